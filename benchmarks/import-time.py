@@ -0,0 +1,168 @@
+#!/usr/bin/python
+
+'''
+    Import time of the scripts, against regressions.
+
+    Every script is loaded as a module (its `__main__` block is not run) in
+    a fresh interpreter, and the time and the heavy packages it imported are
+    reported. Heavy packages (astropy, astroquery, scipy, ...) belong inside
+    the code paths that need them, so none of them may be imported at module
+    load, and no script may take longer than the budget. Quick commands are
+    also started with `--help`. Last, all modules are loaded at once
+    through the package (`import scripts`), within the same budget.
+
+    Exits with 1 if any check fails.
+
+    Usage:
+        python import-time.py [--budget 0.5] [--startup-budget 0.8]
+            [--repeat 3] [--output import-time.json]
+'''
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import subprocess
+from collections import OrderedDict
+
+scripts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'scripts')
+
+# not to be imported at module load.
+heavy_packages = ['astropy', 'astroquery', 'scipy', 'matplotlib', 'dl',
+        'pandas', 'requests', 'pyarrow']
+
+# python2, with panstamps.
+skip_scripts = ['get-image-stamps-ps1.py']
+
+# commands to start with `--help`.
+quick_commands = ['print-table.py', 'generate-new-list.py',
+        'check-consistency.py', 'resultsdb.py', 'assign-stamps.py',
+        'sort-images.py']
+
+loader = '''
+import sys, time, json, importlib.util
+t_start = time.time()
+spec = importlib.util.spec_from_file_location('_loaded', sys.argv[1])
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print(json.dumps([time.time() - t_start, sorted(sys.modules)]))
+'''
+
+def import_time(script, repeat=3):
+    '''
+    Fastest import time of a script (in seconds) and the packages it
+    imported, or (None, error message).
+    '''
+    best, modules = None, None
+    for i_run in range(repeat):
+        proc = subprocess.run([sys.executable, '-c', loader, script],
+                cwd=scripts_dir, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, universal_newlines=True)
+        if proc.returncode:
+            return None, proc.stderr.strip().splitlines()[-1]
+        elapsed, modules = json.loads(proc.stdout.strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best, sorted(set([w.split('.')[0] for w in modules]))
+
+package_loader = '''
+import sys, time, json
+t_start = time.time()
+import scripts
+for name in sys.argv[1:]:
+    getattr(scripts, name)
+print(json.dumps([time.time() - t_start, sorted(sys.modules)]))
+'''
+
+def package_time(names, repeat=3):
+    '''
+    Fastest time to import the package and load the modules `names`
+    through it, and the packages imported, or (None, error message).
+    '''
+    best, modules = None, None
+    for i_run in range(repeat):
+        proc = subprocess.run([sys.executable, '-c', package_loader] + names,
+                cwd=os.path.dirname(scripts_dir), stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, universal_newlines=True)
+        if proc.returncode:
+            return None, proc.stderr.strip().splitlines()[-1]
+        elapsed, modules = json.loads(proc.stdout.strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best, sorted(set([w.split('.')[0] for w in modules]))
+
+def startup_time(script, repeat=3):
+    ''' Fastest wall time of `python SCRIPT --help`, with the interpreter '''
+    best = None
+    for i_run in range(repeat):
+        t_start = time.time()
+        subprocess.run([sys.executable, script, '--help'], cwd=scripts_dir,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.time() - t_start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float, default=0.5,
+            help='Largest import time of a script, seconds.')
+    parser.add_argument('--startup-budget', type=float, default=0.8,
+            help='Largest wall time of quick commands with --help.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    results, failed = OrderedDict(), list()
+    fmtstr = '{:28} {:>9} {:>10}  {}'
+    print(fmtstr.format('Script', 'Import_s', 'Startup_s', 'Heavy'))
+    for file_i in sorted(glob.glob(os.path.join(scripts_dir, '*.py'))):
+        script_i = os.path.basename(file_i)
+        if (script_i in skip_scripts) or script_i.startswith('_'):
+            continue # and the package, loaded at the end.
+
+        elapsed_i, modules_i = import_time(script_i, repeat=args.repeat)
+        if elapsed_i is None: # missing dependencies, not checked.
+            print(fmtstr.format(script_i, '-', '-', 'error: ' + modules_i))
+            results[script_i] = OrderedDict([('error', modules_i)])
+            continue
+        heavy_i = [w for w in heavy_packages if w in modules_i]
+        startup_i = startup_time(script_i, repeat=args.repeat) \
+                if script_i in quick_commands else None
+
+        if heavy_i or (elapsed_i > args.budget) or \
+                ((startup_i or 0.) > args.startup_budget):
+            failed.append(script_i)
+        print(fmtstr.format(script_i, '%.3f' % elapsed_i,
+                '%.3f' % startup_i if startup_i is not None else '',
+                ' '.join(heavy_i)) + ('  FAILED' if failed[-1:] == \
+                [script_i] else ''))
+        results[script_i] = OrderedDict([('import_s', elapsed_i),
+                ('startup_s', startup_i), ('heavy', heavy_i)])
+
+    # all modules through the package.
+    names = [w[:-3].replace('-', '_') for w in results \
+            if 'error' not in results[w]]
+    elapsed, modules = package_time(names, repeat=args.repeat)
+    if elapsed is None:
+        print(fmtstr.format('(package)', '-', '-', 'error: ' + modules))
+        failed.append('(package)')
+    else:
+        heavy = [w for w in heavy_packages if w in modules]
+        if heavy or (elapsed > args.budget):
+            failed.append('(package)')
+        print(fmtstr.format('(package)', '%.3f' % elapsed, '',
+                ' '.join(heavy)) + ('  FAILED' if failed[-1:] == \
+                ['(package)'] else ''))
+        results['(package)'] = OrderedDict([('import_s', elapsed),
+                ('startup_s', None), ('heavy', heavy)])
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+    if failed:
+        print('Failed:', ', '.join(failed))
+        sys.exit(1)
+
+# EOF
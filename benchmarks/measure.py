@@ -0,0 +1,45 @@
+#!/usr/bin/python
+
+'''
+    Run a script and record its peak memory, for run-benchmarks.py.
+
+    The peak resident set of a child process (`ru_maxrss`) also counts the
+    memory of the parent it was forked from, so the high-water mark is
+    read by the script's own process instead, when it exits.
+
+    Usage:
+        python measure.py OUTPUT.json SCRIPT [ARGS...]
+'''
+
+import os
+import sys
+import json
+import atexit
+import runpy
+import resource
+
+def peak_rss_mb():
+    ''' High-water mark of resident memory of this process, in MB '''
+    if os.path.isfile('/proc/self/status'): # Linux, reset by exec.
+        with open('/proc/self/status', 'r') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def write_usage(filename):
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with open(filename, 'w') as fp:
+        json.dump(dict(max_rss_mb=peak_rss_mb(),
+                children_max_rss_mb=children.ru_maxrss / 1024.), fp)
+
+if __name__ == '__main__':
+
+    output, script = sys.argv[1], os.path.abspath(sys.argv[2])
+    atexit.register(write_usage, output)
+
+    sys.argv = sys.argv[2:]
+    sys.path[0] = os.path.dirname(script)
+    runpy.run_path(script, run_name='__main__')
+
+# EOF
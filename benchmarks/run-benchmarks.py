@@ -0,0 +1,247 @@
+#!/usr/bin/python
+
+'''
+    End-to-end benchmark of the pipeline, offline.
+
+    Generates a synthetic OSC tree and fields of stars and galaxies, starts
+    local stand-ins of the remote services (stubs.py) with the given
+    latency, then runs every stage in a scratch directory and reports wall
+    time, CPU time, peak memory (RSS) and throughput (events per second).
+
+    Stages whose client package is not installed (astroquery for Vizier,
+    astro-datalab for Data Lab) are replaced by writing their output
+    directly from the synthetic fields, and are reported as 'synthetic'.
+
+    Usage:
+        python run-benchmarks.py [--events 1000] [--latency 0.05]
+            [--service-latency vizier=0.5] [--stages ...] [--fits]
+            [--workdir DIR] [--output benchmark-results.json] [--profile]
+            [--stream]
+
+    With `--profile`, stages are profiled (see scripts/profiling.py), and
+    cProfile stats are written into the scratch directory. With `--stream`,
+    the searches and sort-nearby-sources write JSON Lines, one event at a
+    time.
+'''
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import argparse
+import importlib.util
+import subprocess
+from collections import OrderedDict
+
+import synthetic
+import stubs
+
+scripts_dir = os.path.abspath(synthetic.scripts_dir)
+measure_py = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        'measure.py')
+
+# stage: (command, client package needed)
+stages = OrderedDict([
+    ('find-hostless-events', (['find-hostless-events.py'], None)),
+    ('search-vizier', (['search-vizier.py'], 'astroquery')),
+    ('search-datalab', (['search-datalab.py'], 'dl')),
+    ('sort-nearby-sources', (['sort-nearby-sources.py'], None)),
+    ('get-image-stamps', (['get-image-stamps.py', 'run'], None)),
+    ('get-image-stamps-fits', (['get-image-stamps.py', 'runfits'], None)),
+    ('render-stamps', (['render-stamps.py', 'run'], None)),
+    ('annotate-stamps', (['annotate-stamps.py', 'runls'], None)),
+    ('prescreen-stamps', (['prescreen-stamps.py', 'run'], None)),
+    ('extract-sources', (['extract-sources.py', 'run'], None)),
+    ('print-table', (['print-table.py', '--output', 'table.txt'], None)),
+])
+
+# stages with `--stream`.
+stream_stages = ['search-vizier', 'search-datalab', 'sort-nearby-sources']
+
+# FITS cutouts and local rendering (`--fits`) replace JPEG cutouts.
+fits_stages = ['get-image-stamps-fits', 'render-stamps']
+
+def run_stage(name, cmd, workdir, env, stdin=None):
+
+    '''
+    Run a stage as a child process.
+
+    Returns
+    -------
+    OrderedDict of 'status', 'wall_s', 'cpu_s' and 'max_rss_mb' (largest
+    resident set of the process and its waited-for children, measured
+    by measure.py).
+    '''
+
+    log = open(os.path.join(workdir, 'log-%s.txt' % name), 'wb')
+    usage_file = os.path.join(workdir, 'usage-%s.json' % name)
+    t_start = time.time()
+    proc = subprocess.Popen([sys.executable, measure_py, usage_file] + cmd,
+            cwd=workdir, env=env, stdin=subprocess.PIPE,
+            stdout=log, stderr=subprocess.STDOUT)
+    if stdin:
+        proc.stdin.write(stdin.encode('utf-8'))
+    proc.stdin.close()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.time() - t_start
+    log.close()
+
+    max_rss = float('nan')
+    if os.path.isfile(usage_file):
+        with open(usage_file, 'r') as fp:
+            usage = json.load(fp)
+        max_rss = max(usage['max_rss_mb'], usage['children_max_rss_mb'])
+
+    return OrderedDict([
+        ('status', 'ok' if proc.returncode == 0 \
+                else 'failed (%d)' % proc.returncode),
+        ('wall_s', wall),
+        ('cpu_s', rusage.ru_utime + rusage.ru_stime),
+        ('max_rss_mb', max_rss),
+    ])
+
+def count_events(workdir):
+    ''' Number of candidate events (0 if not yet selected) '''
+    filename = os.path.join(workdir, 'candidate-events.json')
+    if not os.path.isfile(filename):
+        return 0
+    with open(filename, 'r') as fp:
+        return len(json.load(fp))
+
+def print_report(results, fp=None):
+    fp = fp or sys.stdout
+    fmtstr = '{:24} {:>12} {:>9} {:>9} {:>9} {:>10} {:>9}'
+    fp.write(fmtstr.format('Stage', 'Status', 'Wall_s', 'CPU_s', 'RSS_MB',
+            'Events/s', 'Requests') + '\n')
+    for name_i, res_i in results.items():
+        fp.write(fmtstr.format(name_i, res_i['status'][:12],
+                '%.2f' % res_i['wall_s'], '%.2f' % res_i['cpu_s'],
+                '%.1f' % res_i['max_rss_mb'],
+                '%.1f' % res_i['events_per_s'], res_i['requests']) + '\n')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=1000,
+            help='Number of events in the synthetic OSC tree.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency', type=float, default=0.05,
+            help='Latency of all services, seconds.')
+    parser.add_argument('--service-latency', action='append',
+            help='Latency of one service, as name=seconds.')
+    parser.add_argument('--stages', nargs='+', choices=list(stages),
+            help='Stages to run (default: all, in order).')
+    parser.add_argument('--fits', action='store_true',
+            help='FITS cutouts rendered locally instead of JPEG cutouts.')
+    parser.add_argument('--workdir', default=None,
+            help='Scratch directory (default: temporary, removed).')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--profile', action='store_true',
+            help='Profile stages, cProfile stats in the scratch directory.')
+    parser.add_argument('--stream', action='store_true',
+            help='Stream events through JSON Lines files.')
+    args = parser.parse_args()
+
+    # stages to run.
+    if args.stages:
+        run_stages = [w for w in stages if w in args.stages]
+    elif args.fits:
+        run_stages = [w for w in stages if w != 'get-image-stamps']
+    else:
+        run_stages = [w for w in stages if w not in fits_stages]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='sforzando-bench-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    for dir_i in ['image-stamps', 'annotated']:
+        if not os.path.isdir(os.path.join(workdir, dir_i)):
+            os.makedirs(os.path.join(workdir, dir_i))
+
+    # synthetic data.
+    t_start = time.time()
+    events = synthetic.write_osc_tree(os.path.join(workdir,
+            'Transient-catalogs', 'supernovae'), args.events, seed=args.seed)
+    fields = synthetic.make_fields(events, seed=args.seed)
+    synthetic.save_fields(fields, os.path.join(workdir, 'fields.npz'))
+    print('Synthetic data: %d events, %d objects (%.1f s)' \
+            % (len(events), fields['ra'].size, time.time() - t_start))
+
+    # local services.
+    server = stubs.serve(fields, latency=stubs.parse_latency(args.latency,
+            args.service_latency))
+    env = dict(os.environ)
+    env.update(stubs.service_env(server))
+    env['HOME'] = workdir # no shared caches or tokens.
+    env['PYTHONPATH'] = scripts_dir
+
+    results = OrderedDict()
+    for name_i in run_stages:
+        cmd_i, package_i = stages[name_i]
+        if args.stream and (name_i in stream_stages):
+            cmd_i = cmd_i + ['--stream']
+        metrics_i = os.path.join(workdir, 'metrics-%s.json' % name_i)
+        env['SFORZANDO_METRICS'] = metrics_i
+        if args.profile:
+            env['SFORZANDO_PROFILE'] = os.path.join(workdir,
+                    'profile-%s.prof' % name_i)
+        n_requests = sum([v for k, v in server.stats.items() if k != 'lock'])
+
+        if package_i and importlib.util.find_spec(package_i) is None:
+            t_start = time.time()
+            with open(os.path.join(workdir, 'candidate-events.json')) as fp:
+                cand_events = json.load(fp, object_pairs_hook=OrderedDict)
+            if name_i == 'search-vizier':
+                synthetic.write_vizier_hosts(fields, cand_events,
+                        os.path.join(workdir, 'candidate-hosts.json'))
+            else:
+                synthetic.write_datalab_hosts(fields, cand_events,
+                        os.path.join(workdir, 'candidate-hosts-dl.json'))
+            res_i = OrderedDict([('status', 'synthetic'),
+                    ('wall_s', time.time() - t_start), ('cpu_s', 0.),
+                    ('max_rss_mb', 0.)])
+        else:
+            res_i = run_stage(name_i, [os.path.join(scripts_dir, cmd_i[0])] \
+                    + cmd_i[1:], workdir, env,
+                    stdin='bench\nbench\n' if name_i == 'search-datalab' \
+                    else None)
+
+        N_i = args.events if name_i == 'find-hostless-events' \
+                else count_events(workdir)
+        res_i['events'] = N_i
+        res_i['events_per_s'] = N_i / max(res_i['wall_s'], 1.e-9)
+        res_i['requests'] = sum([v for k, v in server.stats.items() \
+                if k != 'lock']) - n_requests
+        if os.path.isfile(metrics_i):
+            with open(metrics_i, 'r') as fp:
+                res_i['endpoints'] = json.load(fp)['endpoints']
+        results[name_i] = res_i
+        print('%-24s %s (%.2f s)' % (name_i, res_i['status'],
+                res_i['wall_s']))
+        if res_i['status'].startswith('failed'):
+            print('    see', os.path.join(workdir, 'log-%s.txt' % name_i))
+            break
+
+    server.shutdown()
+
+    print()
+    print_report(results)
+
+    summary = OrderedDict([
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('events', args.events),
+        ('seed', args.seed),
+        ('latency', stubs.parse_latency(args.latency,
+                args.service_latency)),
+        ('python', sys.version.split()[0]),
+        ('stages', results),
+    ])
+    with open(args.output, 'w') as fp:
+        json.dump(summary, fp, indent=4)
+
+    if not args.workdir:
+        shutil.rmtree(workdir)
+
+# EOF
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+
+'''
+    Local stand-ins for remote services, serving synthetic fields.
+
+    One HTTP server answers, by path:
+        /viz-bin/votable           Vizier (astroquery), VOTable
+        /auth, /auth/login         Data Lab authentication
+        /query, /query/query       Data Lab SQL queries, CSV
+        /viewer/jpeg-cutout        Legacy Survey Sky Viewer, JPEG
+        /viewer/fits-cutout        Legacy Survey Sky Viewer, FITS
+        /dr14/SkyServerWS/...      SkyServer image cutouts, JPEG
+
+    Every response is delayed by the latency of its service. Point the
+    scripts to the server with (see `netstats.service_url`):
+        SFORZANDO_VIZIER_URL, SFORZANDO_DATALAB_URL,
+        SFORZANDO_LEGACYSURVEY_URL, SFORZANDO_SKYSERVER_URL
+
+    Usage:
+        python stubs.py fields.npz [--port 8642] [--latency 0.1]
+            [--service-latency vizier=0.5 ...]
+'''
+
+import re
+import sys
+import time
+import threading
+import argparse
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote_plus
+
+import synthetic
+
+services = ['vizier', 'datalab', 'legacysurvey', 'skyserver']
+
+box_re = re.compile(r'ra\s+BETWEEN\s+(\S+)\s+AND\s+(\S+)\s+'
+        r'AND\s+dec\s+BETWEEN\s+(\S+)\s+AND\s+(\S+)', re.I)
+table_re = re.compile(r'FROM\s+(\S+)', re.I)
+
+def parse_vizier_script(body):
+    ''' Keywords of a Vizier query script (astroquery), as a dict. '''
+    kw = dict()
+    for line in body.splitlines():
+        key, _, value = line.partition('=')
+        kw[key.strip()] = value.strip()
+    return kw
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    # set by `serve`
+    fields, latency = None, dict()
+    stats = None
+
+    def log_message(self, *args):
+        pass # quiet.
+
+    def send(self, body, status=200, ctype='text/plain'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, location):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def delay(self, service):
+        with self.stats['lock']:
+            self.stats[service] = self.stats.get(service, 0) + 1
+        time.sleep(self.latency.get(service, 0.))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = re.sub('/+', '/', url.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            self.route(path, query, body=None)
+        except Exception as err:
+            self.send('Error: %s' % err, status=500)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        path = re.sub('/+', '/', url.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        try:
+            self.route(path, dict(), body=body)
+        except Exception as err:
+            self.send('Error: %s' % err, status=500)
+
+    def route(self, path, query, body):
+
+        # Vizier
+        if path.startswith('/viz-bin/votable'):
+            self.delay('vizier')
+            kw = parse_vizier_script(body if body is not None \
+                    else unquote_plus(self.path.partition('?')[2]))
+            center = re.match(r'([\d.]+)([+-][\d.]+)', kw.get('-c', ''))
+            ra, dec = float(center.group(1)), float(center.group(2))
+            if '-c.rs' in kw: # radius in arcsec, arcmin or degrees.
+                radius = float(kw['-c.rs'])
+            elif '-c.rm' in kw:
+                radius = float(kw['-c.rm']) * 60.
+            else:
+                radius = float(kw.get('-c.rd', 1. / 60.)) * 3.6e3
+            row_limit = kw.get('-out.max', '50')
+            row_limit = None if row_limit == 'unlimited' else int(row_limit)
+            tables = OrderedDict()
+            for cat in kw.get('-source', '').split(','):
+                if cat in synthetic.vizier_tables:
+                    tables[cat] = (synthetic.vizier_columns(cat),
+                            synthetic.vizier_rows(self.fields, cat, ra, dec,
+                            radius, row_limit=row_limit))
+            return self.send(synthetic.vizier_votable(tables),
+                    ctype='text/xml')
+
+        # Data Lab
+        if path in ('/auth', '/query', '/auth/', '/query/'):
+            return self.send('Hello world!')
+        if path.startswith('/auth/'):
+            self.delay('datalab')
+            if path == '/auth/login':
+                return self.send('%s.1.1.$1$stubtoken' \
+                        % query.get('username', 'anonymous'))
+            return self.send('True')
+        if path == '/query/query':
+            self.delay('datalab')
+            sql = query.get('sql', '')
+            box, table = box_re.search(sql), table_re.search(sql)
+            if not (box and table) \
+                    or table.group(1) not in synthetic.datalab_tables:
+                return self.send('Unsupported query.', status=400)
+            return self.send(synthetic.datalab_csv(self.fields,
+                    table.group(1), *map(float, box.groups())),
+                    ctype='text/csv')
+
+        # Legacy Survey Sky Viewer.
+        if path == '/blank.jpg':
+            return self.send(synthetic.render_jpeg(self.fields, 0., -90.,
+                    16, 1.), ctype='image/jpeg')
+        if path in ('/viewer/jpeg-cutout', '/viewer/fits-cutout'):
+            self.delay('legacysurvey')
+            ra, dec = float(query['ra']), float(query['dec'])
+            layer = query.get('layer', 'ls-dr67')
+            if not synthetic.in_footprint(dec,
+                    synthetic.viewer_layers.get(layer, (-90., 90.))):
+                return self.redirect('/blank.jpg')
+            if path.endswith('jpeg-cutout'):
+                pixscale = 0.262 * 2. ** (14 - int(query.get('zoom', 14)))
+                return self.send(synthetic.render_jpeg(self.fields, ra, dec,
+                        int(query.get('size', 256)), pixscale),
+                        ctype='image/jpeg')
+            return self.send(synthetic.render_fits(self.fields, ra, dec,
+                    int(query.get('size', 256)),
+                    float(query.get('pixscale', 0.262)),
+                    bands=query.get('bands', 'grz')),
+                    ctype='application/fits')
+
+        # SkyServer
+        if path.startswith('/dr14/SkyServerWS/ImgCutout/getjpeg'):
+            self.delay('skyserver')
+            return self.send(synthetic.render_jpeg(self.fields,
+                    float(query['ra']), float(query['dec']),
+                    int(query.get('width', 400)),
+                    float(query.get('scale', 0.4))), ctype='image/jpeg')
+
+        self.send('Not found.', status=404)
+
+def serve(fields, host='127.0.0.1', port=0, latency=None):
+
+    '''
+    Start the stand-in server in a background thread.
+
+    Parameters
+    ----------
+    fields : dict
+        Synthetic fields (`synthetic.make_fields`).
+
+    port : int
+        Port, 0 for any free port.
+
+    latency : dict
+        Delay of responses per service, in seconds.
+
+    Returns
+    -------
+    server : ThreadingHTTPServer
+        Call `server.shutdown()` to stop. `server.base_url` is its URL,
+        `server.stats` the number of requests per service.
+    '''
+
+    handler = type('Handler', (StubHandler,), dict(fields=fields,
+            latency=dict(latency or {}), stats=dict(lock=threading.Lock())))
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.base_url = 'http://%s:%d' % server.server_address[:2]
+    server.stats = handler.stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def service_env(server):
+    ''' Environment variables pointing the scripts to the server. '''
+    return {'SFORZANDO_%s_URL' % w.upper(): server.base_url for w in services}
+
+def parse_latency(default, overrides):
+    ''' Latency per service from `name=seconds` strings. '''
+    latency = {w: default for w in services}
+    for item in overrides or []:
+        name, _, value = item.partition('=')
+        if name not in services:
+            raise ValueError('Unknown service `%s`.' % name)
+        latency[name] = float(value)
+    return latency
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fields', help='Fields (.npz) from synthetic.py')
+    parser.add_argument('--port', type=int, default=8642)
+    parser.add_argument('--latency', type=float, default=0.,
+            help='Latency of all services, seconds.')
+    parser.add_argument('--service-latency', action='append',
+            help='Latency of one service, as name=seconds.')
+    args = parser.parse_args()
+
+    server = serve(synthetic.load_fields(args.fields), port=args.port,
+            latency=parse_latency(args.latency, args.service_latency))
+    for key, value in service_env(server).items():
+        print('export %s=%s' % (key, value))
+    try:
+        while True:
+            time.sleep(3600.)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+# EOF
@@ -0,0 +1,433 @@
+#!/usr/bin/python
+
+'''
+    Synthetic inputs for benchmarks.
+
+    - An OSC-like tree of event files (`write_osc_tree`), for
+      find-hostless-events.py.
+    - A field of stars and galaxies around every event (`make_fields`),
+      with realistic surface densities and magnitude counts, and a host
+      galaxy for most events.
+    - Vizier tables, Data Lab CSV and image cutouts (JPEG/FITS) made from
+      these fields, either served by the stand-ins in stubs.py or written
+      directly (`write_vizier_hosts`, `write_datalab_hosts`) when the client
+      package of a service is not installed.
+'''
+
+import os
+import sys
+import io
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+scripts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'scripts')
+sys.path.insert(0, scripts_dir)
+
+from catalogs import vizier_cats, radec_cols, srcid_cols
+
+# surface density (per deg^2, brighter than `mag_max`) of stars and galaxies
+star_density, galaxy_density = 8000., 25000.
+mag_min, mag_max = 12., 23.5
+
+# radius of synthetic fields, in arcsec.
+field_radius = 150.
+
+# Vizier catalogs: object kinds (0: star, 1: galaxy), magnitude limit and
+# declination range.
+vizier_tables = OrderedDict([
+    ('II/246/out',           ((0, 1), 16.5, (-90., 90.))),
+    ('VII/233/xsc',          ((1,),   14.5, (-90., 90.))),
+    ('II/349/ps1',           ((0, 1), 22.0, (-30., 90.))),
+    ('VII/237/pgc',          ((1,),   16.0, (-90., 90.))),
+    ('V/147/sdss12',         ((0, 1), 22.5, (-10., 90.))),
+    ('VII/259/6dfgs',        ((1,),   13.0, (-90.,  0.))),
+    ('I/345/gaia2',          ((0,),   20.7, (-90., 90.))),
+    ('J/ApJS/199/26/table3', ((1,),   13.5, (-90., 90.))),
+    ('VII/62A/mcg',          ((1,),   15.0, (-90., 90.))),
+    ('VII/155/rc3',          ((1,),   14.0, (-90., 90.))),
+])
+
+# Data Lab tables (galaxies only).
+datalab_tables = OrderedDict([
+    ('des_dr1.galaxies', (23.0, (-65.,  5.))),
+    ('ls_dr7.galaxy',    (23.0, (-20., 32.))),
+])
+
+# Sky Viewer layers: declination range.
+viewer_layers = OrderedDict([
+    ('decals-dr7',    (-20., 32.)),
+    ('mzls+bass-dr6', ( 32., 90.)),
+    ('des-dr1',       (-65.,  5.)),
+    ('sdssco',        (-10., 90.)),
+    ('ls-dr67',       (-20., 90.)),
+    ('decals-dr5',    (-20., 32.)),
+    ('unwise-neo',    (-90., 90.)),
+])
+
+def sexagesimal(value, hours=False, sep=':', precision=2):
+    ''' Degrees into a sexagesimal string. '''
+    sign = '-' if value < 0. else ('' if hours else '+')
+    value = abs(value) / (15. if hours else 1.)
+    d = int(value)
+    m = int((value - d) * 60.)
+    s = ((value - d) * 60. - m) * 60.
+    s = round(s, precision)
+    if s >= 60.:
+        s, m = s - 60., m + 1
+    if m >= 60:
+        m, d = m - 60, d + 1
+    width = 3 + precision if precision else 2
+    return '%s%02d%s%02d%s%0*.*f' % (sign, d, sep, m, sep,
+            width, precision, s)
+
+def sample_mags(rng, n, slope):
+    ''' Magnitudes with number counts N(<m) ~ 10^(slope m) '''
+    u = rng.uniform(size=n)
+    a, b = 10. ** (slope * mag_min), 10. ** (slope * mag_max)
+    return np.log10(a + u * (b - a)) / slope
+
+def write_osc_tree(root, N_events, seed=42, events_per_dir=500):
+
+    '''
+    Write an OSC-like tree, one JSON file per event.
+
+    About 80% of the events pass the selection of find-hostless-events.py,
+    others have z > 0.1, no type, only a 'Candidate' type or no
+    coordinates.
+
+    Returns
+    -------
+    events : list of tuple
+        (name, ra_deg, dec_deg, redshift) of all events.
+    '''
+
+    rng = np.random.RandomState(seed)
+    ra = rng.uniform(0., 360., N_events)
+    dec = np.degrees(np.arcsin(rng.uniform(-1., 1., N_events)))
+    zred = rng.uniform(0.005, 0.1, N_events)
+    kind = rng.choice(5, N_events, p=[0.8, 0.08, 0.04, 0.04, 0.04])
+    zred[kind == 1] += 0.1
+
+    types = ['Ia', 'II', 'Ib/c', 'IIn', 'SLSN-I', 'TDE']
+    events = list()
+    for i in range(N_events):
+        name_i = 'SYN%07d' % i
+        dir_i = os.path.join(root, 'batch-%03d' % (i // events_per_dir))
+        if not os.path.isdir(dir_i):
+            os.makedirs(dir_i)
+        info_i = OrderedDict([('name', name_i), ('sources', [
+                dict(name='Synthetic', alias='1')])])
+        if kind[i] != 4:
+            info_i['ra'] = [dict(value=sexagesimal(ra[i], hours=True),
+                    source='1', u_value='hours')]
+            info_i['dec'] = [dict(value=sexagesimal(dec[i], precision=1),
+                    source='1', u_value='degrees')]
+        info_i['redshift'] = [dict(value='%.5f' % zred[i], source='1')]
+        if kind[i] == 3:
+            info_i['claimedtype'] = [dict(value='Candidate', source='1')]
+        elif kind[i] != 2:
+            info_i['claimedtype'] = [dict(value=types[rng.randint(6)],
+                    source='1')]
+        with open(os.path.join(dir_i, name_i + '.json'), 'w') as fp:
+            json.dump({name_i: info_i}, fp)
+        events.append((name_i, ra[i], dec[i], zred[i]))
+
+    return events
+
+def make_fields(events, seed=42, host_fraction=0.7):
+
+    '''
+    Stars and galaxies around every event.
+
+    Returns
+    -------
+    fields : dict of ndarray
+        'ra', 'dec' (deg), 'kind' (0: star, 1: galaxy), 'mag', 'size'
+        (asec), 'pmra', 'pmdec', 'e_pm' (mas/yr) and 'objid', sorted by
+        declination.
+    '''
+
+    from astropy.cosmology import WMAP9 as cosmo
+
+    rng = np.random.RandomState(seed)
+    area = np.pi * (field_radius / 3.6e3) ** 2
+    cols = OrderedDict([(w, list()) for w in \
+            ('ra', 'dec', 'kind', 'mag', 'size')])
+
+    kpc_per_asec = cosmo.kpc_proper_per_arcmin( \
+            np.array([w[3] for w in events])).value / 60.
+
+    for i_event, (name_i, ra_i, dec_i, zred_i) in enumerate(events):
+        for kind_j, density_j, slope_j in \
+                ((0, star_density, 0.2), (1, galaxy_density, 0.35)):
+            n_j = rng.poisson(density_j * area)
+            r_j = field_radius * np.sqrt(rng.uniform(size=n_j))
+            t_j = rng.uniform(0., 2. * np.pi, n_j)
+            cols['ra'].append(ra_i + r_j * np.cos(t_j) / 3.6e3 \
+                    / np.cos(np.radians(dec_i)))
+            cols['dec'].append(dec_i + r_j * np.sin(t_j) / 3.6e3)
+            cols['kind'].append(np.full(n_j, kind_j))
+            cols['mag'].append(sample_mags(rng, n_j, slope_j))
+            cols['size'].append(np.full(n_j, 0.6) if kind_j == 0 \
+                    else rng.uniform(0.8, 3., n_j))
+
+        # host galaxy within 10 kpc.
+        if rng.uniform() < host_fraction:
+            r_j = rng.uniform(0.5, 10.) / kpc_per_asec[i_event]
+            t_j = rng.uniform(0., 2. * np.pi)
+            cols['ra'].append([ra_i + r_j * np.cos(t_j) / 3.6e3 \
+                    / np.cos(np.radians(dec_i))])
+            cols['dec'].append([dec_i + r_j * np.sin(t_j) / 3.6e3])
+            cols['kind'].append([1])
+            cols['mag'].append([rng.uniform(13., 19.)])
+            cols['size'].append([rng.uniform(3., 8.)])
+
+    fields = {k: np.concatenate(v) for k, v in cols.items()}
+    fields['ra'] %= 360.
+    fields['dec'] = np.clip(fields['dec'], -90., 90.)
+    N = fields['ra'].size
+    fields['pmra'] = np.where(fields['kind'] == 0,
+            rng.normal(0., 8., N), rng.normal(0., 0.3, N))
+    fields['pmdec'] = np.where(fields['kind'] == 0,
+            rng.normal(0., 8., N), rng.normal(0., 0.3, N))
+    fields['e_pm'] = rng.uniform(0.1, 1., N)
+
+    order = np.argsort(fields['dec'], kind='stable')
+    fields = {k: v[order] for k, v in fields.items()}
+    fields['objid'] = np.arange(N, dtype='i8') + 1000000
+    return fields
+
+def save_fields(fields, filename):
+    np.savez(filename, **fields)
+
+def load_fields(filename):
+    with np.load(filename) as data:
+        return {k: data[k] for k in data.files}
+
+def select_box(fields, ra_min, ra_max, dec_min, dec_max):
+    ''' Indices of objects within a box (R.A. may wrap around) '''
+    i0, i1 = np.searchsorted(fields['dec'], [dec_min, dec_max])
+    ra = fields['ra'][i0:i1]
+    if ra_min < 0. or ra_max > 360.:
+        ok = ((ra - ra_min) % 360.) <= (ra_max - ra_min)
+    else:
+        ok = (ra >= ra_min) & (ra <= ra_max)
+    return np.flatnonzero(ok) + i0
+
+def select_cone(fields, ra, dec, radius):
+    ''' Indices of objects within `radius` (arcsec), sorted by distance. '''
+    r_deg = radius / 3.6e3
+    cos_d = max(np.cos(np.radians(dec)), 1.e-6)
+    idx = select_box(fields, ra - r_deg / cos_d, ra + r_deg / cos_d,
+            dec - r_deg, dec + r_deg)
+    dra = ((fields['ra'][idx] - ra + 180.) % 360. - 180.) * cos_d
+    ddec = fields['dec'][idx] - dec
+    dist = np.hypot(dra, ddec)
+    ok = dist <= r_deg
+    return idx[ok][np.argsort(dist[ok], kind='stable')]
+
+def in_footprint(dec, dec_range):
+    return dec_range[0] <= dec <= dec_range[1]
+
+def vizier_columns(cat):
+
+    '''
+    Column layout of a Vizier table, as used by sort-nearby-sources.py:
+    positions and IDs at the indices of `radec_cols` and `srcid_cols`,
+    proper motions of Gaia in columns 7 to 10.
+
+    Returns
+    -------
+    list of (name, kind), kind is one of 'ra', 'dec', 'id', 'pmra',
+    'e_pmra', 'pmdec', 'e_pmdec' or 'mag'.
+    '''
+
+    (i_ra, i_dec), units = radec_cols[cat]
+    layout = {i_ra: ('RAJ2000', 'ra'), i_dec: ('DEJ2000', 'dec'),
+            srcid_cols[cat]: ('ID', 'id')}
+    if 'gaia' in cat:
+        layout.update({7: ('pmRA', 'pmra'), 8: ('e_pmRA', 'e_pmra'),
+                9: ('pmDE', 'pmdec'), 10: ('e_pmDE', 'e_pmdec')})
+    N_cols = max(layout) + 2
+    return [layout.get(i, ('mag%d' % i, 'mag')) for i in range(N_cols)]
+
+def vizier_rows(fields, cat, ra, dec, radius, row_limit=None):
+    ''' Rows of a Vizier table in a cone, as lists (None for nulls) '''
+
+    kinds, mag_lim, dec_range = vizier_tables[cat]
+    if not in_footprint(dec, dec_range):
+        return list()
+    idx = select_cone(fields, ra, dec, radius)
+    idx = idx[np.isin(fields['kind'][idx], kinds) \
+            & (fields['mag'][idx] < mag_lim)]
+    if row_limit:
+        idx = idx[:row_limit]
+
+    units = radec_cols[cat][1]
+    rows = list()
+    for i in idx:
+        row = list()
+        for name_j, kind_j in vizier_columns(cat):
+            if kind_j == 'ra':
+                row.append(fields['ra'][i] if units[0] == 'deg' \
+                        else sexagesimal(fields['ra'][i], hours=True,
+                        sep=' ', precision=1))
+            elif kind_j == 'dec':
+                row.append(fields['dec'][i] if units[1] == 'deg' \
+                        else sexagesimal(fields['dec'][i], sep=' ',
+                        precision=0))
+            elif kind_j == 'id':
+                row.append(int(fields['objid'][i]))
+            elif kind_j in ('pmra', 'pmdec'):
+                row.append(float(fields[kind_j][i]))
+            elif kind_j in ('e_pmra', 'e_pmdec'):
+                row.append(float(fields['e_pm'][i]))
+            else:
+                row.append(float(fields['mag'][i]))
+        rows.append(row)
+    return rows
+
+def vizier_votable(tables):
+
+    '''
+    VOTable document of Vizier tables.
+
+    Parameters
+    ----------
+    tables : OrderedDict
+        {catalog: (columns, rows)}
+    '''
+
+    xml = ['<?xml version="1.0" encoding="UTF-8"?>',
+           '<VOTABLE version="1.3" '
+           'xmlns="http://www.ivoa.net/xml/VOTable/v1.3">']
+    for cat, (columns, rows) in tables.items():
+        if not rows:
+            continue
+        xml.append('<RESOURCE name="%s">' % cat)
+        xml.append('<TABLE ID="%s" name="%s">' \
+                % (cat.replace('/', '_'), cat))
+        for (name_j, _), value_j in zip(columns, rows[0]):
+            if isinstance(value_j, str):
+                xml.append('<FIELD name="%s" datatype="char" '
+                           'arraysize="*"/>' % name_j)
+            elif isinstance(value_j, int):
+                xml.append('<FIELD name="%s" datatype="long"/>' % name_j)
+            else:
+                xml.append('<FIELD name="%s" datatype="double"/>' % name_j)
+        xml.append('<DATA><TABLEDATA>')
+        for row in rows:
+            xml.append('<TR>' + ''.join(['<TD>%s</TD>' % (w,) \
+                    for w in row]) + '</TR>')
+        xml.append('</TABLEDATA></DATA></TABLE></RESOURCE>')
+    xml.append('</VOTABLE>')
+    return '\n'.join(xml).encode('utf-8')
+
+def datalab_csv(fields, table, ra_min, ra_max, dec_min, dec_max):
+    ''' Data Lab query result (objid, ra, dec) in a box, as CSV. '''
+    mag_lim, dec_range = datalab_tables[table]
+    lines = ['objid,ra,dec']
+    if in_footprint(0.5 * (dec_min + dec_max), dec_range):
+        idx = select_box(fields, ra_min, ra_max, dec_min, dec_max)
+        idx = idx[(fields['kind'][idx] == 1) & (fields['mag'][idx] < mag_lim)]
+        lines += ['%d,%.7f,%.7f' % (fields['objid'][i], fields['ra'][i],
+                fields['dec'][i]) for i in idx]
+    return '\n'.join(lines)
+
+def render_image(fields, ra, dec, size, pixscale, bands=3, seed=None):
+
+    '''
+    Image of a field: noise and Gaussian profiles of objects.
+
+    Returns
+    -------
+    img : ndarray
+        (bands, size, size) float32 array.
+    '''
+
+    rng = np.random.RandomState(seed)
+    img = rng.normal(0., 0.01, (bands, size, size)).astype('f4')
+    idx = select_cone(fields, ra, dec, size * pixscale * 0.75)
+    cos_d = np.cos(np.radians(dec))
+    yy, xx = np.mgrid[0:size, 0:size]
+    for i in idx:
+        x = (size - 1.) / 2. - ((fields['ra'][i] - ra + 180.) % 360. - 180.) \
+                * cos_d * 3.6e3 / pixscale
+        y = (size - 1.) / 2. - (fields['dec'][i] - dec) * 3.6e3 / pixscale
+        sig = fields['size'][i] / pixscale
+        amp = 10. ** (-0.4 * (fields['mag'][i] - 18.))
+        x0, x1 = int(max(x - 5 * sig, 0)), int(min(x + 5 * sig + 1, size))
+        y0, y1 = int(max(y - 5 * sig, 0)), int(min(y + 5 * sig + 1, size))
+        if x0 >= x1 or y0 >= y1:
+            continue
+        psf = amp * np.exp(-((xx[y0:y1, x0:x1] - x) ** 2 \
+                + (yy[y0:y1, x0:x1] - y) ** 2) / (2. * sig ** 2))
+        for k in range(bands):
+            img[k, y0:y1, x0:x1] += psf * (0.8 + 0.2 * k)
+    return img
+
+def render_jpeg(fields, ra, dec, size, pixscale, quality=90):
+    ''' Image of a field as JPEG bytes. '''
+    from PIL import Image
+    img = render_image(fields, ra, dec, size, pixscale)
+    rgb = np.arcsinh(img[::-1] * 10.) / np.arcsinh(10.)
+    rgb = (np.clip(rgb, 0., 1.) * 255.).astype('u1').transpose(1, 2, 0)
+    fp = io.BytesIO()
+    Image.fromarray(rgb).save(fp, format='JPEG', quality=quality)
+    return fp.getvalue()
+
+def render_fits(fields, ra, dec, size, pixscale, bands='grz'):
+    ''' Image of a field as FITS bytes (one plane per band). '''
+    from astropy.io import fits
+    img = render_image(fields, ra, dec, size, pixscale, bands=len(bands))
+    hdu = fits.PrimaryHDU(img)
+    hdu.header['BANDS'] = bands
+    hdu.header['CRVAL1'], hdu.header['CRVAL2'] = ra, dec
+    hdu.header['CDELT1'] = hdu.header['CDELT2'] = pixscale / 3.6e3
+    fp = io.BytesIO()
+    hdu.writeto(fp)
+    return fp.getvalue()
+
+def search_radius(zred):
+    ''' Search radius of search-vizier.py (30 kpc, at most 120 arcsec) '''
+    from astropy.cosmology import WMAP9 as cosmo
+    try:
+        ksc = cosmo.kpc_proper_per_arcmin(abs(zred)).value / 60.
+        return min(30. / ksc, 120.)
+    except Exception:
+        return 120.
+
+def write_vizier_hosts(fields, cand_events, filename, row_limit=50):
+    ''' candidate-hosts.json as written by search-vizier.py '''
+    from coords import event_coords
+    from jsonio import dump_json
+    hosts = OrderedDict()
+    for event_i, (ra_i, dec_i) in event_coords(cand_events).items():
+        rad_i = search_radius(float(cand_events[event_i]['redshift']))
+        hosts[event_i] = OrderedDict([('search_radius', rad_i)])
+        for cat_j in vizier_cats:
+            rows_j = vizier_rows(fields, cat_j, ra_i, dec_i, rad_i,
+                    row_limit=row_limit)
+            if rows_j:
+                hosts[event_i][cat_j] = rows_j
+    dump_json(hosts, filename, pretty=False)
+
+def write_datalab_hosts(fields, cand_events, filename, box_radius=60.):
+    ''' candidate-hosts-dl.json as written by search-datalab.py '''
+    from coords import event_coords
+    from jsonio import dump_json
+    hosts, r = OrderedDict(), box_radius / 3.6e3
+    for event_i, (ra_i, dec_i) in event_coords(cand_events).items():
+        dra = r / np.cos(np.radians(dec_i))
+        hosts[event_i] = OrderedDict([
+            ('DES', datalab_csv(fields, 'des_dr1.galaxies',
+                    ra_i - dra, ra_i + dra, dec_i - r, dec_i + r)),
+            ('LS', datalab_csv(fields, 'ls_dr7.galaxy',
+                    ra_i - dra, ra_i + dra, dec_i - r, dec_i + r)),
+        ])
+    dump_json(hosts, filename, pretty=False)
+
+# EOF
@@ -0,0 +1,50 @@
+'''
+    The scripts as an importable package.
+
+    With the repository root on `sys.path`, modules and stages are loaded
+    on first access, each with its own lazy imports, e.g.
+
+        import scripts
+        events = scripts.report.load_events(cand_events)
+        from scripts import jsonio, sort_nearby_sources
+
+    Stages are named with underscores ('sort_nearby_sources' for
+    sort-nearby-sources.py, see `sforzando.stage`). These are the same
+    module objects the scripts import from each other (`import jsonio`), so
+    nothing is loaded twice; submodules are therefore not importable as
+    `import scripts.jsonio`.
+'''
+
+import os
+import sys
+import importlib
+
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+if scripts_dir not in sys.path:
+    sys.path.insert(0, scripts_dir)
+
+# modules are found in `scripts_dir` as top-level modules, not here.
+__path__ = []
+
+def module_names():
+    ''' Names of all modules and stages in the package. '''
+    return sorted([w[:-3].replace('-', '_') for w in os.listdir(scripts_dir) \
+            if w.endswith('.py') and not w.startswith('_')])
+
+def __getattr__(name):
+    ''' Load a module (e.g. 'report') or a stage (e.g. 'print_table'). '''
+    if name.startswith('_') or name not in module_names():
+        raise AttributeError('module %r has no attribute %r' \
+                % (__name__, name))
+    if os.path.isfile(os.path.join(scripts_dir, name + '.py')):
+        module = importlib.import_module(name)
+    else:
+        module = importlib.import_module('sforzando').stage( \
+                name.replace('_', '-'))
+    globals()[name] = module
+    return module
+
+def __dir__():
+    return sorted(list(globals().keys()) + module_names())
+
+# EOF
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+
+'''
+    Split image stamps into shards for visual inspection.
+
+    Every stamp goes to one inspector, and a fraction of stamps (`--overlap`)
+    also to a second one, so that the whole set is covered with the minimum
+    effort and with a known overlap for agreement statistics
+    (`check-consistency.py`). Pairs of inspectors in the overlap are rotated,
+    so that every pair shares some stamps. The assignment is reproducible
+    with the same seed.
+
+    Stamps flagged automatically by `prescreen-stamps.py` are left out,
+    unless `--all` is given.
+
+    Usage: python assign-stamps.py ab cd ef [--overlap 0.1 --seed 42]
+
+    Then every inspector runs `python vis-inspect.py ab`.
+'''
+
+import sys
+import random
+import argparse
+from collections import OrderedDict
+
+from jsonio import load_json, dump_json
+
+def assign_stamps(stamps, inspectors, overlap=0.1, seed=42):
+
+    '''
+    Assign stamps to inspectors.
+
+    Parameters
+    ----------
+    stamps : list of tuple
+        (event, image source) of stamps.
+
+    inspectors : list of str
+        Inspector IDs.
+
+    overlap : float
+        Fraction of stamps to be inspected twice.
+
+    seed : int
+        Random seed of the shuffle.
+
+    Returns
+    -------
+    shards : OrderedDict
+        {inspector: list of stamps}, every list in a random order.
+    '''
+
+    N_insp = len(inspectors)
+    if (N_insp < 2) and overlap:
+        raise ValueError('Overlap needs at least two inspectors.')
+
+    rng = random.Random(seed)
+    stamps = list(stamps)
+    rng.shuffle(stamps)
+
+    shards = OrderedDict([(w, list()) for w in inspectors])
+    N_overlap = int(round(overlap * len(stamps)))
+    for i_stamp, stamp_i in enumerate(stamps):
+        i_first = i_stamp % N_insp
+        shards[inspectors[i_first]].append(stamp_i)
+        if i_stamp < N_overlap: # second inspector, rotate the pairs.
+            i_second = (i_first + 1 + (i_stamp // N_insp) % (N_insp - 1)) \
+                    % N_insp
+            shards[inspectors[i_second]].append(stamp_i)
+
+    # do not show the overlapping stamps first.
+    for shard_i in shards.values():
+        rng.shuffle(shard_i)
+
+    return shards
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inspectors', nargs='+',
+            help='Inspector IDs (two letters).')
+    parser.add_argument('--overlap', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--all', action='store_true',
+            help='Also assign stamps flagged by prescreen-stamps.py.')
+    args = parser.parse_args()
+
+    # read saved images.
+    annotated_images = load_json('./annotated-images.json')
+
+    # stamps flagged automatically.
+    prescreen = dict() if args.all \
+            else load_json('./prescreen-stats.json', missing_ok=True)
+
+    # create a flattened list of images.
+    image_stamps, N_auto = list(), 0
+    for event_i, images_i in annotated_images.items():
+        for imsrc_j, imfile_j in images_i.items():
+            if not imfile_j: # skip null
+                continue
+            if prescreen.get(event_i, {}).get(imsrc_j, {}).get('auto'):
+                N_auto += 1
+                continue
+            image_stamps.append((event_i, imsrc_j))
+
+    shards = assign_stamps(image_stamps, args.inspectors,
+            overlap=args.overlap, seed=args.seed)
+
+    assignments = OrderedDict([
+        ('seed', args.seed),
+        ('overlap', args.overlap),
+        ('shards', shards),
+    ])
+    dump_json(assignments, 'inspection-assignments.json')
+
+    for inspector_i, shard_i in shards.items():
+        print(inspector_i, len(shard_i))
+    print('Stamps:', len(image_stamps), 'Total assigned:',
+          sum(map(len, shards.values())), 'Auto-flagged, skipped:', N_auto)
+
+# EOF
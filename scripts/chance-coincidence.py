@@ -0,0 +1,276 @@
+#!/usr/bin/python
+
+'''
+    Chance-coincidence probabilities of nearby sources.
+
+    The probability that a source of surface density Sigma lies within the
+    separation r of an event by chance is P_cc = 1 - exp(-pi r^2 Sigma).
+    Source densities are HEALPix maps (NESTED) per survey, built once from
+    the query results already at hand: the number of sources of a survey
+    around every event (nearest-host-candidate.json) over the area of the
+    search (Vizier cone from candidate-hosts.json, or the Data Lab box),
+    summed over the events in a pixel. Events without sources of a survey
+    (outside its footprint) are not used for it, and Vizier results at the
+    row limit (lower limits) only where nothing else is available. Local
+    catalog dumps (`--dump SURVEY=FILE`, .npz or .csv with 'ra' and 'dec'
+    in degrees) replace the estimates in the pixels they cover.
+
+    `maps` writes the maps into `source-density.npz`. `run` computes P_cc
+    of all event-source pairs at once, with the maps from that file (built
+    first if missing, older than its inputs, or of another `--nside`), and
+    writes `chance-coincidence.json`: event -> list of P_cc, in the order
+    of sources in nearest-host-candidate.json (null without a density).
+
+    Usage:
+        python chance-coincidence.py maps [--nside 16] [--dump PS1=ps1.npz]
+        python chance-coincidence.py run [--nside 16]
+'''
+
+import os
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+import profiling
+import skypix
+from catalogs import cat_names
+from report import load_events, load_sources, group_argmin
+from jsonio import load_json, dump_json, open_events, stored_file
+
+maps_file = './source-density.npz'
+
+# Data Lab searches: boxes of 60 arcsec half-width (search-datalab.py)
+datalab_area = 120. ** 2 # arcsec^2
+
+# rows per catalog and event returned by Vizier (astroquery default)
+vizier_row_limit = 50
+
+def search_areas(event_names, cand_hosts_v):
+    ''' Area of the Vizier search around every event, arcsec^2. '''
+    return np.array([np.pi * cand_hosts_v[w]['search_radius'] ** 2 \
+            if w in cand_hosts_v else np.nan for w in event_names])
+
+def density_maps(events, sources, vizier_area, nside=16):
+
+    '''
+    Source density per HEALPix pixel and survey, from the sources around
+    events.
+
+    Parameters
+    ----------
+    events, sources : Table
+        Candidate events and nearby sources (`report.load_events`,
+        `report.load_sources`).
+
+    vizier_area : ndarray
+        Area of the Vizier search per event, arcsec^2.
+
+    nside : int
+        Resolution of the maps.
+
+    Returns
+    -------
+    surveys : list of str
+
+    density : ndarray, (npix, number of surveys)
+        Sources per arcsec^2, NaN without data.
+    '''
+
+    surveys, survey_idx = np.unique(sources['survey'].astype(str),
+            return_inverse=True)
+    N_events, N_surveys = len(events), len(surveys)
+    npix = skypix.nside_to_npix(nside)
+
+    # number of sources and search area per (event, survey)
+    counts = np.bincount(sources['event'] * N_surveys + survey_idx,
+            minlength=N_events * N_surveys).reshape(N_events, N_surveys)
+    is_vizier = np.array([w in cat_names.values() for w in surveys],
+            dtype=bool)
+    area = np.where(is_vizier[None, :], vizier_area[:, None], datalab_area)
+    truncated = is_vizier[None, :] & (counts >= vizier_row_limit)
+
+    # pixels of events.
+    has_crd = np.isfinite(events['ra_deg']) & np.isfinite(events['dec_deg'])
+    ipix = np.zeros(N_events, dtype='i8')
+    ipix[has_crd] = skypix.ang2pix_nest(nside, events['ra_deg'][has_crd],
+            events['dec_deg'][has_crd])
+    key = ipix[:, None] * N_surveys + np.arange(N_surveys)[None, :]
+    use = (counts > 0) & np.isfinite(area) & has_crd[:, None]
+
+    # complete counts first, lower limits where nothing else.
+    density = np.full(npix * N_surveys, np.nan)
+    for sel in [use & ~truncated, use & truncated]:
+        n_k = np.bincount(key[sel], weights=counts[sel],
+                minlength=npix * N_surveys)
+        a_k = np.bincount(key[sel], weights=area[sel],
+                minlength=npix * N_surveys)
+        fill = np.isnan(density) & (a_k > 0)
+        density[fill] = n_k[fill] / a_k[fill]
+
+    return list(surveys), density.reshape(npix, N_surveys)
+
+def add_dump(surveys, density, survey, ra, dec):
+
+    '''
+    Source density of a survey from a local catalog dump, in the pixels
+    it covers. Returns (surveys, density) with the survey added if new.
+    '''
+
+    nside = skypix.npix_to_nside(density.shape[0])
+    if survey not in surveys:
+        surveys = surveys + [survey]
+        density = np.hstack([density, np.full((density.shape[0], 1),
+                np.nan)])
+    ipix = skypix.ang2pix_nest(nside, ra, dec)
+    counts = np.bincount(ipix, minlength=density.shape[0])
+    covered = counts > 0
+    density[covered, surveys.index(survey)] = counts[covered] \
+            / (skypix.pixel_area(nside) * 3600. ** 2)
+    return surveys, density
+
+def read_dump(filename):
+    ''' RA and Dec (degrees) of a catalog dump, .npz or .csv '''
+    if filename.endswith('.npz'):
+        data = np.load(filename)
+    else:
+        data = np.genfromtxt(filename, delimiter=',', names=True)
+    return np.asarray(data['ra'], 'f8'), np.asarray(data['dec'], 'f8')
+
+def chance_coincidence(events, sources, surveys, density):
+
+    '''
+    P_cc of all event-source pairs.
+
+    Densities of pixels without data are the median of the survey over
+    all pixels with data.
+
+    Returns
+    -------
+    pcc : ndarray
+        Per row of `sources`, NaN if the survey has no density.
+    '''
+
+    nside = skypix.npix_to_nside(density.shape[0])
+    if not len(sources):
+        return np.zeros(0)
+
+    # density at the event of every source.
+    survey_idx = np.array([surveys.index(w) if w in surveys else -1 \
+            for w in sources['survey']])
+    ra, dec = events['ra_deg'][sources['event']], \
+            events['dec_deg'][sources['event']]
+    has_crd = np.isfinite(ra) & np.isfinite(dec)
+    ipix = np.zeros(len(sources), dtype='i8')
+    ipix[has_crd] = skypix.ang2pix_nest(nside, ra[has_crd], dec[has_crd])
+    sigma = np.where((survey_idx >= 0) & has_crd,
+            density[ipix, np.maximum(survey_idx, 0)], np.nan)
+
+    # fall back to the median density of the survey.
+    with np.errstate(all='ignore'):
+        median = np.array([np.nanmedian(w) if np.any(np.isfinite(w)) \
+                else np.nan for w in density.T] + [np.nan])
+    sigma = np.where(np.isnan(sigma), median[survey_idx], sigma)
+
+    return -np.expm1(-np.pi * sources['sep_asec'] ** 2 * sigma)
+
+def save_maps(filename, nside, surveys, density):
+    np.savez_compressed(filename, nside=nside, surveys=np.array(surveys),
+            density=density)
+
+def load_maps(filename):
+    ''' Returns nside, surveys (list) and density maps. '''
+    with np.load(filename) as data:
+        return int(data['nside']), [str(w) for w in data['surveys']], \
+                data['density']
+
+def maps_outdated(filename, input_files, nside=None):
+    '''
+    True if the maps file is missing, older than any of the input files, or
+    of another resolution (unless `nside` is None).
+    '''
+    if not os.path.isfile(filename):
+        return True
+    t_maps = os.path.getmtime(filename)
+    if any([os.path.getmtime(w) > t_maps for w in input_files \
+            if os.path.isfile(w)]):
+        return True
+    if nside is not None:
+        with np.load(filename) as data:
+            return int(data['nside']) != nside
+    return False
+
+if __name__ == '__main__':
+
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['maps', 'run'])
+    parser.add_argument('--nside', type=int, default=None,
+            help='Resolution of the density maps (default: that of the '
+            'existing maps, or 16).')
+    parser.add_argument('--dump', action='append', default=[],
+            metavar='SURVEY=FILE', help='Local catalog dump of a survey.')
+    args = parser.parse_args()
+
+    # read events and nearby sources.
+    events = load_events(load_json('candidate-events.json'))
+    sources = load_sources(open_events('nearest-host-candidate.json'),
+            events['name'])
+
+    # density maps, rebuilt if older than their inputs.
+    input_files = [stored_file(w) for w in ['candidate-events.json',
+            'nearest-host-candidate.json', 'candidate-hosts.json']] \
+            + [w.split('=', 1)[1] for w in args.dump]
+    if (args.mode == 'maps') \
+            or maps_outdated(maps_file, input_files, nside=args.nside):
+        nside = args.nside or (load_maps(maps_file)[0] \
+                if os.path.isfile(maps_file) else 16)
+        if args.mode == 'run':
+            print('Building density maps (nside %d).' % nside)
+        with profiling.phase('maps'):
+            vizier_area = search_areas(events['name'],
+                    open_events('candidate-hosts.json'))
+            surveys, density = density_maps(events, sources, vizier_area,
+                    nside=nside)
+            for dump_i in args.dump:
+                survey_i, file_i = dump_i.split('=', 1)
+                surveys, density = add_dump(surveys, density, survey_i,
+                        *read_dump(file_i))
+        save_maps(maps_file, nside, surveys, density)
+        print('Density maps (sources / arcmin^2, median over pixels):')
+        for survey_i, density_i in zip(surveys, density.T):
+            print('{:12} {:10.4f} {:8d} pixels'.format(survey_i,
+                    np.nanmedian(density_i) * 3600.,
+                    int(np.isfinite(density_i).sum())))
+    else:
+        _, surveys, density = load_maps(maps_file)
+
+    if args.mode == 'run':
+
+        with profiling.phase('pcc'):
+            pcc = chance_coincidence(events, sources, surveys, density)
+
+        # P_cc per event, in the order of nearest-host-candidate.json
+        order = np.argsort(sources['event'], kind='stable')
+        bounds = np.cumsum(np.bincount(sources['event'],
+                minlength=len(events)))[:-1]
+        chance_coinc = OrderedDict()
+        for name_i, pcc_i in zip(events['name'],
+                np.split(pcc[order], bounds)):
+            chance_coinc[name_i] = [None if np.isnan(w) else float(w) \
+                    for w in pcc_i]
+        dump_json(chance_coinc, 'chance-coincidence.json', pretty=False)
+
+        # nearest non-stellar source vs. the least likely by chance.
+        galaxy = np.flatnonzero(sources['star_flag'] != 'S')
+        i_near = group_argmin(sources['event'][galaxy],
+                sources['dist_kpc'][galaxy], len(events))
+        i_pcc = group_argmin(sources['event'][galaxy],
+                np.where(np.isnan(pcc[galaxy]), np.inf, pcc[galaxy]),
+                len(events))
+        print('Pairs:', len(sources), 'Events with sources:',
+                int((i_near >= 0).sum()), 'Most probable host not the '
+                'nearest:', int((i_near != i_pcc).sum()))
+
+# EOF
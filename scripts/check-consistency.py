@@ -1,15 +1,166 @@
 #!/usr/bin/python
 
+'''
+    Combine results of visual inspection from several inspectors.
+
+    Results in `visual-inspection-??.json` are loaded into a matrix of
+    (stamps x inspectors) with integer-coded flags (favorite flag ignored),
+    then majority-vote consensus, agreement rates and kappa statistics are
+    computed on the whole matrix.
+
+    Outputs:
+        visual-inspection-combined.json: consensus of every stamp.
+        visual-inspection-disagree.json: stamps with disagreeing results, for
+            re-inspection, with the results of every inspector.
+
+    Use `--unanimous` to keep only stamps where all inspectors agree.
+'''
+
 import os, sys
-import json
 import glob
+import argparse
+import itertools as itt
 from collections import OrderedDict
 
+import numpy as np
+
+from jsonio import load_json, dump_json
+
+# flags compared between inspectors.
+vote_flags = 'cnqy'
+
+def vote_key(flags):
+    ''' Flags compared between inspectors (favorite flag ignored) '''
+    return ''.join(sorted(flags.replace('f', '')))
+
+def inspection_matrix(image_stamps, inspection_results):
+
+    '''
+    Integer-coded matrix of inspection results.
+
+    Parameters
+    ----------
+    image_stamps : list of tuple
+        (event, image source, ...) of stamps.
+
+    inspection_results : list of dict
+        Results of inspectors, {event: {image source: flags}}.
+
+    Returns
+    -------
+    M : ndarray
+        (N_stamps, N_inspectors) matrix of codes, 0 for no result.
+
+    codes : list of str
+        Flags of codes, `codes[0]` is None.
+    '''
+
+    stamp_idx = {(w[0], w[1]): i for i, w in enumerate(image_stamps)}
+    codes, code_idx = [None], dict()
+    M = np.zeros((len(image_stamps), len(inspection_results)), dtype='i2')
+    for j_insp, set_j in enumerate(inspection_results):
+        rows_j, vals_j = list(), list()
+        for event_k, images_k in set_j.items():
+            for imsrc_l, flags_l in images_k.items():
+                i_stamp = stamp_idx.get((event_k, imsrc_l), None)
+                if i_stamp is None:
+                    continue
+                key_l = vote_key(flags_l)
+                if key_l not in code_idx:
+                    code_idx[key_l] = len(codes)
+                    codes.append(key_l)
+                rows_j.append(i_stamp)
+                vals_j.append(code_idx[key_l])
+        M[rows_j, j_insp] = vals_j
+    return M, codes
+
+def vote_counts(M, N_codes):
+    ''' (N_stamps, N_codes) counts of every code, column 0 is empty. '''
+    C = np.zeros((M.shape[0], N_codes), dtype='i4')
+    for k in range(1, N_codes):
+        C[:, k] = (M == k).sum(axis=1)
+    return C
+
+def majority_vote(C):
+
+    '''
+    Majority-vote consensus from vote counts.
+
+    Returns
+    -------
+    code : ndarray
+        Code with most votes, 0 if no strict majority.
+
+    n_rated, n_agree : ndarray
+        Number of results, and number of votes for the most voted code.
+    '''
+
+    n_rated = C[:, 1:].sum(axis=1)
+    if (C.shape[0] == 0) or (C.shape[1] <= 1): # no stamps or no results.
+        return np.zeros(C.shape[0], dtype='i8'), n_rated, n_rated.copy()
+    code = np.argmax(C[:, 1:], axis=1) + 1
+    n_agree = C[np.arange(C.shape[0]), code]
+    code[2 * n_agree <= n_rated] = 0
+    return code, n_rated, n_agree
+
+def flag_agreement(M, codes):
+
+    '''
+    Agreement rate of every flag: fraction of pairs of inspectors on the
+    same stamp that agree on the presence of the flag.
+    '''
+
+    rated = M > 0
+    n_rated = rated.sum(axis=1)
+    multi = n_rated >= 2
+    n_pairs = n_rated * (n_rated - 1) / 2.
+
+    rates = OrderedDict()
+    for flag_i in vote_flags:
+        has_flag_i = np.array([(w is not None) and (flag_i in w) \
+                for w in codes])
+        n_yes = (has_flag_i[M] & rated).sum(axis=1)
+        n_no = n_rated - n_yes
+        agree = n_yes * (n_yes - 1) / 2. + n_no * (n_no - 1) / 2.
+        rates[flag_i] = float(agree[multi].sum() / n_pairs[multi].sum()) \
+                if multi.any() else float('nan')
+    return rates
+
+def cohen_kappa(a, b, N_codes):
+    ''' Cohen's kappa of two inspectors, on stamps rated by both. '''
+    both = (a > 0) & (b > 0)
+    if not both.any():
+        return float('nan'), 0
+    a, b = a[both], b[both]
+    conf = np.bincount(a * N_codes + b,
+            minlength=N_codes ** 2).reshape(N_codes, N_codes)
+    n = float(both.sum())
+    p_o = np.trace(conf) / n
+    p_e = (conf.sum(axis=1) * conf.sum(axis=0)).sum() / n ** 2
+    kappa = (p_o - p_e) / (1. - p_e) if p_e < 1. else 1.
+    return float(kappa), int(n)
+
+def fleiss_kappa(C):
+    ''' Fleiss' kappa for stamps with two or more results. '''
+    C = C[:, 1:].astype('f8')
+    n = C.sum(axis=1)
+    C, n = C[n >= 2], n[n >= 2]
+    if not n.size:
+        return float('nan')
+    P_i = ((C * (C - 1.)).sum(axis=1)) / (n * (n - 1.))
+    p_k = C.sum(axis=0) / n.sum()
+    P_e = (p_k ** 2).sum()
+    return float((P_i.mean() - P_e) / (1. - P_e)) if P_e < 1. else 1.
+
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--unanimous', action='store_true',
+            help='Keep only stamps where all inspectors agree.')
+    args = parser.parse_args()
+
     # read list of available images.
-    with open('./annotated-images.json', 'r') as fp:
-        annotated_images = json.load(fp, object_pairs_hook=OrderedDict)
+    annotated_images = load_json('./annotated-images.json')
 
     # create a flattened list of images.
     image_stamps = list()
@@ -20,31 +171,53 @@ if __name__ == '__main__':
             image_stamps.append((event_i, imsrc_j, imfile_j))
 
     # read existing inspection results.
-    inspection_results = list()
-    for file_i in glob.glob('./visual-inspection-??.json'):
-        fp_i = open(file_i, 'r')
-        inspection_results.append(json.load( \
-                fp_i, object_pairs_hook=OrderedDict))
-        fp_i.close()
+    inspection_results, inspectors = list(), list()
+    for file_i in sorted(glob.glob('./visual-inspection-??.json')):
+        inspection_results.append(load_json(file_i))
+        inspectors.append(os.path.basename(file_i)[-7:-5])
     N_dataset = len(inspection_results)
 
+    # matrix of results, votes and consensus.
+    M, codes = inspection_matrix(image_stamps, inspection_results)
+    C = vote_counts(M, len(codes))
+    consensus, n_rated, n_agree = majority_vote(C)
+    if args.unanimous:
+        consensus[n_agree < n_rated] = 0
+
     # construct new
     inspection_cb = OrderedDict()
-    for event_i, imsrc_j, imfile_j in image_stamps:
-        result_i = list()
-        for set_i in inspection_results:
-            if (event_i in set_i) and (imsrc_j in set_i[event_i]):
-                result_i.append(set_i[event_i][imsrc_j])
-        result_i = list(set([w.replace('f', '') for w in result_i]))
-        if len(result_i) == 0: # no result
-            pass
-        elif len(result_i) == 1: # consistent results
-            if event_i not in inspection_cb:
-                inspection_cb[event_i] = OrderedDict()
-            inspection_cb[event_i][imsrc_j] = result_i[0]
-        else: # inconsistent results.
-            pass
+    for i_stamp in np.flatnonzero(consensus):
+        event_i, imsrc_j = image_stamps[i_stamp][:2]
+        if event_i not in inspection_cb:
+            inspection_cb[event_i] = OrderedDict()
+        inspection_cb[event_i][imsrc_j] = codes[consensus[i_stamp]]
+
+    # disagreeing results, for re-inspection.
+    inspection_dis = OrderedDict()
+    for i_stamp in np.flatnonzero((n_rated >= 2) & (n_agree < n_rated)):
+        event_i, imsrc_j = image_stamps[i_stamp][:2]
+        if event_i not in inspection_dis:
+            inspection_dis[event_i] = OrderedDict()
+        inspection_dis[event_i][imsrc_j] = OrderedDict([ \
+                (inspectors[k], codes[M[i_stamp, k]]) \
+                for k in np.flatnonzero(M[i_stamp])])
 
     # save new results.
-    with open('visual-inspection-combined.json', 'w') as fp:
-        json.dump(inspection_cb, fp, indent=4)
+    dump_json(inspection_cb, 'visual-inspection-combined.json')
+
+    dump_json(inspection_dis, 'visual-inspection-disagree.json')
+
+    # agreement statistics.
+    print('Inspectors:', N_dataset, 'Stamps:', len(image_stamps),
+          'Inspected:', int((n_rated > 0).sum()),
+          'Multiple results:', int((n_rated >= 2).sum()))
+    print('Consensus:', int((consensus > 0).sum()),
+          'Disagreeing:', int(((n_rated >= 2) & (n_agree < n_rated)).sum()))
+    print('Agreement rate per flag:', ', '.join(['%s: %.3f' % (k, v) \
+            for k, v in flag_agreement(M, codes).items()]))
+    print("Fleiss' kappa: %.3f" % fleiss_kappa(C))
+    for j, k in itt.combinations(range(N_dataset), 2):
+        kappa_jk, n_jk = cohen_kappa(M[:, j], M[:, k], len(codes))
+        if n_jk:
+            print("Cohen's kappa %s-%s: %.3f (%d stamps)" \
+                    % (inspectors[j], inspectors[k], kappa_jk, n_jk))
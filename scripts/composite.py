@@ -0,0 +1,223 @@
+#!/usr/bin/python
+
+'''
+    Render colour composites from per-band FITS cutouts.
+
+    The remote services (Legacy Survey viewer, SkyServer, panstamps) return
+    JPEG images with their own stretch. Here we keep the FITS cutouts and
+    render colour images locally, so a new stretch does not require a new
+    download.
+'''
+
+import numpy as np
+
+# output image size in pixels, per image source. These are the sizes of the
+# JPEG stamps from the remote services, as assumed in `annotate-stamps.py`.
+output_sizes = {
+    'SDSS': 256,
+    'DES': 256,
+    'DECaLS': 256,
+    'MzLS-BASS': 256,
+    'ps1': 480,
+}
+
+# bands assigned to (R, G, B) channels, per image source.
+rgb_bands = {
+    'SDSS': ('i', 'r', 'g'),
+    'DES': ('z', 'r', 'g'),
+    'DECaLS': ('z', 'r', 'g'),
+    'MzLS-BASS': ('z', 'r', 'g'),
+    'ps1': ('i', 'r', 'g'),
+}
+
+# relative scaling of bands (roughly follows the Legacy Survey viewer), for
+# images in nanomaggies (zero-point 22.5).
+band_scales = {
+    'g': 6.0,
+    'r': 3.4,
+    'i': 2.5,
+    'z': 2.2,
+}
+
+def ps1_flux(data, header):
+
+    '''
+    Nanomaggies of a PS1 stack cutout: undo the asinh compression
+    (BOFFSET, BSOFTEN), then scale counts from the zero-point
+    25 + 2.5 log10(EXPTIME) to 22.5. Other images are returned as they are.
+    '''
+
+    data = np.asarray(data, dtype='f8')
+    if 'BSOFTEN' in header and 'BOFFSET' in header:
+        data = header['BOFFSET'] + header['BSOFTEN'] * 2. \
+                * np.sinh(data * np.log(10.) / 2.5)
+    if 'EXPTIME' in header:
+        zero_point = 25. + 2.5 * np.log10(header['EXPTIME'])
+        data = data * 10. ** (-0.4 * (zero_point - 22.5))
+    return data.astype('f4')
+
+def read_fits_bands(fits_files, bands):
+
+    '''
+    Read image data of a cutout into a (N_bands, N_y, N_x) array.
+
+    Parameters
+    ----------
+    fits_files : str or dict
+        Either a single FITS file with a data cube (one plane per band, in the
+        order of `bands`, as returned by the Legacy Survey viewer), or a dict
+        of {band: single-band FITS file} (PS1).
+
+    bands : str or sequence of str
+        Bands in the file (cube), or bands to read (dict).
+
+    Returns
+    -------
+    images : dict
+        {band: 2-d float32 array}, in nanomaggies. Single-band PS1 stacks
+        are stored asinh-compressed in counts at the zero-point
+        25 + 2.5 log10(EXPTIME), and are converted (see `ps1_flux`).
+    '''
+
+    from astropy.io import fits
+
+    images = dict()
+    if isinstance(fits_files, dict):
+        for band_i in bands:
+            with fits.open(fits_files[band_i], memmap=False) as hdul:
+                images[band_i] = ps1_flux(hdul[0].data, hdul[0].header)
+    else:
+        with fits.open(fits_files, memmap=False) as hdul:
+            cube = np.asarray(hdul[0].data, dtype='f4')
+        if cube.ndim == 2:
+            cube = cube[np.newaxis]
+        for band_i, plane_i in zip(bands, cube):
+            images[band_i] = plane_i
+
+    return images
+
+def lupton_rgb(r, g, b, Q=8., stretch=0.5, minimum=0.):
+
+    '''
+    Lupton et al. (2004) asinh stretch of three images.
+
+    Parameters
+    ----------
+    r, g, b : ndarray
+        Images for the red, green and blue channels, already scaled.
+
+    Q : float
+        Softening parameter of the asinh function.
+
+    stretch : float
+        Linear stretch of the image.
+
+    minimum : float
+        Intensity that maps to black.
+
+    Returns
+    -------
+    rgb : ndarray
+        (N_y, N_x, 3) uint8 array.
+    '''
+
+    rgb = np.stack([r, g, b], axis=-1)
+    rgb = np.nan_to_num(rgb - minimum, copy=False)
+    np.maximum(rgb, 0., out=rgb)
+
+    # mean intensity, and the asinh-stretched intensity.
+    I = rgb.mean(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fac = np.arcsinh(Q * I / stretch) / (Q * I)
+    fac[I <= 0.] = 0.
+    rgb *= fac[..., np.newaxis]
+
+    # keep the colour of saturated pixels.
+    maxval = rgb.max(axis=-1)
+    over = maxval > 1.
+    rgb[over] /= maxval[over][:, np.newaxis]
+
+    return (rgb * 255.).astype('u1')
+
+def linear_rgb(r, g, b, Q=None, stretch=1., minimum=0.):
+    ''' Linear stretch between `minimum` and `minimum + stretch` '''
+    rgb = np.stack([r, g, b], axis=-1)
+    rgb = np.clip(np.nan_to_num((rgb - minimum) / stretch), 0., 1.)
+    return (rgb * 255.).astype('u1')
+
+stretch_funcs = {
+    'lupton': lupton_rgb,
+    'linear': linear_rgb,
+}
+
+def render_composite(fits_files, image_src, saveto, bands=None,
+        method='lupton', Q=8., stretch=0.5, minimum=0., scales=None,
+        quality=90):
+
+    '''
+    Render a colour JPEG of a stamp from its FITS cutout.
+
+    Parameters
+    ----------
+    fits_files : str or dict
+        FITS cutout(s), see `read_fits_bands`.
+
+    image_src : str
+        Image source ('DECaLS', 'SDSS', 'ps1', ...) as in `image-cutout.json`,
+        which decides output size and band assignment.
+
+    saveto : str
+        Output JPEG file name.
+
+    bands : str
+        Bands of the data cube, default to the ones in `rgb_bands`.
+
+    method : str
+        Name of the stretch, key of `stretch_funcs`.
+
+    Q, stretch, minimum : float
+        Parameters of the stretch.
+
+    scales : dict
+        Relative scaling of bands, default to `band_scales`.
+
+    quality : int
+        JPEG quality.
+
+    Returns
+    -------
+    Saved filename, or None if the cutout has no valid pixels (outside
+    survey footprint).
+    '''
+
+    from PIL import Image
+
+    rgb_bands_i = rgb_bands[image_src]
+    if bands is None:
+        bands = ''.join(sorted(rgb_bands_i, key='grizy'.index))
+    if scales is None:
+        scales = band_scales
+
+    images = read_fits_bands(fits_files, bands)
+
+    # blank cutout (beyond survey footprint)
+    if not any(np.any(np.nan_to_num(images[w])) for w in rgb_bands_i):
+        return None
+
+    rgb = stretch_funcs[method](
+        *[images[w] * scales[w] for w in rgb_bands_i],
+        Q=Q, stretch=stretch, minimum=minimum
+    )
+
+    # FITS rows run from south to north.
+    img = Image.fromarray(rgb[::-1], mode='RGB')
+    size = output_sizes[image_src]
+    if img.size != (size, size):
+        img = img.resize((size, size), Image.LANCZOS)
+
+    with open(saveto, 'wb') as fp:
+        img.save(fp, 'JPEG', quality=quality)
+
+    return saveto
+
+# EOF
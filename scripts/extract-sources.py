@@ -0,0 +1,349 @@
+#!/usr/bin/python
+
+'''
+    Extract sources from image stamps, to find faint hosts automatically.
+
+    Every stamp (JPEG from `image-cutout.json`, or FITS cutouts from
+    `image-cutout-fits.json` with `--fits`) is processed as follows:
+    background and noise are estimated in a mesh of boxes (median and
+    scaled MAD of clipped pixels, median-filtered and interpolated), the
+    background-subtracted image is smoothed with a Gaussian kernel and
+    thresholded, and connected pixels above the threshold are segmented
+    into sources. Flux, centroid, S/N and shape (second moments) of every
+    source are measured. Sources larger than the PSF are extended.
+
+    Sources within the circle of `--ring-kpc` proper kpc (30, as used for
+    hostless candidates) are saved into `stamp-sources.json`: event ->
+    image source -> list of detections. An event with an extended source
+    inside the circle in any stamp has a host candidate below the catalog
+    limits. The stretch and compression of JPEG stamps leave more faint
+    spurious detections than FITS cutouts.
+
+    Usage:
+        python extract-sources.py run [--fits] [--processes N]
+            [--ring-kpc 30] [--nsigma 3] [--min-area 8] [--min-snr 5]
+        python extract-sources.py test
+'''
+
+import sys
+import argparse
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+import profiling
+from overlays import stamp_sizes
+from jsonio import load_json, dump_json
+
+def background_mesh(img, box=32, filter_size=3, clip_sigma=3., n_iter=3):
+
+    '''
+    Background and noise of an image, from a mesh of boxes.
+
+    In every box, pixels beyond `clip_sigma` of the median are clipped
+    iteratively, and the median and scaled MAD of the rest are the local
+    background and noise. The mesh is median-filtered (`filter_size`
+    boxes) and interpolated to every pixel.
+
+    Returns
+    -------
+    bg : ndarray
+        Background of every pixel.
+
+    noise : float
+        Median noise of the boxes.
+    '''
+
+    from scipy import ndimage
+
+    im_h, im_w = img.shape
+    ny, nx = max(im_h // box, 1), max(im_w // box, 1)
+    by, bx = im_h // ny, im_w // nx
+
+    # boxes as (ny, nx, pixels), NaN for invalid pixels.
+    cells = img[:ny * by, :nx * bx].reshape(ny, by, nx, bx) \
+            .swapaxes(1, 2).reshape(ny, nx, by * bx).astype('f8')
+    with np.errstate(all='ignore'):
+        for i_iter in range(n_iter):
+            med = np.nanmedian(cells, axis=2)
+            mad = 1.4826 * np.nanmedian(np.abs(cells - med[..., None]),
+                    axis=2)
+            clip = np.abs(cells - med[..., None]) \
+                    > clip_sigma * np.maximum(mad, 1e-12)[..., None]
+            cells = np.where(clip, np.nan, cells)
+        med = np.nanmedian(cells, axis=2)
+        mad = 1.4826 * np.nanmedian(np.abs(cells - med[..., None]), axis=2)
+
+    # empty boxes: median of the others.
+    for arr in [med, mad]:
+        bad = ~np.isfinite(arr)
+        arr[bad] = np.nanmedian(arr) if np.any(~bad) else 0.
+
+    if filter_size > 1:
+        med = ndimage.median_filter(med, size=filter_size, mode='nearest')
+
+    # bilinear interpolation between box centers.
+    yc = (np.arange(im_h) - (by - 1) / 2.) / by
+    xc = (np.arange(im_w) - (bx - 1) / 2.) / bx
+    yy, xx = np.meshgrid(np.clip(yc, 0, ny - 1), np.clip(xc, 0, nx - 1),
+            indexing='ij')
+    bg = ndimage.map_coordinates(med, [yy, xx], order=1, mode='nearest')
+
+    return bg, float(np.median(mad))
+
+def extract_sources(img, pix_scale, ring_rad_asec=None, nsigma=3.,
+        min_area=8, min_snr=5., min_noise=0., kernel_fwhm=2.,
+        psf_fwhm_asec=1.3, box=32):
+
+    '''
+    Sources in an image.
+
+    Parameters
+    ----------
+    img : 2-d array
+        Image, the event at the center.
+
+    pix_scale : float
+        Pixel scale, arcsec.
+
+    ring_rad_asec : float
+        Keep sources within this distance of the center, None for all.
+
+    nsigma : float
+        Detection threshold, in noise of the smoothed image.
+
+    min_area : int
+        Smallest number of pixels of a source.
+
+    min_snr : float
+        Smallest S/N of a source (flux over noise of its pixels).
+
+    min_noise : float
+        Smallest noise per pixel (e.g. 1 for the quantization of JPEG).
+
+    kernel_fwhm : float
+        FWHM of the smoothing kernel, pixels.
+
+    psf_fwhm_asec : float
+        FWHM of point sources, arcsec. Sources with a second-moment size
+        (geometric mean of the axes) above 1.5 times that of the PSF
+        (convolved with the kernel) are extended.
+
+    box : int
+        Box size of the background mesh, pixels.
+
+    Returns
+    -------
+    list of OrderedDict, from the nearest source: 'x', 'y' (pixels),
+    'sep_asec', 'flux', 'snr', 'npix', 'a_asec', 'b_asec', 'theta' (degrees
+    from +x), 'extended'.
+    '''
+
+    from scipy import ndimage
+
+    img = np.asarray(img, dtype='f8')
+    valid = np.isfinite(img)
+    img = np.where(valid, img, np.nanmedian(img) if valid.any() else 0.)
+    im_h, im_w = img.shape
+
+    # background-subtracted and smoothed images.
+    bg, noise = background_mesh(img, box=box)
+    noise = max(noise, min_noise)
+    sub = img - bg
+    k_sigma = kernel_fwhm / 2.3548
+    smooth = ndimage.gaussian_filter(sub, k_sigma)
+    bg_pix = smooth[valid]
+    noise_s = 1.4826 * np.median(np.abs(bg_pix - np.median(bg_pix))) \
+            if bg_pix.size else 0.
+    # white noise is reduced by the kernel.
+    noise_s = max(noise_s, min_noise / (2. * np.sqrt(np.pi) * k_sigma))
+    if not (noise_s > 0.):
+        return list()
+
+    # segmentation.
+    labels, N_labels = ndimage.label(valid & (smooth > nsigma * noise_s),
+            structure=np.ones((3, 3)))
+    if not N_labels:
+        return list()
+    idx = np.arange(1, N_labels + 1)
+    npix = ndimage.sum_labels(np.ones_like(sub), labels, idx)
+
+    # flux-weighted moments (positive pixels).
+    w = np.clip(sub, 0., None)
+    yp, xp = np.indices(sub.shape, dtype='f8')
+    flux = ndimage.sum_labels(sub, labels, idx)
+    w_sum = np.maximum(ndimage.sum_labels(w, labels, idx), 1e-12)
+    x_c = ndimage.sum_labels(w * xp, labels, idx) / w_sum
+    y_c = ndimage.sum_labels(w * yp, labels, idx) / w_sum
+    xx = ndimage.sum_labels(w * xp ** 2, labels, idx) / w_sum - x_c ** 2
+    yy = ndimage.sum_labels(w * yp ** 2, labels, idx) / w_sum - y_c ** 2
+    xy = ndimage.sum_labels(w * xp * yp, labels, idx) / w_sum - x_c * y_c
+
+    # axes of the second moments.
+    tr, det = xx + yy, np.sqrt(((xx - yy) / 2.) ** 2 + xy ** 2)
+    a = np.sqrt(np.clip(tr / 2. + det, 0., None))
+    b = np.sqrt(np.clip(tr / 2. - det, 0., None))
+    theta = np.degrees(0.5 * np.arctan2(2. * xy, xx - yy))
+
+    # point sources: PSF and kernel in quadrature (pixels).
+    psf_sigma = np.hypot(psf_fwhm_asec / pix_scale / 2.3548, k_sigma)
+    extended = np.sqrt(a * b) > 1.5 * psf_sigma
+
+    snr = flux / (noise * np.sqrt(npix))
+    sep = np.hypot(x_c - (im_w - 1) / 2., y_c - (im_h - 1) / 2.) * pix_scale
+
+    keep = (npix >= min_area) & (snr >= min_snr)
+    if ring_rad_asec is not None:
+        keep &= sep < ring_rad_asec
+
+    sources = list()
+    for i_src in np.flatnonzero(keep)[np.argsort(sep[keep])]:
+        sources.append(OrderedDict([
+            ('x', round(float(x_c[i_src]), 2)),
+            ('y', round(float(y_c[i_src]), 2)),
+            ('sep_asec', round(float(sep[i_src]), 3)),
+            ('flux', float(flux[i_src])),
+            ('snr', round(float(snr[i_src]), 2)),
+            ('npix', int(npix[i_src])),
+            ('a_asec', round(float(a[i_src] * pix_scale), 3)),
+            ('b_asec', round(float(b[i_src] * pix_scale), 3)),
+            ('theta', round(float(theta[i_src]), 1)),
+            ('extended', bool(extended[i_src])),
+        ]))
+    return sources
+
+def read_stamp(image_file, image_src):
+
+    '''
+    Detection image, pixel scale (arcsec) and smallest noise of a stamp:
+    the gray-scale JPEG (quantized), or the sum of the bands of a FITS
+    cutout, each in units of its noise.
+    '''
+
+    if image_file.lower().endswith('.fits'):
+        from composite import read_fits_bands
+        from sforzando import stage
+        layer, bands, pix_scale = \
+                stage('get-image-stamps').fits_layers[image_src]
+        images = read_fits_bands(image_file, bands)
+        detect = 0.
+        for band_i, img_i in images.items():
+            img_i = np.where(np.isfinite(img_i), img_i, 0.)
+            mad_i = 1.4826 * np.median(np.abs(img_i - np.median(img_i)))
+            detect = detect + (img_i / mad_i if mad_i > 0. else 0.)
+        return np.asarray(detect)[::-1], pix_scale, 0. # south to north.
+
+    from PIL import Image
+    img = np.asarray(Image.open(image_file).convert('L'), dtype='f4')
+    return img, stamp_sizes[image_src] / img.shape[1], 1.
+
+def extract_task(task):
+    ''' Sources of a single stamp, for the process pool '''
+    event_i, imsrc_i, imfile_i, ring_rad_i, kwargs_i = task
+    try:
+        img_i, pix_scale_i, min_noise_i = read_stamp(imfile_i, imsrc_i)
+        return event_i, imsrc_i, extract_sources(img_i, pix_scale_i,
+                ring_rad_asec=ring_rad_i, min_noise=min_noise_i, **kwargs_i)
+    except Exception as err:
+        print('Failed:', imfile_i, err)
+        return event_i, imsrc_i, None
+
+if (__name__ == '__main__') and ('test' in sys.argv):
+
+    # blank sky, a point source, and a faint extended galaxy.
+    rng = np.random.RandomState(42)
+    size, pix_scale = 256, 0.27
+    yp, xp = np.indices((size, size), dtype='f8')
+    gauss = lambda x0, y0, sx, sy, f: f / (2. * np.pi * sx * sy) \
+            * np.exp(-0.5 * (((xp - x0) / sx) ** 2 + ((yp - y0) / sy) ** 2))
+    img = 20. + 0.02 * xp + rng.normal(0., 2., (size, size)) \
+            + gauss(60., 200., 2., 2., 3000.) \
+            + gauss(150., 140., 9., 5., 6000.)
+
+    sources = extract_sources(img, pix_scale)
+    assert len(sources) == 2, sources
+    galaxy, star = sources # nearest first.
+    assert abs(galaxy['x'] - 150.) < 1. and abs(galaxy['y'] - 140.) < 1.
+    assert galaxy['extended'] and (not star['extended'])
+    assert galaxy['a_asec'] > galaxy['b_asec']
+    assert abs(galaxy['theta']) < 10.
+
+    # within the circle only.
+    sources = extract_sources(img, pix_scale, ring_rad_asec=10.)
+    assert len(sources) == 1 and sources[0]['extended']
+
+    # nothing in pure noise.
+    assert not extract_sources(rng.normal(0., 2., (size, size)), pix_scale)
+
+    print('OK')
+
+if (__name__ == '__main__') and ('run' in sys.argv):
+
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['run'])
+    parser.add_argument('--fits', action='store_true',
+            help='Use FITS cutouts (image-cutout-fits.json).')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--ring-kpc', type=float, default=30.)
+    parser.add_argument('--nsigma', type=float, default=3.)
+    parser.add_argument('--min-area', type=int, default=8)
+    parser.add_argument('--min-snr', type=float, default=5.)
+    parser.add_argument('--psf-fwhm', type=float, default=1.3,
+            help='FWHM of point sources, arcsec.')
+    parser.add_argument('--output', default='stamp-sources.json')
+    args = parser.parse_args()
+
+    from astropy.cosmology import WMAP9 as cosmo
+
+    # read events and stamps.
+    cand_events = load_json('candidate-events.json')
+    image_cutout = load_json('image-cutout-fits.json' if args.fits \
+            else 'image-cutout.json')
+
+    # radius of the circle, in arcsec, for all events.
+    event_names = [w for w in image_cutout if w in cand_events]
+    zred = np.array([abs(float(cand_events[w]['redshift'])) \
+            for w in event_names])
+    kpc_per_asec = cosmo.kpc_proper_per_arcmin(zred).value / 60.
+    with np.errstate(divide='ignore'):
+        ring_rad = np.where(kpc_per_asec > 0.,
+                args.ring_kpc / kpc_per_asec, 0.)
+
+    kwargs = dict(nsigma=args.nsigma, min_area=args.min_area,
+            min_snr=args.min_snr, psf_fwhm_asec=args.psf_fwhm)
+    tasks = list()
+    for event_i, ring_rad_i in zip(event_names, ring_rad):
+        for imsrc_j, imfile_j in image_cutout[event_i].items():
+            if (not imfile_j) or (not isinstance(imfile_j, str)) \
+                    or (imsrc_j not in stamp_sizes):
+                continue # no stamp, or PS1 (one file per band)
+            tasks.append((event_i, imsrc_j, imfile_j, float(ring_rad_i),
+                    kwargs))
+
+    # extract sources.
+    stamp_sources = OrderedDict([(w, OrderedDict()) for w in event_names])
+    with Pool(args.processes) as pool, profiling.phase('events'):
+        for event_i, imsrc_i, sources_i in tqdm(pool.imap_unordered( \
+                extract_task, tasks, chunksize=8), total=len(tasks)):
+            if sources_i is not None:
+                stamp_sources[event_i][imsrc_i] = sources_i
+
+    # image sources in the order of the stamp list, whatever the order of
+    # completion.
+    for event_i, sources_i in stamp_sources.items():
+        stamp_sources[event_i] = OrderedDict([(w, sources_i[w]) \
+                for w in image_cutout[event_i] if w in sources_i])
+
+    dump_json(stamp_sources, args.output)
+
+    N_host = sum([any([any([v['extended'] for v in w]) \
+            for w in images_i.values()]) \
+            for images_i in stamp_sources.values()])
+    print('Stamps:', len(tasks), 'Events:', len(event_names),
+            'With extended source in the circle:', N_host)
+
+# EOF
@@ -5,13 +5,15 @@
 '''
 
 import os
-import json
 import glob
 from collections import OrderedDict
 
+import profiling
+from jsonio import load_json, dump_json
+
 osc_dir = './Transient-catalogs/supernovae/'
 
-def read_supernovae():
+def read_supernovae(osc_dir=osc_dir):
     '''
     Iterate over JSON files in OSC
     '''
@@ -19,8 +21,7 @@ def read_supernovae():
         for file_i in files:
             if '.json' != file_i.lower()[-5:]:
                 continue
-            with open(subdir + '/' + file_i, 'r') as fp:
-                yield json.load(fp)
+            yield load_json(subdir + '/' + file_i)
 
 def claimedtype_to_str(claimedtype):
     '''
@@ -72,68 +73,114 @@ def select_coord(ra_list, dec_list):
     # return values.
     return tuple(crds[src_id_sel])
 
-if __name__ == '__main__':
+def select_event(event_info):
 
-    candidate_events = OrderedDict()
-    fmtstr = '{:32} {:40} {:24} {:24} {:16}'
+    '''
+    Select a candidate event.
 
-    # read events
-    for event_i in read_supernovae():
-        for event_name_i, event_info_i in event_i.items():
+    Parameters
+    ----------
+    event_info : dict
+        Record of an event in OSC.
 
-            # skip events with host names
-            '''
-            if ('host' in event_info_i) and event_info_i['host']:
-                continue
-            '''
-            # Host name condition removed, 052519, YJ
-            # Some hostless SNe have host names! (Anon)
+    Returns
+    -------
+    OrderedDict of 'ra', 'dec', 'type' and 'redshift', or None if the event
+    is not a candidate.
+    '''
 
-            # skip events without valid redshift
-            if not (('redshift' in event_info_i) \
-                    and event_info_i['redshift']):
-                continue
+    # skip events with host names
+    '''
+    if ('host' in event_info) and event_info['host']:
+        return None
+    '''
+    # Host name condition removed, 052519, YJ
+    # Some hostless SNe have host names! (Anon)
 
-            # skip events without type classification
-            if not (('claimedtype' in event_info_i) \
-                    and event_info_i['claimedtype']):
-                continue
+    # skip events without valid redshift
+    if not (('redshift' in event_info) and event_info['redshift']):
+        return None
 
-            # skip events with only a `Candidate` or 'LGRB' flag.
-            type_descr_i = claimedtype_to_str(event_info_i['claimedtype'])
-            if not type_descr_i:
-                continue
+    # skip events without type classification
+    if not (('claimedtype' in event_info) and event_info['claimedtype']):
+        return None
 
-            # skip events without coordinates
-            if ('ra' not in event_info_i) or ('dec' not in event_info_i) \
-                    or (not event_info_i['ra']) or (not event_info_i['dec']):
-                continue
+    # skip events with only a `Candidate` or 'LGRB' flag.
+    type_descr = claimedtype_to_str(event_info['claimedtype'])
+    if not type_descr:
+        return None
+
+    # skip events without coordinates
+    if ('ra' not in event_info) or ('dec' not in event_info) \
+            or (not event_info['ra']) or (not event_info['dec']):
+        return None
+
+    # get RA, Dec, redshift of this event.
+    ra, dec = select_coord(event_info['ra'], event_info['dec'])
+
+    # get redshift of the event (only the first one.)
+    zred = event_info['redshift'][0]['value']
 
-            # get RA, Dec, redshift of this event.
-            ra_i, dec_i = select_coord(event_info_i['ra'], event_info_i['dec'])
+    # New: only select events within z~0.1 (YJ, 20190506)
+    if float(zred) > 0.1:
+        return None
 
-            # get redshift of the event (only the first one.)
-            zred_i = event_info_i['redshift'][0]['value']
+    return OrderedDict([
+        ('ra', ra),
+        ('dec', dec),
+        ('type', type_descr),
+        ('redshift', zred),
+    ])
 
-            # New: only select events within z~0.1 (YJ, 20190506)
-            if float(zred_i) > 0.1:
+def find_candidates(osc_dir=osc_dir, verbose=True):
+
+    '''
+    Select candidate events from the OSC tree.
+
+    Parameters
+    ----------
+    osc_dir : str
+        Directory of OSC JSON files (searched recursively).
+
+    verbose : bool
+        Print every candidate.
+
+    Returns
+    -------
+    candidate_events : OrderedDict
+        Event name -> 'ra', 'dec', 'type' and 'redshift'.
+    '''
+
+    candidate_events = OrderedDict()
+    fmtstr = '{:32} {:40} {:24} {:24} {:16}'
+
+    # read events
+    for event_i in profiling.iter_events(read_supernovae(osc_dir),
+                                         key=lambda w: next(iter(w), '')):
+        for event_name_i, event_info_i in event_i.items():
+
+            cand_i = select_event(event_info_i)
+            if cand_i is None:
                 continue
 
             # this is a candidate event.
-            cand_i = [event_name_i, type_descr_i, ra_i, dec_i, zred_i]
-            print(fmtstr.format(*cand_i))
+            if verbose:
+                print(fmtstr.format(event_name_i, cand_i['type'],
+                        cand_i['ra'], cand_i['dec'], cand_i['redshift']))
 
             # save into dict.
-            candidate_events[event_name_i] = OrderedDict([
-                ('ra', ra_i),
-                ('dec', dec_i),
-                ('type', type_descr_i),
-                ('redshift', zred_i),
-            ])
+            candidate_events[event_name_i] = cand_i
+
+    return candidate_events
+
+if __name__ == '__main__':
+
+    profiling.enable()
+
+    candidate_events = find_candidates()
 
     # save into a file.
-    with open('candidate-events.json', 'w') as fp:
-        json.dump(candidate_events, fp, indent=4)
+    dump_json(candidate_events, 'candidate-events.json')
     print('Number of candidates:', len(candidate_events))
 
 # EOF
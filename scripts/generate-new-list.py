@@ -2,22 +2,34 @@
 
 '''
     Read results from visual inspection, create new target lists.
+
+    Use `--format csv|parquet|html --output FILE` for a machine-readable
+    table (one row per event, with column 'case'), default is the text
+    lists on stdout.
 '''
 
 import os, sys
-import json
-import glob, shutil
+import argparse
 from collections import OrderedDict
 
+import numpy as np
+
+from report import Table, load_inspection, has_flag
+from jsonio import load_json
+
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--format', default='text',
+            choices=['text', 'csv', 'parquet', 'html'])
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
     # read candidate events.
-    with open('candidate-events.json', 'r') as fp:
-        cand_events = json.load(fp, object_pairs_hook=OrderedDict)
+    cand_events = load_json('candidate-events.json')
 
     # read results of visual inspection
-    with open('./visual-inspection.json', 'r') as f:
-        vis_insp = json.load(f, object_pairs_hook=OrderedDict)
+    vis_insp = load_json('./visual-inspection.json')
 
     '''
     Visual inspection flags:
@@ -28,62 +40,49 @@ if __name__ == '__main__':
         f: flag for interesting cases
     '''
 
-    case_absent, case_visible, case_ambiguous = list(), list(), list()
-
-    # for events in the list, get their inspection results.
-    for cand_i, cand_info_i in cand_events.items():
+    # image sources: (column label, key in inspection results)
+    img_srcs = [('SDSS', 'SDSS'), ('ps1', 'ps1'), ('DECaLS', 'DECaLS'),
+            ('MzLS/BASS', 'MzLS-BASS'), ('DES', 'DES')]
 
-        # skip events w/o vis inspection
-        if cand_i not in vis_insp:
-            continue
+    # events with vis inspection, and their flags per image source.
+    names = np.array([w for w in cand_events if w in vis_insp], dtype=object)
+    all_srcs = sorted(set([k for w in names for k in vis_insp[w]]) \
+            | set([w[1] for w in img_srcs]))
+    flags = load_inspection(vis_insp, names, all_srcs)
+    is_visible = has_flag(flags, 'y').any(axis=1)
+    is_absent = has_flag(flags, 'n').any(axis=1)
 
-        # get results.
-        result_i = ''.join([v for k, v in vis_insp[cand_i].items()])
-        is_visible = ('y' in result_i)
-        is_absent = ('n' in result_i)
+    # case 1: visible, case 2: absent, case 3: intermediate, cannot tell.
+    case = np.full(len(names), 'ambiguous', dtype=object)
+    case[is_visible & (~is_absent)] = 'visible'
+    case[(~is_visible) & is_absent] = 'absent'
 
-        # case 1: visible
-        if is_visible and (not is_absent):
-            case_visible.append(cand_i)
-            continue
+    # summary of inspection per image source.
+    insp_repr = np.full(flags.shape, '?', dtype=object)
+    insp_repr[has_flag(flags, 'n')] = 'N'
+    insp_repr[has_flag(flags, 'y')] = 'Y'
+    insp_repr[np.equal(flags, None)] = 'N/A'
 
-        # case 2: absent
-        if (not is_visible) and is_absent:
-            case_absent.append(cand_i)
-            continue
+    get = lambda key: np.array([cand_events[w][key] for w in names],
+            dtype=object)
+    table = Table([('name', names), ('type', get('type')), ('ra', get('ra')),
+            ('dec', get('dec')), ('redshift', get('redshift')),
+            ('case', case)] + [(label_j, insp_repr[:, all_srcs.index(key_j)]) \
+            for label_j, key_j in img_srcs])
 
-        # case 3: intermediate, cannot tell.
-        case_ambiguous.append(cand_i)
+    if args.format != 'text':
+        table.write(args.output or sys.stdout, fmt=args.format)
+        sys.exit(0)
 
     # print three lists of events.
+    fp_out = open(args.output, 'w') if args.output else sys.stdout
     fmtstr_event = '{:24} {:32} {:18} {:18} {:16}'
     fmtstr_visinsp = '{:8} {:8} {:8} {:12} {:8}'
-    img_srcs = ['SDSS', 'ps1', 'DECaLS', 'MzLS/BASS', 'DES']
-    for cand_list in (case_visible, case_absent, case_ambiguous):
-        print('\n\n\n\n\n')
+    img_labels = [w[0] for w in img_srcs]
+    for case_i in ('visible', 'absent', 'ambiguous'):
+        print('\n\n\n\n\n', file=fp_out)
         print(fmtstr_event.format('Name', 'Type', 'RA', 'Dec', 'Z'), \
-              fmtstr_visinsp.format(*img_srcs))
-        for cand_i in cand_list:
-            cand_info_i = cand_events[cand_i]
-            cand_str = fmtstr_event.format(
-                cand_i,
-                cand_info_i['type'],
-                cand_info_i['ra'],
-                cand_info_i['dec'],
-                cand_info_i['redshift'],
-            )
-            vinsp_info_i = vis_insp[cand_i]
-            insp_repr_i = list()
-            for imsrc_i in img_srcs:
-                if imsrc_i not in vinsp_info_i:
-                    insp_repr_i.append('N/A')
-                    continue
-                if 'y' in vinsp_info_i[imsrc_i]:
-                    insp_repr_i.append('Y')
-                    continue
-                if 'n' in vinsp_info_i[imsrc_i]:
-                    insp_repr_i.append('N')
-                    continue
-                insp_repr_i.append('?')
-            vinsp_str = fmtstr_visinsp.format(*insp_repr_i)
-            print(cand_str, vinsp_str)
+              fmtstr_visinsp.format(*img_labels), file=fp_out)
+        for row_j in table.take(case == case_i).rows():
+            print(fmtstr_event.format(*row_j[:5]),
+                  fmtstr_visinsp.format(*row_j[6:]), file=fp_out)
@@ -5,9 +5,12 @@
     ** For compatibility issues, please run this script under python2
 
     190506: Download FITS files.
+
+    Run with `fits` to download single-band FITS cutouts instead of the colour
+    JPEG, for local rendering with `render-stamps.py`.
 '''
 
-import os, sys, time
+import os, sys, time, re
 import warnings
 
 import logging
@@ -21,6 +24,13 @@ from astropy.coordinates import SkyCoord
 from panstamps.downloader import downloader
 from panstamps.image import image
 
+import netstats
+
+def downloaded_nbytes(file_lists):
+    ''' Total size of files returned by the PS1 downloader '''
+    return sum([os.path.getsize(w) for files in file_lists \
+            for w in (files or []) if os.path.isfile(w)])
+
 def to_bytes(s):
     if isinstance(s, unicode):
         return s.encode('utf-8')
@@ -37,6 +47,8 @@ if __name__ == '__main__':
     logging.basicConfig()
     log = logging.getLogger()
 
+    netstats.enable()
+
     # read events.
     with open('candidate-events.json', 'r') as fp:
         cand_events = json.load(fp, object_hook=to_bytes,)
@@ -45,8 +57,15 @@ if __name__ == '__main__':
     with open('nearest-host-candidate.json', 'r') as fp:
         nearest_hosts = json.load(fp, object_hook=to_bytes,)
 
-    if os.path.isfile('image-cutout-ps1.json'):
-        with open('image-cutout-ps1.json', 'r') as fp:
+    # colour JPEG, or single-band FITS files.
+    get_fits = 'fits' in sys.argv
+    if get_fits:
+        cutout_file = 'image-cutout-ps1-fits.json'
+    else:
+        cutout_file = 'image-cutout-ps1.json'
+
+    if os.path.isfile(cutout_file):
+        with open(cutout_file, 'r') as fp:
             image_cutout = json.load(fp, object_hook=to_bytes,)
     else:
         image_cutout = OrderedDict()
@@ -63,6 +82,7 @@ if __name__ == '__main__':
 
         # having valid local images, skip
         if (event_i in image_cutout) and (image_cutout[event_i]['ps1']):
+            netstats.cache_hit('ps1')
             continue
 
         # get nearby sources,
@@ -81,27 +101,51 @@ if __name__ == '__main__':
 
         # locate image
         try:
-            fits_files, jpeg_files, color_files = downloader(
+            ps1_downloader = downloader(
                 log=log,
                 settings=False,
                 downloadDirectory='./ps1-stamps/',
-                fits=False,
-                jpeg=True,
+                fits=get_fits,
+                jpeg=(not get_fits),
                 arcsecSize=120,
                 filterSet='gri',
-                color=True,
-                singleFilters=False,
+                color=(not get_fits),
+                singleFilters=get_fits,
                 ra='%f'%(crd_i.ra.deg,),
                 dec="%f"%(crd_i.dec.deg),
                 imageType="stack",
                 mjdStart=False,
                 mjdEnd=False,
                 window=False
-            ).get()
+            )
+            fits_files, jpeg_files, color_files = netstats.call('ps1',
+                    ps1_downloader.get, nbytes=downloaded_nbytes)
         except:
             continue
             # there is an undebuggable error here.
 
+        if get_fits:
+
+            if not fits_files:
+                image_cutout[event_i] = dict(ps1=None)
+                continue
+
+            # rename, and index by filter.
+            fits_bands_i = OrderedDict()
+            for file_j in fits_files:
+                dir_j, fname_j = os.path.split(file_j)
+                band_j = re.search('_([grizy])_', fname_j).group(1)
+                new_name_j = dir_j + '/' + event_i + '-' + fname_j
+                os.rename(file_j, new_name_j)
+                fits_bands_i[band_j] = new_name_j
+            image_cutout[event_i] = dict(ps1=fits_bands_i)
+
+            I_counter += 1
+            if not I_counter % 7:
+                with open(cutout_file, 'w') as fp:
+                    json.dump(image_cutout, fp)
+            continue
+
         if not color_files:
             image_cutout[event_i] = dict(ps1=None)
             continue # coordinates beyond survey footprint: skip.
@@ -131,8 +175,8 @@ if __name__ == '__main__':
 
         I_counter += 1
         if not I_counter % 7:
-            with open('image-cutout-ps1.json', 'w') as fp:
+            with open(cutout_file, 'w') as fp:
                 json.dump(image_cutout, fp)
 
-    with open('image-cutout-ps1.json', 'w') as fp:
+    with open(cutout_file, 'w') as fp:
         json.dump(image_cutout, fp)
@@ -6,13 +6,14 @@
 
 import os
 import sys
-import json
 from collections import namedtuple, OrderedDict
 
 from tqdm import tqdm
-import requests
 
-from astropy.coordinates import SkyCoord
+import netstats
+import profiling
+from coords import event_coords
+from jsonio import load_json, dump_json, open_events
 
 def get_stamp_skyviewer(ra, dec, saveto=None, zoom=14, layer='ls-dr67'):
 
@@ -48,9 +49,10 @@ def get_stamp_skyviewer(ra, dec, saveto=None, zoom=14, layer='ls-dr67'):
             'mzls+bass-dr6', 'decals-dr5', 'des-dr1', 'unwise-neo']:
         raise RuntimeError('Invalid `layer` option.')
 
-    ls_url = '''http://legacysurvey.org//viewer/jpeg-cutout'''
+    ls_url = netstats.service_url('legacysurvey', 'http://legacysurvey.org/') \
+            + '/viewer/jpeg-cutout'
     req_payload = dict(ra=ra, dec=dec, zoom=zoom, layer=layer)
-    resp = requests.get(ls_url, params=req_payload)
+    resp = netstats.get('legacysurvey', ls_url, retries=2, params=req_payload)
 
     # test if empty
     if resp.url.endswith('blank.jpg'):
@@ -70,6 +72,66 @@ def get_stamp_skyviewer(ra, dec, saveto=None, zoom=14, layer='ls-dr67'):
 
     return saveto
 
+def get_fits_skyviewer(ra, dec, saveto=None, layer='ls-dr67', bands='grz',
+        pixscale=0.262, size=256):
+
+    '''
+    Get FITS cutout of an object from legacysurvey.org Sky Viewer.
+
+    Parameters
+    ----------
+    ra, dec : float
+        R.A. and declination of the image center in degrees.
+
+    saveto : str
+        File name of output file ('fits' automatically added).
+        Use `None` to return the file content directly.
+
+    layer : str
+        Which survey (and data release) to retrieve, as in
+        `get_stamp_skyviewer`.
+
+    bands : str
+        Bands to retrieve, one plane per band in the returned data cube.
+
+    pixscale : float
+        Pixel scale in arcsec/pix.
+
+    size : int
+        Image size in pixels.
+
+    Returns
+    -------
+    Saved filename, or binary file content when `saveto` is None.
+    '''
+
+    # sanity check
+    if layer not in ['sdssco', 'ls-dr67', 'decals-dr7',
+            'mzls+bass-dr6', 'decals-dr5', 'des-dr1', 'unwise-neo']:
+        raise RuntimeError('Invalid `layer` option.')
+
+    ls_url = netstats.service_url('legacysurvey', 'http://legacysurvey.org/') \
+            + '/viewer/fits-cutout'
+    req_payload = dict(ra=ra, dec=dec, layer=layer, bands=bands,
+            pixscale=pixscale, size=size)
+    resp = netstats.get('legacysurvey', ls_url, retries=2, params=req_payload)
+
+    # not a FITS file: no data here.
+    if not resp.content.startswith(b'SIMPLE'):
+        raise RuntimeError('Coordinates outside survey footprint.')
+
+    if saveto is None:
+        return resp.content
+
+    # add fits suffix
+    if not saveto.endswith('.fits'):
+        saveto += '.fits'
+
+    with open(saveto, 'wb') as fp:
+        fp.write(resp.content)
+
+    return saveto
+
 def get_stamp_sdss(ra, dec, saveto=None, scale=0.4,):
 
     '''
@@ -92,10 +154,11 @@ def get_stamp_sdss(ra, dec, saveto=None, scale=0.4,):
     Filename, or binary image data when `saveto` is None.
     '''
 
-    ss_url = '''http://skyserver.sdss.org/dr14/SkyServerWS/ImgCutout/getjpeg'''
+    ss_url = netstats.service_url('skyserver', 'http://skyserver.sdss.org') \
+            + '/dr14/SkyServerWS/ImgCutout/getjpeg'
     req_payload = dict(TaskName='Skyserver.Chart.List',
             ra=ra, dec=dec, scale=scale, width=400, height=400, opt='')
-    resp = requests.get(ss_url, params=req_payload)
+    resp = netstats.get('skyserver', ss_url, retries=2, params=req_payload)
 
     # if nowhere to save.
     if saveto is None:
@@ -110,30 +173,63 @@ def get_stamp_sdss(ra, dec, saveto=None, scale=0.4,):
 
     return saveto
 
-if (__name__ == '__main__') and ('run' in sys.argv):
+def is_hostless_candidate(nearby_srcs, max_dist_kpc=30.):
+    ''' True if there is no non-stellar source within `max_dist_kpc` '''
+    for src_j in nearby_srcs:
+        # projected distance > 30 kpc, not a star
+        if (src_j[-2] < max_dist_kpc) and ('S' not in src_j[6]):
+            return False
+    return True
+
+# Sky Viewer layers, bands and pixel scales (asec/pix) of FITS cutouts.
+# Pixel scales match the JPEG stamps (see `stamp_sizes`, annotate-stamps.py)
+fits_layers = OrderedDict([
+    ('DECaLS',    ('decals-dr7',    'grz', 0.25 / 0.9375)),
+    ('MzLS-BASS', ('mzls+bass-dr6', 'grz', 0.25 / 0.9375)),
+    ('DES',       ('des-dr1',       'grz', 0.25 / 0.9375)),
+    ('SDSS',      ('sdssco',        'gri', 0.20)),
+])
+
+def get_stamps(cand_events, nearest_hosts, image_cutout=None,
+        checkpoint='image-cutout.json'):
 
-    # read events.
-    with open('candidate-events.json', 'r') as fp:
-        cand_events = json.load(fp, object_pairs_hook=OrderedDict)
+    '''
+    Get JPEG stamps of hostless candidates from the Sky Viewer and save
+    them into ./image-stamps/.
+
+    Parameters
+    ----------
+    cand_events : dict
+        Candidate events (candidate-events.json).
+
+    nearest_hosts : dict or jsonio.JsonlStore
+        Nearby sources (nearest-host-candidate.json, see `open_events`).
 
-    # read nearest host candidates.
-    with open('nearest-host-candidate.json', 'r') as fp:
-        nearest_hosts = json.load(fp, object_pairs_hook=OrderedDict)
+    image_cutout : OrderedDict
+        Stamps retrieved so far, events in it are skipped.
 
-    if os.path.isfile('image-cutout.json'):
-        with open('image-cutout.json', 'r') as fp:
-            image_cutout = json.load(fp, object_pairs_hook=OrderedDict)
-    else:
+    checkpoint : str
+        File to save the list into every 97 events, or None.
+
+    Returns
+    -------
+    image_cutout : OrderedDict
+        Event name -> file name (or None) per image source.
+    '''
+
+    if image_cutout is None:
         image_cutout = OrderedDict()
 
     fname_fmt = './image-stamps/{}-{}.jpg'
 
     # for events in the list, find their image in major surveys.
     I_counter = 0
-    for event_i, event_info_i in tqdm( \
-            cand_events.items(), total=len(cand_events)):
+    event_crds = event_coords(cand_events)
+    for event_i, event_info_i in profiling.iter_events(tqdm( \
+            cand_events.items(), total=len(cand_events))):
 
         if event_i in image_cutout:
+            netstats.cache_hit('legacysurvey', len(image_cutout[event_i]))
             continue # already retrieved, skip.
 
         # get its nearest host candidate
@@ -154,27 +250,22 @@ if (__name__ == '__main__') and ('run' in sys.argv):
             continue
         '''
 
-        # find objects without galaxies in 25 kpc.
-        is_cand = True
-        for src_j in nh_i:
-            # projected distance > 30 kpc, not a star
-            if (src_j[-2] < 30.) and ('S' not in src_j[6]):
-                is_cand = False
-        if not is_cand:
+        # find objects without galaxies in 30 kpc.
+        if not is_hostless_candidate(nh_i):
             continue
 
         # read RA, Dec of the event,
-        crd_i = SkyCoord(ra=event_info_i['ra'],
-                         dec=event_info_i['dec'],
-                         unit=('hour', 'deg'))
+        if event_i not in event_crds:
+            continue # missing or malformed coordinates.
+        ra_i, dec_i = event_crds[event_i]
 
         img_files_i = OrderedDict()
 
         # get image from legacysurvey dr6/7
         fname_i = fname_fmt.format(event_i.replace(' ', '_'), 'DECaLS')
         try:
-            img_files_i['DECaLS'] = get_stamp_skyviewer(crd_i.ra.deg, \
-                    crd_i.dec.deg, saveto=fname_i, layer='decals-dr7')
+            img_files_i['DECaLS'] = get_stamp_skyviewer(ra_i, \
+                    dec_i, saveto=fname_i, layer='decals-dr7')
         except Exception as err:
             if 'outside survey footprint' in str(err):
                 img_files_i['DECaLS'] = None
@@ -184,8 +275,8 @@ if (__name__ == '__main__') and ('run' in sys.argv):
         #
         fname_i = fname_fmt.format(event_i.replace(' ', '_'), 'MzLS-BASS')
         try:
-            img_files_i['MzLS-BASS'] = get_stamp_skyviewer(crd_i.ra.deg, \
-                    crd_i.dec.deg, saveto=fname_i, layer='mzls+bass-dr6')
+            img_files_i['MzLS-BASS'] = get_stamp_skyviewer(ra_i, \
+                    dec_i, saveto=fname_i, layer='mzls+bass-dr6')
         except Exception as err:
             if 'outside survey footprint' in str(err):
                 img_files_i['MzLS-BASS'] = None
@@ -197,8 +288,8 @@ if (__name__ == '__main__') and ('run' in sys.argv):
         # get DES
         fname_i = fname_fmt.format(event_i.replace(' ', '_'), 'DES')
         try:
-            img_files_i['DES'] = get_stamp_skyviewer(crd_i.ra.deg, \
-                    crd_i.dec.deg, saveto=fname_i, layer='des-dr1')
+            img_files_i['DES'] = get_stamp_skyviewer(ra_i, \
+                    dec_i, saveto=fname_i, layer='des-dr1')
         except Exception as err:
             if 'outside survey footprint' in str(err):
                 img_files_i['DES'] = None
@@ -208,8 +299,8 @@ if (__name__ == '__main__') and ('run' in sys.argv):
         # get SDSS
         fname_i = fname_fmt.format(event_i.replace(' ', '_'), 'SDSS')
         try:
-            img_files_i['SDSS'] = get_stamp_skyviewer(crd_i.ra.deg, \
-                    crd_i.dec.deg, saveto=fname_i, layer='sdssco')
+            img_files_i['SDSS'] = get_stamp_skyviewer(ra_i, \
+                    dec_i, saveto=fname_i, layer='sdssco')
         except Exception as err:
             if 'outside survey footprint' in str(err):
                 img_files_i['SDSS'] = None
@@ -219,13 +310,95 @@ if (__name__ == '__main__') and ('run' in sys.argv):
         image_cutout[event_i] = img_files_i
 
         I_counter += 1
-        if not I_counter % 97:
-            with open('image-cutout.json', 'w') as fp:
-                json.dump(image_cutout, fp)
+        if checkpoint and not I_counter % 97:
+            dump_json(image_cutout, checkpoint, pretty=False)
+
+    return image_cutout
+
+def get_fits_stamps(cand_events, nearest_hosts, image_cutout=None,
+        checkpoint='image-cutout-fits.json'):
+
+    '''
+    Get FITS cutouts of hostless candidates from the Sky Viewer and save
+    them into ./image-stamps-fits/. Same as `get_stamps`.
+    '''
+
+    if image_cutout is None:
+        image_cutout = OrderedDict()
+
+    fname_fmt = './image-stamps-fits/{}-{}.fits'
+    if not os.path.isdir('./image-stamps-fits/'):
+        os.makedirs('./image-stamps-fits/')
+
+    I_counter = 0
+    event_crds = event_coords(cand_events)
+    for event_i, event_info_i in profiling.iter_events(tqdm( \
+            cand_events.items(), total=len(cand_events))):
+
+        if event_i in image_cutout:
+            netstats.cache_hit('legacysurvey', len(image_cutout[event_i]))
+            continue # already retrieved, skip.
+
+        if not is_hostless_candidate(nearest_hosts[event_i]):
+            continue
+
+        if event_i not in event_crds:
+            continue # missing or malformed coordinates.
+        ra_i, dec_i = event_crds[event_i]
+
+        # one request per layer (see the note above)
+        img_files_i = OrderedDict()
+        for imsrc_j, (layer_j, bands_j, pixscale_j) in fits_layers.items():
+            fname_j = fname_fmt.format(event_i.replace(' ', '_'), imsrc_j)
+            try:
+                img_files_i[imsrc_j] = get_fits_skyviewer(ra_i, \
+                        dec_i, saveto=fname_j, layer=layer_j,
+                        bands=bands_j, pixscale=pixscale_j, size=256)
+            except Exception as err:
+                if 'outside survey footprint' in str(err):
+                    img_files_i[imsrc_j] = None
+                else:
+                    raise
+
+        image_cutout[event_i] = img_files_i
+
+        I_counter += 1
+        if checkpoint and not I_counter % 97:
+            dump_json(image_cutout, checkpoint, pretty=False)
+
+    return image_cutout
+
+if __name__ == '__main__':
+    netstats.enable()
+    profiling.enable()
+
+if (__name__ == '__main__') and ('run' in sys.argv):
+
+    # read events.
+    cand_events = load_json('candidate-events.json')
+
+    # read nearest host candidates (on demand, if stored as JSON Lines).
+    nearest_hosts = open_events('nearest-host-candidate.json')
+
+    image_cutout = load_json('image-cutout.json', missing_ok=True)
+    image_cutout = get_stamps(cand_events, nearest_hosts, image_cutout)
 
     #
-    with open('image-cutout.json', 'w') as fp:
-        json.dump(image_cutout, fp)
+    dump_json(image_cutout, 'image-cutout.json', pretty=False)
+
+# FITS cutouts, to be rendered locally by `render-stamps.py`
+if (__name__ == '__main__') and ('runfits' in sys.argv):
+
+    # read events.
+    cand_events = load_json('candidate-events.json')
+
+    # read nearest host candidates (on demand, if stored as JSON Lines).
+    nearest_hosts = open_events('nearest-host-candidate.json')
+
+    image_cutout = load_json('image-cutout-fits.json', missing_ok=True)
+    image_cutout = get_fits_stamps(cand_events, nearest_hosts, image_cutout)
+
+    dump_json(image_cutout, 'image-cutout-fits.json', pretty=False)
 
 #
 if (__name__ == '__main__') and ('test' in sys.argv):
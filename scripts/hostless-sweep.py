@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+'''
+    Hostless status of every event for a grid of distance thresholds and
+    star-flag policies, from nearest-host-candidate.json in one pass.
+
+    An event is hostless at a threshold `d` if it has no non-stellar
+    neighbor within `d` proper kpc. Star-flag policies (see
+    `report.nearest_distance`):
+        object:  cross-matched objects, stellar if any source is flagged,
+                 at the mean distance of their sources (the 30 kpc cut of
+                 print-table.py)
+        source:  single sources not flagged as stars (get-image-stamps.py,
+                 30 kpc)
+        none:    all sources
+        display: the source displayed for the nearest object within 30 kpc
+                 (the 20 kpc cut of print-table.py, on the distance of that
+                 source)
+
+    Sources were searched within 30 kpc (at most 120 arcsec, see
+    search-vizier.py), so thresholds beyond that are incomplete.
+
+    The table has one row per event: 'name', 'redshift', the nearest
+    distance per policy ('dist_<policy>', kpc) and the status per policy
+    and threshold ('hostless_<policy>_<kpc>', 1 if hostless). The number of
+    hostless events per threshold is printed.
+
+    Usage:
+        python hostless-sweep.py [--kpc 5 10 20 30 | --kpc-grid 2 30 2]
+            [--policies object source none display]
+            [--format csv|parquet|html]
+            [--output hostless-sweep.csv]
+'''
+
+import sys
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+import profiling
+from sforzando import stage
+from report import Table, load_events, load_sources, nearest_distance, \
+        star_policies
+from jsonio import load_json, open_events
+
+# largest search radius of nearby sources, kpc.
+search_kpc = 30.
+
+def sweep(events, sources, thresholds, policies=star_policies,
+        source_name_order=None):
+
+    '''
+    Hostless status for all thresholds and policies.
+
+    Parameters
+    ----------
+    events, sources : Table
+        Candidate events and nearby sources (`report.load_events`,
+        `report.load_sources`).
+
+    thresholds : array-like
+        Distance thresholds, proper kpc.
+
+    policies : list of str
+        Star-flag policies.
+
+    source_name_order : list of str
+        Order of surveys for the displayed source (policy 'display').
+
+    Returns
+    -------
+    Table of events, with nearest distances and hostless flags.
+    '''
+
+    thresholds = np.asarray(thresholds, dtype='f8')
+    table = Table([('name', events['name']),
+            ('redshift', events['redshift'])])
+    for policy_i in policies:
+        dist_i = nearest_distance(sources, len(events), star_policy=policy_i,
+                source_name_order=source_name_order)
+        table['dist_' + policy_i] = dist_i
+        hostless_i = (dist_i[:, None] >= thresholds[None, :]).astype('i1')
+        for j_thr, thr_j in enumerate(thresholds):
+            table['hostless_%s_%g' % (policy_i, thr_j)] = hostless_i[:, j_thr]
+    return table
+
+if __name__ == '__main__':
+
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kpc', type=float, nargs='+',
+            default=[5., 10., 15., 20., 25., 30.],
+            help='Distance thresholds, proper kpc.')
+    parser.add_argument('--kpc-grid', type=float, nargs=3, default=None,
+            metavar=('START', 'STOP', 'STEP'),
+            help='Grid of thresholds (STOP included), instead of --kpc.')
+    parser.add_argument('--policies', nargs='+', default=star_policies,
+            choices=star_policies)
+    parser.add_argument('--format', default='csv',
+            choices=['csv', 'parquet', 'html'])
+    parser.add_argument('--output', default='hostless-sweep.csv')
+    args = parser.parse_args()
+
+    if args.kpc_grid:
+        start, stop, step = args.kpc_grid
+        thresholds = np.arange(start, stop + step / 2., step)
+    else:
+        thresholds = np.array(sorted(set(args.kpc)))
+    if thresholds.max() > search_kpc:
+        print('Warning: sources were searched within %g kpc only.' \
+                % search_kpc, file=sys.stderr)
+
+    # read events and nearby sources.
+    events = load_events(load_json('candidate-events.json'))
+    sources = load_sources(open_events('nearest-host-candidate.json'),
+            events['name'])
+
+    with profiling.phase('sweep'):
+        table = sweep(events, sources, thresholds, policies=args.policies,
+                source_name_order=stage('print-table').source_name_order)
+    table.write(args.output, fmt=args.format)
+
+    # summary.
+    fmtstr = '{:>8}' + ' {:>8}' * len(args.policies)
+    print(fmtstr.format('kpc', *args.policies))
+    for thr_i in thresholds:
+        print(fmtstr.format('%g' % thr_i, *[int(table['hostless_%s_%g' \
+                % (w, thr_i)].sum()) for w in args.policies]))
+    print('Events:', len(events))
+
+# EOF
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+'''
+    Continuous ingest of newly announced transients.
+
+    The OSC tree is polled for new or modified event files. Events in them
+    that pass the selection (see `find-hostless-events.py`) and are new, or
+    changed since they were selected, go through the catalog searches, the
+    association of nearby sources and the stamp download straight away, and
+    are added to the existing outputs (candidate-events.json, ...,
+    image-cutout.json). Their stamps are annotated into ./annotated/, added
+    to annotated-images.json and, if `inspection.db` exists, to the queue of
+    the inspection server.
+
+    Sizes and modification times of the files seen so far are kept in
+    `ingest-state.json`. Without it, all files are read once, but only
+    events that differ from candidate-events.json are processed. Events
+    that no longer pass the selection are removed from the outputs (but not
+    from the queue of inspection.db).
+
+    Usage:
+        python ingest-events.py [--interval 60] [--once] [--no-datalab]
+'''
+
+import os
+import sys
+import time
+import argparse
+from collections import OrderedDict
+
+import netstats
+import profiling
+from sforzando import stage
+from jsonio import load_json, dump_json
+
+state_file = './ingest-state.json'
+
+# outputs: file name -> pretty
+outputs = OrderedDict([
+    ('candidate-events.json', True),
+    ('candidate-hosts.json', False),
+    ('candidate-hosts-dl.json', False),
+    ('nearest-host-candidate.json', False),
+    ('survey-coverage.json', True),
+    ('image-cutout.json', False),
+    ('annotated-images.json', True),
+])
+
+def changed_files(osc_dir, state):
+
+    '''
+    JSON files in the OSC tree that are new or modified since `state`.
+
+    Returns
+    -------
+    files : list of str
+
+    state : dict
+        File name -> [mtime_ns, size] of all files, for the next poll.
+    '''
+
+    files, new_state = list(), dict()
+    for subdir, dirs, files_i in os.walk(osc_dir):
+        for file_j in sorted(files_i):
+            if '.json' != file_j.lower()[-5:]:
+                continue
+            path_j = subdir + '/' + file_j
+            try:
+                st_j = os.stat(path_j)
+            except OSError: # removed in the meantime.
+                continue
+            new_state[path_j] = [st_j.st_mtime_ns, st_j.st_size]
+            if state.get(path_j) != new_state[path_j]:
+                files.append(path_j)
+    return files, new_state
+
+def select_changed(files, cand_events):
+
+    '''
+    Select candidates in files, compared with existing candidates.
+
+    Returns
+    -------
+    batch : OrderedDict
+        New or changed candidate events.
+
+    dropped : list of str
+        Events that are no longer candidates.
+
+    unreadable : list of str
+        Files that could not be parsed (e.g. still being written).
+    '''
+
+    select_event = stage('find-hostless-events').select_event
+
+    batch, dropped, unreadable = OrderedDict(), list(), list()
+    for file_i in files:
+        try:
+            events_i = load_json(file_i)
+        except ValueError: # still being written.
+            unreadable.append(file_i)
+            continue
+        for event_name_j, event_info_j in events_i.items():
+            cand_j = select_event(event_info_j)
+            if cand_j is None:
+                if event_name_j in cand_events:
+                    dropped.append(event_name_j)
+            elif cand_events.get(event_name_j) != cand_j:
+                batch[event_name_j] = cand_j
+    return batch, dropped, unreadable
+
+def annotate_new(batch, res):
+    ''' Annotate stamps of events in `batch`, returns new stamps. '''
+    annotate_image = stage('annotate-stamps').annotate_image
+    new_images = OrderedDict()
+    for event_i in batch:
+        if event_i not in res['image-cutout.json']:
+            continue # not a hostless candidate.
+        new_images[event_i] = OrderedDict()
+        for imsrc_j, imfile_j in res['image-cutout.json'][event_i].items():
+            new_images[event_i][imsrc_j] = None if imfile_j is None else \
+                    annotate_image(event_i, batch[event_i], imsrc_j,
+                    imfile_j, res['nearest-host-candidate.json'][event_i],
+                    desti_dir='./annotated/')
+    res['annotated-images.json'].update(new_images)
+    return new_images
+
+def ingest(batch, dropped, token=None):
+
+    '''
+    Process new or changed events, and add them to the outputs.
+
+    Parameters
+    ----------
+    batch : OrderedDict
+        Candidate events, as in candidate-events.json.
+
+    dropped : list of str
+        Events to remove from the outputs.
+
+    token : str
+        Data Lab token, or None to skip the Data Lab search.
+
+    Returns
+    -------
+    OrderedDict of new annotated stamps, as in annotated-images.json.
+    '''
+
+    res = OrderedDict([(w, load_json(w, missing_ok=True)) for w in outputs])
+
+    # earlier results of changed events are out of date.
+    for event_i in list(batch) + list(dropped):
+        for data_j in res.values():
+            data_j.pop(event_i, None)
+    res['candidate-events.json'].update(batch)
+
+    with profiling.phase('search'):
+        stage('search-vizier').search_vizier(batch,
+                candidate_hosts=res['candidate-hosts.json'],
+                checkpoint=None)
+        if token is not None:
+            stage('search-datalab').search_datalab(batch, token,
+                    candidate_hosts=res['candidate-hosts-dl.json'],
+                    checkpoint=None)
+
+    # without Data Lab, sources from Vizier only.
+    hosts_dl = OrderedDict([(w, res['candidate-hosts-dl.json'].get(w,
+            OrderedDict())) for w in batch])
+    nearest_src, survey_coverage = \
+            stage('sort-nearby-sources').sort_sources(batch,
+            res['candidate-hosts.json'], hosts_dl)
+    res['nearest-host-candidate.json'].update(nearest_src)
+    res['survey-coverage.json'].update(survey_coverage)
+
+    stage('get-image-stamps').get_stamps(batch,
+            res['nearest-host-candidate.json'],
+            image_cutout=res['image-cutout.json'], checkpoint=None)
+
+    with profiling.phase('annotate'):
+        new_images = annotate_new(batch, res)
+
+    for file_i, pretty_i in outputs.items():
+        dump_json(res[file_i], file_i, pretty=pretty_i)
+
+    return new_images
+
+def enqueue(new_images):
+    ''' Add stamps to the queue of the inspection server, if there is one. '''
+    inspect_server = stage('inspect-server')
+    if not os.path.isfile(inspect_server.db_file):
+        return 0
+    conn = inspect_server.connect()
+    try:
+        return inspect_server.add_stamps(conn, new_images)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+
+    netstats.enable()
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--osc-dir',
+            default=stage('find-hostless-events').osc_dir)
+    parser.add_argument('--interval', type=float, default=60.,
+            help='Seconds between polls of the OSC tree.')
+    parser.add_argument('--once', action='store_true',
+            help='Poll once and exit.')
+    parser.add_argument('--no-datalab', action='store_true',
+            help='Skip the Data Lab search (no login).')
+    args = parser.parse_args()
+
+    # log in once, before waiting for events.
+    token = None if args.no_datalab else stage('search-datalab').login()
+
+    for dir_i in ['./image-stamps/', './annotated/']:
+        if not os.path.isdir(dir_i):
+            os.makedirs(dir_i)
+
+    state = load_json(state_file, missing_ok=True)
+    while True:
+
+        files, new_state = changed_files(args.osc_dir, state)
+        if files:
+            batch, dropped, unreadable = select_changed(files,
+                    load_json('candidate-events.json', missing_ok=True))
+            for file_i in unreadable: # try again at the next poll.
+                new_state.pop(file_i)
+            try:
+                if batch or dropped:
+                    new_images = ingest(batch, dropped, token=token)
+                    n_queued = enqueue(new_images)
+                    print(time.strftime('%Y-%m-%d %H:%M:%S'),
+                            'Files:', len(files), 'New/changed:', len(batch),
+                            'Dropped:', len(dropped), 'Stamps:',
+                            sum([len([v for v in w.values() if v]) \
+                            for w in new_images.values()]),
+                            'Queued:', n_queued)
+                    sys.stdout.flush()
+            except Exception as err: # e.g. network errors, try again later.
+                if args.once:
+                    raise
+                print('Failed:', repr(err), file=sys.stderr)
+                new_state = state
+            else:
+                dump_json(new_state, state_file, pretty=False)
+        state = new_state
+
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+# EOF
@@ -0,0 +1,459 @@
+#!/usr/bin/python
+
+'''
+    Visual inspection server for many inspectors.
+
+    Stamps and verdicts are kept in a SQLite database (WAL mode), so that
+    inspectors work on a shared queue at the same time, and every verdict is
+    a row with inspector and time. Consensus of every stamp is updated in the
+    same transaction as the verdict.
+
+    Usage:
+        python inspect-server.py init           # create inspection.db
+        python inspect-server.py serve          # http://localhost:8080/
+        python inspect-server.py export         # write JSON files
+
+    `export` writes `visual-inspection-??.json` (per inspector) and
+    `visual-inspection-combined.json` (consensus), as used by the other
+    scripts. Automatic flags of `prescreen-stamps.py` are verdicts of the
+    inspector 'auto'.
+
+    Visual inspection flags (see `generate-new-list.py`):
+        c: potential close-by host object
+        y: host object visible
+        n: host object invisible
+        q: poor image quality
+        f: flag for interesting cases (not used for consensus)
+'''
+
+import os
+import re
+import sys
+import io
+import json
+import glob
+import time
+import random
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from jsonio import load_json, dump_json
+
+db_file = './inspection.db'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS stamps (
+    id          INTEGER PRIMARY KEY,
+    event       TEXT NOT NULL,
+    imsrc       TEXT NOT NULL,
+    imfile      TEXT NOT NULL,
+    rank        REAL NOT NULL,
+    n_verdicts  INTEGER NOT NULL DEFAULT 0,
+    lease_by    TEXT,
+    lease_until REAL,
+    UNIQUE (event, imsrc)
+);
+CREATE TABLE IF NOT EXISTS verdicts (
+    stamp_id    INTEGER NOT NULL REFERENCES stamps(id),
+    inspector   TEXT NOT NULL,
+    flags       TEXT NOT NULL,
+    time        REAL NOT NULL,
+    PRIMARY KEY (stamp_id, inspector)
+);
+CREATE TABLE IF NOT EXISTS votes (
+    stamp_id    INTEGER NOT NULL REFERENCES stamps(id),
+    flags       TEXT NOT NULL,
+    n           INTEGER NOT NULL,
+    PRIMARY KEY (stamp_id, flags)
+);
+CREATE TABLE IF NOT EXISTS consensus (
+    stamp_id    INTEGER PRIMARY KEY REFERENCES stamps(id),
+    flags       TEXT,
+    n_agree     INTEGER NOT NULL,
+    n_total     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stamps_queue ON stamps (n_verdicts, rank);
+'''
+
+def connect(filename=db_file):
+    ''' Open the database in WAL mode. '''
+    conn = sqlite3.connect(filename, timeout=30., isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+    return conn
+
+def safe_name(inspector):
+    ''' Inspector name usable in file names. '''
+    return re.sub(r'[^\w.-]', '_', inspector).lstrip('.')
+
+def vote_key(flags):
+    ''' Flags compared between inspectors (favorite flag ignored) '''
+    return ''.join(sorted(flags.replace('f', '')))
+
+def update_consensus(conn, stamp_id):
+    ''' Majority vote of a stamp from its vote counts. '''
+    votes = conn.execute('SELECT flags, n FROM votes WHERE stamp_id = ? '
+            'AND n > 0 ORDER BY n DESC, flags', (stamp_id,)).fetchall()
+    n_total = sum([w[1] for w in votes])
+    if votes and (2 * votes[0][1] > n_total):
+        flags, n_agree = votes[0]
+    else:
+        flags, n_agree = None, (votes[0][1] if votes else 0)
+    conn.execute('INSERT OR REPLACE INTO consensus VALUES (?, ?, ?, ?)',
+            (stamp_id, flags, n_agree, n_total))
+
+def record_verdict(conn, stamp_id, inspector, flags, timestamp=None):
+
+    '''
+    Save a verdict, and update vote counts and consensus of the stamp.
+
+    A later verdict of the same inspector on the same stamp replaces the
+    earlier one. Raises KeyError for unknown stamps.
+    '''
+
+    timestamp = timestamp or time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if conn.execute('SELECT 1 FROM stamps WHERE id = ?',
+                (stamp_id,)).fetchone() is None:
+            raise KeyError('unknown stamp %s' % (stamp_id,))
+        prev = conn.execute('SELECT flags FROM verdicts WHERE stamp_id = ? '
+                'AND inspector = ?', (stamp_id, inspector)).fetchone()
+        if prev is not None:
+            conn.execute('UPDATE votes SET n = n - 1 WHERE stamp_id = ? '
+                    'AND flags = ?', (stamp_id, vote_key(prev[0])))
+        else:
+            conn.execute('UPDATE stamps SET n_verdicts = n_verdicts + 1 '
+                    'WHERE id = ?', (stamp_id,))
+        conn.execute('INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)',
+                (stamp_id, inspector, flags, timestamp))
+        conn.execute('INSERT OR IGNORE INTO votes VALUES (?, ?, 0)',
+                (stamp_id, vote_key(flags)))
+        conn.execute('UPDATE votes SET n = n + 1 WHERE stamp_id = ? '
+                'AND flags = ?', (stamp_id, vote_key(flags)))
+        conn.execute('UPDATE stamps SET lease_by = NULL, lease_until = NULL '
+                'WHERE id = ? AND lease_by = ?', (stamp_id, inspector))
+        update_consensus(conn, stamp_id)
+        conn.execute('COMMIT')
+    except:
+        conn.execute('ROLLBACK')
+        raise
+
+def next_stamp(conn, inspector, n_per_stamp=1, lease_time=600.):
+
+    '''
+    Hand out the next stamp to an inspector.
+
+    Stamps with fewer verdicts come first, stamps already inspected by this
+    inspector are skipped. The stamp is leased to the inspector for
+    `lease_time` seconds, so that others do not get it meanwhile.
+
+    Returns
+    -------
+    (id, event, imsrc) of the stamp, or None if nothing left.
+    '''
+
+    t_now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('''
+            SELECT id, event, imsrc FROM stamps
+            WHERE n_verdicts < ?
+                AND (lease_until IS NULL OR lease_until < ? OR lease_by = ?)
+                AND id NOT IN
+                    (SELECT stamp_id FROM verdicts WHERE inspector = ?)
+            ORDER BY n_verdicts, rank LIMIT 1
+        ''', (n_per_stamp, t_now, inspector, inspector)).fetchone()
+        if row is not None:
+            conn.execute('UPDATE stamps SET lease_by = ?, lease_until = ? '
+                    'WHERE id = ?', (inspector, t_now + lease_time, row[0]))
+        conn.execute('COMMIT')
+    except:
+        conn.execute('ROLLBACK')
+        raise
+    return row
+
+def add_stamps(conn, annotated_images, rng=random):
+
+    '''
+    Add stamps to the queue, in random order. Stamps already in the queue
+    are kept as they are.
+
+    Returns
+    -------
+    Number of stamps added.
+    '''
+
+    n_added = 0
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for event_i, images_i in annotated_images.items():
+            for imsrc_j, imfile_j in images_i.items():
+                if not imfile_j: # skip null
+                    continue
+                n_added += conn.execute('INSERT OR IGNORE INTO stamps '
+                        '(event, imsrc, imfile, rank) VALUES (?, ?, ?, ?)',
+                        (event_i, imsrc_j, imfile_j, rng.random())).rowcount
+        conn.execute('COMMIT')
+    except:
+        conn.execute('ROLLBACK')
+        raise
+    return n_added
+
+def add_auto_flags(conn, prescreen):
+
+    '''
+    Automatic flags of `prescreen-stamps.py` as verdicts of inspector
+    'auto', for stamps in the queue without any verdict.
+
+    Returns
+    -------
+    Number of verdicts added.
+    '''
+
+    stamp_ids = {(w[1], w[2]): w[0] for w in conn.execute( \
+            'SELECT id, event, imsrc FROM stamps WHERE n_verdicts = 0')}
+    n_added = 0
+    for event_i, stats_i in prescreen.items():
+        for imsrc_j, stats_j in stats_i.items():
+            id_j = stamp_ids.get((event_i, imsrc_j), None)
+            if stats_j.get('auto') and (id_j is not None):
+                record_verdict(conn, id_j, 'auto', stats_j['auto'])
+                n_added += 1
+    return n_added
+
+def init_db(conn, seed=None):
+
+    '''
+    Fill the queue from `annotated-images.json`, import old results and
+    automatic flags (`prescreen-stats.json`).
+    '''
+
+    conn.executescript(schema)
+
+    annotated_images = load_json('./annotated-images.json')
+    add_stamps(conn, annotated_images, rng=random.Random(seed))
+
+    # existing results of the Tk application.
+    stamp_ids = {(w[1], w[2]): w[0] for w in \
+            conn.execute('SELECT id, event, imsrc FROM stamps')}
+    for file_i in sorted(glob.glob('./visual-inspection-??.json')):
+        inspector_i = file_i[-7:-5]
+        t_file_i = os.path.getmtime(file_i)
+        results_i = load_json(file_i)
+        for event_j, images_j in results_i.items():
+            for imsrc_k, flags_k in images_j.items():
+                if (event_j, imsrc_k) in stamp_ids:
+                    record_verdict(conn, stamp_ids[(event_j, imsrc_k)],
+                            inspector_i, flags_k, timestamp=t_file_i)
+    add_auto_flags(conn, load_json('./prescreen-stats.json', missing_ok=True))
+
+    n_stamps = conn.execute('SELECT COUNT(*) FROM stamps').fetchone()[0]
+    n_verdicts = conn.execute('SELECT COUNT(*) FROM verdicts').fetchone()[0]
+    print('Stamps:', n_stamps, 'Verdicts:', n_verdicts)
+
+def export_json(conn):
+
+    ''' Write per-inspector results and the consensus as JSON files. '''
+
+    rows = conn.execute('''
+        SELECT verdicts.inspector, stamps.event, stamps.imsrc, verdicts.flags
+        FROM verdicts JOIN stamps ON stamps.id = verdicts.stamp_id
+        ORDER BY verdicts.inspector, stamps.event
+    ''')
+    per_inspector = OrderedDict()
+    for inspector_i, event_i, imsrc_i, flags_i in rows:
+        insp_i = per_inspector.setdefault(inspector_i, OrderedDict())
+        insp_i.setdefault(event_i, OrderedDict())[imsrc_i] = flags_i
+    for inspector_i, results_i in per_inspector.items():
+        dump_json(results_i, 'visual-inspection-%s.json' \
+                % (safe_name(inspector_i),))
+
+    rows = conn.execute('''
+        SELECT stamps.event, stamps.imsrc, consensus.flags
+        FROM consensus JOIN stamps ON stamps.id = consensus.stamp_id
+        WHERE consensus.flags IS NOT NULL ORDER BY stamps.event
+    ''')
+    inspection_cb = OrderedDict()
+    for event_i, imsrc_i, flags_i in rows:
+        inspection_cb.setdefault(event_i, OrderedDict())[imsrc_i] = flags_i
+    dump_json(inspection_cb, 'visual-inspection-combined.json')
+
+    print('Inspectors:', len(per_inspector),
+          'Stamps with consensus:', sum(map(len, inspection_cb.values())))
+
+page_html = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>sforzando inspection</title>
+<style>body{background:#222;color:#ddd;font-family:monospace;text-align:center}
+img{width:800px;height:800px;image-rendering:auto}</style></head>
+<body>
+<div id="info">Loading...</div><img id="stamp"><div id="keys">
+Up: visible, Down: absent, q: low quality, c: close-by, f: favorite,
+Left: back</div>
+<script>
+var inspector = new URLSearchParams(location.search).get('inspector')
+        || prompt('Inspector (two letters):');
+var current = null, history = [], fav = false;
+function show(s) {
+    current = s; fav = false;
+    if (!s.id) { document.getElementById('info').textContent = 'Done.'; return; }
+    document.getElementById('info').textContent = s.event + ' / ' + s.imsrc;
+    document.getElementById('stamp').src = '/stamp/' + s.id;
+}
+function next() {
+    fetch('/api/next?inspector=' + inspector).then(r => r.json()).then(show);
+}
+function verdict(flag) {
+    if (!current || !current.id) return;
+    history.push(current);
+    fetch('/api/verdict', {method: 'POST', body: JSON.stringify({
+        id: current.id, inspector: inspector, flags: flag + (fav ? 'f' : '')
+    })}).then(next);
+}
+document.onkeydown = function(e) {
+    if (e.key == 'ArrowUp') verdict('y');
+    else if (e.key == 'ArrowDown') verdict('n');
+    else if (e.key == 'q') verdict('q');
+    else if (e.key == 'c') verdict('c');
+    else if (e.key == 'f') { fav = !fav;
+        document.getElementById('info').textContent += fav ? ' *' : ''; }
+    else if (e.key == 'ArrowLeft' && history.length) show(history.pop());
+};
+next();
+</script></body></html>
+'''
+
+class InspectionHandler(BaseHTTPRequestHandler):
+
+    ''' HTTP API of the inspection server. '''
+
+    # set by `serve`
+    n_per_stamp, lease_time, stamp_overlays = 1, 600., dict()
+    local = threading.local()
+
+    @property
+    def conn(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = connect()
+        return self.local.conn
+
+    def send(self, body, content_type='application/json', status=200):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/':
+            self.send(page_html, 'text/html')
+        elif url.path == '/api/next':
+            inspector = safe_name(query.get('inspector', [''])[0])
+            if not inspector:
+                return self.send('{"error": "no inspector"}', status=400)
+            row = next_stamp(self.conn, inspector,
+                    self.n_per_stamp, self.lease_time)
+            keys = ('id', 'event', 'imsrc')
+            self.send(json.dumps(dict(zip(keys, row)) if row else dict()))
+        elif url.path.startswith('/stamp/'):
+            try:
+                stamp_id = int(url.path.split('/')[-1])
+            except ValueError:
+                return self.send('{"error": "bad stamp id"}', status=400)
+            self.send_stamp(stamp_id)
+        elif url.path == '/api/stats':
+            stats = OrderedDict([(k, self.conn.execute(v).fetchone()[0]) \
+                    for k, v in [
+                ('stamps', 'SELECT COUNT(*) FROM stamps'),
+                ('inspected', 'SELECT COUNT(*) FROM stamps '
+                        'WHERE n_verdicts > 0'),
+                ('verdicts', 'SELECT COUNT(*) FROM verdicts'),
+                ('consensus', 'SELECT COUNT(*) FROM consensus '
+                        'WHERE flags IS NOT NULL'),
+            ]])
+            self.send(json.dumps(stats))
+        else:
+            self.send('{"error": "not found"}', status=404)
+
+    def send_stamp(self, stamp_id):
+        row = self.conn.execute('SELECT event, imsrc, imfile FROM stamps '
+                'WHERE id = ?', (stamp_id,)).fetchone()
+        if row is None:
+            return self.send('{"error": "not found"}', status=404)
+        event_i, imsrc_i, imfile_i = row
+        overlay_i = self.stamp_overlays.get(event_i, {}).get(imsrc_i, None)
+        if overlay_i is None: # already annotated, send as it is.
+            with open(imfile_i, 'rb') as fp:
+                return self.send(fp.read(), 'image/jpeg')
+        from PIL import Image
+        from overlays import draw_overlay
+        img = draw_overlay(Image.open(imfile_i).convert('RGB'), overlay_i)
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', quality=90)
+        self.send(buf.getvalue(), 'image/jpeg')
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/api/verdict':
+            return self.send('{"error": "not found"}', status=404)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+            stamp_id, inspector, flags = int(data['id']), \
+                    safe_name(str(data['inspector'])), str(data['flags'])
+            if not inspector:
+                raise ValueError('no inspector')
+        except (ValueError, KeyError, TypeError) as err:
+            return self.send(json.dumps(dict(error=str(err))), status=400)
+        try:
+            record_verdict(self.conn, stamp_id, inspector, flags)
+        except KeyError as err:
+            return self.send(json.dumps(dict(error=str(err))), status=404)
+        self.send('{"ok": true}')
+
+    def log_message(self, fmt, *args):
+        pass # quiet.
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['init', 'serve', 'export'])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--n-per-stamp', type=int, default=1,
+            help='Number of inspectors per stamp.')
+    parser.add_argument('--lease-time', type=float, default=600.)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    conn = connect()
+
+    if args.mode == 'init':
+        init_db(conn, seed=args.seed)
+
+    if args.mode == 'export':
+        export_json(conn)
+
+    if args.mode == 'serve':
+        conn.executescript(schema)
+        InspectionHandler.n_per_stamp = args.n_per_stamp
+        InspectionHandler.lease_time = args.lease_time
+        InspectionHandler.stamp_overlays = \
+                load_json('./stamp-overlays.json', missing_ok=True)
+        server = ThreadingHTTPServer((args.host, args.port),
+                InspectionHandler)
+        print('Serving on http://%s:%d/' % (args.host, args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+# EOF
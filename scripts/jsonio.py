@@ -0,0 +1,485 @@
+#!/usr/bin/python
+
+'''
+    Reading and writing JSON files of the pipeline.
+
+    Uses `orjson` (native, serializes NumPy types) if installed, otherwise
+    the standard library with `npEncoder`. Files are written atomically (a
+    temporary file in the same directory, then renamed), and top-level dicts
+    are written one entry at a time, so large outputs are never built as one
+    string in memory.
+
+    Pretty-printing is optional: `pretty=False` writes compact JSON, which
+    is much faster for large files (e.g., candidate-hosts.json). With
+    `orjson`, pretty output is indented by two spaces. NaN and infinity are
+    written as null either way; files with NaN written by older versions
+    are still read.
+
+    Large outputs with one entry per event may also be stored as JSON Lines
+    (the same name, with `.jsonl`): one line `{"event": value}` per event.
+    `JsonlStore` reads and writes them one event at a time, so only the
+    positions of lines are kept in memory.
+
+    For storage and transfer, they are packed (`.jsonz`, see
+    `pack-artifacts.py`): the same lines, compressed in blocks of about
+    256 kB (with `zstandard` if installed, otherwise `zlib`), and an index
+    of events and blocks at the end. `PackedStore` decompresses only the
+    block of the event that is read.
+
+    `load_json('x.json')` reads the newest of `x.json`, `x.jsonl` and
+    `x.jsonz`, and `open_events` returns a `JsonlStore` or a `PackedStore`
+    for the latter two.
+'''
+
+import os
+import json
+import struct
+import itertools
+from json.decoder import scanstring
+import tempfile
+from collections import OrderedDict
+
+import profiling
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+replace = getattr(os, 'replace', os.rename) # Python 2
+
+# permission of new files (`mkstemp` creates them as 0600)
+umask = os.umask(0)
+os.umask(umask)
+
+def finite_or_none(obj):
+    ''' Non-finite floats in lists and dicts into None, as orjson does. '''
+    if isinstance(obj, float):
+        return obj if (obj - obj == 0.) else None
+    if isinstance(obj, dict):
+        return obj.__class__([(k, finite_or_none(v)) for k, v in obj.items()])
+    if isinstance(obj, (list, tuple)):
+        return [finite_or_none(w) for w in obj]
+    return obj
+
+def np_default(obj):
+    ''' NumPy types into Python types, for `json.dump(default=...)` '''
+    import numpy as np # only with NumPy objects, loaded by then.
+    if isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.floating):
+        return finite_or_none(float(obj))
+    elif isinstance(obj, np.bool_):
+        return bool(obj)
+    elif isinstance(obj, np.ndarray):
+        return finite_or_none(obj.tolist())
+    raise TypeError('Object of type %s is not JSON serializable' \
+            % type(obj).__name__)
+
+class npEncoder(json.JSONEncoder):
+    """ Special json encoder for np types """
+    def default(self, obj):
+        try:
+            return np_default(obj)
+        except TypeError:
+            return json.JSONEncoder.default(self, obj)
+
+def loads_json(data):
+    '''
+    Parse bytes, keeping the order of keys. NaN and Infinity (not JSON,
+    but written by `json.dump`) are accepted.
+    '''
+    if orjson is not None: # dicts are ordered (Python 3.7+)
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass # e.g., NaN, parsed below.
+    return json.loads(data.decode('utf-8'), object_pairs_hook=OrderedDict)
+
+def stored_file(filename):
+    '''
+    File to read for `filename`: the newest of 'x.json', 'x.jsonl' and
+    'x.jsonz' (the later one if they are as new), or `filename` if none of
+    them exists.
+    '''
+    if not filename.endswith('.json'):
+        return filename
+    stored = [(os.path.getmtime(w), i, w) for i, w in enumerate( \
+            [filename, filename + 'l', filename + 'z']) if os.path.isfile(w)]
+    return max(stored)[-1] if stored else filename
+
+def load_json(filename, missing_ok=False):
+
+    '''
+    Read a JSON (or JSON Lines) file, keeping the order of keys.
+
+    Parameters
+    ----------
+    filename : str
+        JSON file.
+
+    missing_ok : bool
+        Return an empty OrderedDict if the file does not exist.
+    '''
+
+    filename = stored_file(filename)
+    if missing_ok and (not os.path.isfile(filename)):
+        return OrderedDict()
+    if filename.endswith('.jsonl') or filename.endswith('.jsonz'):
+        with open_events(filename) as store, profiling.phase('load'):
+            return OrderedDict(store.items())
+    with profiling.phase('load'):
+        with open(filename, 'rb') as fp:
+            return loads_json(fp.read())
+
+def dumps_json(obj, pretty=False):
+    ''' Serialize into bytes. '''
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    obj = finite_or_none(obj)
+    if pretty:
+        return json.dumps(obj, indent=4, cls=npEncoder).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'),
+            default=np_default).encode('utf-8')
+
+def iter_json(obj, pretty=False):
+
+    '''
+    Serialize into chunks of bytes, one per entry of a top-level dict (or
+    of a `JsonlStore` or `PackedStore`).
+    '''
+
+    if not hasattr(obj, 'items'):
+        yield dumps_json(obj, pretty=pretty)
+        return
+
+    if not obj:
+        yield b'{}'
+        return
+
+    indent = (b'  ' if orjson is not None else b'    ') if pretty else b''
+    newline, colon = (b'\n', b': ') if pretty else (b'', b':')
+    for i_item, (key, value) in enumerate(obj.items()):
+        value = dumps_json(value, pretty=pretty)
+        if pretty:
+            value = value.replace(b'\n', b'\n' + indent)
+        yield (b',' if i_item else b'{') + newline + indent \
+                + dumps_json(str(key)) + colon + value
+    yield newline + b'}'
+
+def dump_json(obj, filename, pretty=True):
+
+    '''
+    Write a JSON file atomically.
+
+    Parameters
+    ----------
+    obj : object
+        Object to write, may contain NumPy types.
+
+    filename : str
+        Output file, replaced only after the new one is complete. A dict is
+        written as JSON Lines if the name ends with '.jsonl', and packed if
+        it ends with '.jsonz'.
+
+    pretty : bool
+        Indented output (default), or compact.
+    '''
+
+    if filename.endswith('.jsonl'):
+        chunks = (dumps_json(OrderedDict([(key, value)])) + b'\n' \
+                for key, value in obj.items())
+    elif filename.endswith('.jsonz'):
+        chunks = iter_packed(obj.items())
+    else:
+        chunks = iter_json(obj, pretty=pretty)
+
+    with profiling.phase('serialize'):
+        write_atomic(filename, chunks)
+
+def write_atomic(filename, chunks):
+    ''' Write chunks of bytes into a new file, then rename it. '''
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_file = tempfile.mkstemp(dir=dirname,
+            prefix='.' + os.path.basename(filename) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            for chunk in chunks:
+                fp.write(chunk)
+        os.chmod(tmp_file, 0o666 & ~umask)
+        replace(tmp_file, filename)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+class JsonlStore(object):
+
+    '''
+    Events in a JSON Lines file, read and written one at a time, as a dict.
+
+    The file is read once when opened, to find the line of every event.
+    Values are read from the file when accessed, and new values are
+    appended (and flushed) at once, so a stage can be interrupted and
+    continued, and memory does not grow with the size of the values. An
+    event written again is read from its last line. A last line without
+    newline (an interrupted write) is removed.
+
+    Parameters
+    ----------
+    filename : str
+        JSON Lines file.
+
+    mode : 'r', 'a' or 'w'
+        Read only, read and append (default), or start an empty file.
+    '''
+
+    def __init__(self, filename, mode='a'):
+        self.filename, self.mode = filename, mode
+        self.index = OrderedDict() # key -> (offset, length)
+        if mode == 'r' or (mode == 'a' and os.path.isfile(filename)):
+            self.fp = open(filename, 'rb' if mode == 'r' else 'r+b')
+            self.scan()
+        else:
+            self.fp = open(filename, 'w+b')
+
+    def scan(self):
+        ''' Find the line of every event. '''
+        offset = 0
+        for line in self.fp:
+            if not line.endswith(b'\n'): # interrupted write.
+                if self.mode != 'r':
+                    self.fp.truncate(offset)
+                break
+            if len(line) > 1:
+                self.index[line_key(line)] = (offset, len(line))
+            offset += len(line)
+
+    def __getitem__(self, key):
+        offset, length = self.index[key]
+        self.fp.seek(offset)
+        return loads_json(self.fp.read(length))[key]
+
+    def __setitem__(self, key, value):
+        line = dumps_json(OrderedDict([(key, value)])) + b'\n'
+        self.fp.seek(0, os.SEEK_END)
+        offset = self.fp.tell()
+        self.fp.write(line)
+        self.fp.flush()
+        self.index[key] = (offset, len(line))
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def get(self, key, default=None):
+        return self[key] if key in self.index else default
+
+    def items(self):
+        ''' (key, value) of all events, read one at a time. '''
+        for key in list(self.index):
+            yield key, self[key]
+
+    def values(self):
+        for key, value in self.items():
+            yield value
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def line_key(line):
+    ''' Key of a line `{"key": value}` of JSON Lines, without parsing it. '''
+    head = line[:1024].decode('utf-8', 'ignore')
+    return scanstring(head, head.index('"') + 1)[0]
+
+# block size of packed files, bytes before compression.
+packed_block_size = 256 * 1024
+
+def packed_codecs():
+    ''' Codecs for packed files, preferred first. '''
+    try:
+        import zstandard
+        return ['zstd', 'zlib']
+    except ImportError:
+        return ['zlib']
+
+def packed_codec(codec, level=None):
+
+    '''
+    Functions (compress, decompress) of a codec, 'zstd' or 'zlib'.
+    '''
+
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('`zstandard` is needed for zstd-packed files.')
+        return (zstandard.ZstdCompressor(level=level or 9).compress,
+                zstandard.ZstdDecompressor().decompress)
+    if codec == 'zlib':
+        import zlib
+        return (lambda data: zlib.compress(data, level or 6),
+                zlib.decompress)
+    raise ValueError('Unknown codec `%s`.' % codec)
+
+def iter_packed(items, codec=None, level=None, block_size=None):
+
+    '''
+    Pack events into chunks of bytes (a `.jsonz` file).
+
+    The file starts with a line `jsonz 1 CODEC`, followed by compressed
+    blocks of JSON Lines (events are not split between blocks) and the
+    compressed index: `{"blocks": [[offset, length, raw length], ...],
+    "keys": [...], "block": [...]}` (block of each key). The last 16 bytes
+    are the offset and length of the index (little-endian uint64).
+
+    Parameters
+    ----------
+    items : iterable
+        (key, value) of events.
+
+    codec : 'zstd' or 'zlib'
+        Compression (default: zstd if `zstandard` is installed).
+
+    level : int
+        Compression level (default: 9 for zstd, 6 for zlib).
+
+    block_size : int
+        Bytes of JSON Lines per block, before compression.
+    '''
+
+    codec = codec or packed_codecs()[0]
+    compress = packed_codec(codec, level)[0]
+    block_size = block_size or packed_block_size
+
+    header = ('jsonz 1 %s\n' % codec).encode('ascii')
+    yield header
+
+    offset, blocks, keys, key_blocks = len(header), list(), list(), list()
+    lines, n_bytes = list(), 0
+    for key, value in itertools.chain(items, [(None, None)]):
+        if lines and ((key is None) or (n_bytes >= block_size)):
+            data = compress(b''.join(lines))
+            blocks.append([offset, len(data), n_bytes])
+            offset += len(data)
+            lines, n_bytes = list(), 0
+            yield data
+        if key is None: # end of events.
+            break
+        lines.append(dumps_json(OrderedDict([(key, value)])) + b'\n')
+        n_bytes += len(lines[-1])
+        keys.append(key)
+        key_blocks.append(len(blocks))
+
+    index = compress(dumps_json(OrderedDict([('blocks', blocks),
+            ('keys', keys), ('block', key_blocks)])))
+    yield index + struct.pack('<QQ', offset, len(index))
+
+class PackedStore(object):
+
+    '''
+    Events in a packed file (`.jsonz`, see `iter_packed`), as a read-only
+    dict.
+
+    Only the index is read when opened. Reading an event decompresses its
+    block, which is kept until an event of another block is read, so
+    reading events in order decompresses every block once.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fp = open(filename, 'rb')
+        header = self.fp.readline().split()
+        if header[:2] != [b'jsonz', b'1']:
+            self.fp.close()
+            raise ValueError('`%s` is not a packed file.' % filename)
+        self.codec = header[2].decode('ascii')
+        self.decompress = packed_codec(self.codec)[1]
+        self.fp.seek(-16, os.SEEK_END)
+        offset, length = struct.unpack('<QQ', self.fp.read(16))
+        self.fp.seek(offset)
+        index = loads_json(self.decompress(self.fp.read(length)))
+        self.blocks = index['blocks']
+        self.index = OrderedDict(zip(index['keys'], index['block']))
+        self.i_block, self.lines = None, None
+
+    def block(self, i_block):
+        ''' Lines of a block, by key. '''
+        if i_block != self.i_block:
+            offset, length, n_bytes = self.blocks[i_block]
+            self.fp.seek(offset)
+            data = self.decompress(self.fp.read(length))
+            self.lines = dict([(line_key(w), w) for w in \
+                    data.splitlines() if w])
+            self.i_block = i_block
+        return self.lines
+
+    def __getitem__(self, key):
+        return loads_json(self.block(self.index[key])[key])[key]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def get(self, key, default=None):
+        return self[key] if key in self.index else default
+
+    def items(self):
+        ''' (key, value) of all events, one block at a time. '''
+        for key in self.index:
+            yield key, self[key]
+
+    def values(self):
+        for key, value in self.items():
+            yield value
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_events(filename):
+
+    '''
+    Events of a JSON file, as a dict, or as a read-only `JsonlStore` or
+    `PackedStore` if it is stored as JSON Lines or packed (see
+    `stored_file`).
+    '''
+
+    filename = stored_file(filename)
+    if filename.endswith('.jsonl'):
+        return JsonlStore(filename, mode='r')
+    if filename.endswith('.jsonz'):
+        return PackedStore(filename)
+    return load_json(filename)
+
+# EOF
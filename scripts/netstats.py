@@ -0,0 +1,215 @@
+#!/usr/bin/python
+
+'''
+    Instrumentation of remote calls (Vizier, Data Lab, Sky Viewer, SkyServer,
+    PS1 cutout server).
+
+    Every remote call goes through `call()` (or `get()` for plain HTTP
+    requests), which records, per endpoint: latency histogram, bytes
+    transferred, status codes, errors and retries. Skipped calls (results
+    found locally) are counted with `cache_hit()`.
+
+    Scripts call `enable()` once: a summary is printed at exit, and the
+    metrics are written to a JSON file if `--metrics=FILE` is given in the
+    command line (or the `SFORZANDO_METRICS` environment variable is set).
+
+    `service_url()` gives the base URL of a service, which can be replaced
+    with `SFORZANDO_<NAME>_URL` (e.g., local stand-ins for benchmarks).
+
+    ** Keep this module compatible with python2 (get-image-stamps-ps1.py)
+'''
+
+import os
+import sys
+import time
+import atexit
+from collections import OrderedDict
+
+import profiling
+from jsonio import dump_json
+
+# upper edges of latency bins, in seconds (last bin is open).
+latency_bins = [0.05, 0.1, 0.2, 0.5, 1., 2., 5., 10., 20., 60., 120.]
+
+class EndpointStats(object):
+
+    ''' Counters of a single remote endpoint. '''
+
+    def __init__(self, name):
+        self.name = name
+        self.n_calls, self.n_errors, self.n_retries = 0, 0, 0
+        self.n_cache_hits, self.n_bytes = 0, 0
+        self.latency = list()
+        self.latency_hist = [0] * (len(latency_bins) + 1)
+        self.status = OrderedDict()
+
+    def add(self, elapsed, nbytes=0, status=None, error=False):
+        ''' Record a single call. '''
+        self.n_calls += 1
+        self.n_errors += int(bool(error))
+        self.n_bytes += int(nbytes or 0)
+        self.latency.append(elapsed)
+        i_bin = 0
+        while (i_bin < len(latency_bins)) and (elapsed > latency_bins[i_bin]):
+            i_bin += 1
+        self.latency_hist[i_bin] += 1
+        if status is not None:
+            status = str(status)
+            self.status[status] = self.status.get(status, 0) + 1
+
+    def percentile(self, q):
+        ''' Percentile of latency (q in 0-100) '''
+        if not self.latency:
+            return float('nan')
+        lat = sorted(self.latency)
+        return lat[min(int(q / 100. * len(lat)), len(lat) - 1)]
+
+    def to_dict(self):
+        return OrderedDict([
+            ('calls', self.n_calls),
+            ('errors', self.n_errors),
+            ('retries', self.n_retries),
+            ('cache_hits', self.n_cache_hits),
+            ('bytes', self.n_bytes),
+            ('total_time', sum(self.latency)),
+            ('latency_p50', self.percentile(50.)),
+            ('latency_p90', self.percentile(90.)),
+            ('latency_p99', self.percentile(99.)),
+            ('latency_max', max(self.latency) if self.latency else None),
+            ('latency_bins', latency_bins),
+            ('latency_hist', self.latency_hist),
+            ('status', self.status),
+        ])
+
+# stats of all endpoints in this process.
+endpoints = OrderedDict()
+
+def get_endpoint(name):
+    ''' Get (or create) stats of an endpoint '''
+    if name not in endpoints:
+        endpoints[name] = EndpointStats(name)
+    return endpoints[name]
+
+def cache_hit(name, n=1):
+    ''' Record calls to `name` avoided by local results. '''
+    get_endpoint(name).n_cache_hits += n
+
+def service_url(name, default):
+    ''' Base URL of a service, or `SFORZANDO_<NAME>_URL` if set. '''
+    return os.environ.get('SFORZANDO_%s_URL' % name.upper(), default)
+
+def response_info(rv):
+    ''' Guess status code and size of a returned object. '''
+    status, nbytes = getattr(rv, 'status_code', None), 0
+    if hasattr(rv, 'content'): # requests.Response
+        nbytes = len(rv.content)
+    elif isinstance(rv, (bytes, str)):
+        nbytes = len(rv)
+    return status, nbytes
+
+def call(name, func, retries=0, retry_wait=2., nbytes=None):
+
+    '''
+    Call a remote function, and record it.
+
+    Parameters
+    ----------
+    name : str
+        Name of the endpoint, e.g. 'vizier', 'datalab', 'legacysurvey'.
+
+    func : callable
+        Function without arguments that does the remote call.
+
+    retries : int
+        Number of retries when `func` raises an exception.
+
+    retry_wait : float
+        Seconds to wait before the first retry; doubled for every retry.
+
+    nbytes : callable
+        Function that returns the size of the result in bytes. By default
+        it is guessed by `response_info`.
+
+    Returns
+    -------
+    The return value of `func`. The exception of the last attempt is
+    re-raised.
+    '''
+
+    stats = get_endpoint(name)
+    for i_try in range(retries + 1):
+        if i_try:
+            stats.n_retries += 1
+            time.sleep(retry_wait * 2 ** (i_try - 1))
+        t_start = time.time()
+        try:
+            with profiling.phase('remote'):
+                rv = func()
+        except Exception as err:
+            stats.add(time.time() - t_start,
+                    status=type(err).__name__, error=True)
+            if i_try == retries:
+                raise
+            continue
+        elapsed = time.time() - t_start
+        status, size = response_info(rv)
+        if nbytes is not None:
+            size = nbytes(rv)
+        error = (status is not None) and (int(status) >= 400)
+        stats.add(elapsed, nbytes=size, status=status, error=error)
+        return rv
+
+def get(name, url, retries=0, **kwargs):
+    ''' Instrumented `requests.get` '''
+    import requests
+    return call(name, lambda: requests.get(url, **kwargs), retries=retries)
+
+def summary(fp=None):
+    ''' Print a summary table of remote calls. '''
+    if not endpoints:
+        return
+    fp = fp or sys.stderr
+    fmtstr = '{:16} {:>8} {:>7} {:>7} {:>7} {:>10} {:>8} {:>8} {:>8} {:>8}'
+    fp.write('\n' + fmtstr.format('Endpoint', 'Calls', 'Errors', 'Retries',
+            'Cached', 'MB', 'Mean_s', 'P50_s', 'P90_s', 'Max_s') + '\n')
+    for name_i, stats_i in endpoints.items():
+        n_i = max(stats_i.n_calls, 1)
+        fp.write(fmtstr.format(name_i, stats_i.n_calls, stats_i.n_errors,
+                stats_i.n_retries, stats_i.n_cache_hits,
+                '%.2f' % (stats_i.n_bytes / 1.e6),
+                '%.3f' % (sum(stats_i.latency) / n_i),
+                '%.3f' % stats_i.percentile(50.),
+                '%.3f' % stats_i.percentile(90.),
+                '%.3f' % (max(stats_i.latency) if stats_i.latency else 0.),
+        ) + '\n')
+        if stats_i.status:
+            fp.write('    status: ' + ', '.join(['%s x%d' % (k, v) \
+                    for k, v in stats_i.status.items()]) + '\n')
+
+def write_metrics(filename):
+    ''' Write metrics of all endpoints into a JSON file. '''
+    metrics = OrderedDict([
+        ('script', os.path.basename(sys.argv[0])),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('endpoints', OrderedDict([(k, v.to_dict()) \
+                for k, v in endpoints.items()])),
+    ])
+    dump_json(metrics, filename)
+
+def metrics_file_from_argv(argv=None):
+    ''' Find `--metrics=FILE` in the command line. '''
+    for arg_i in (argv or sys.argv)[1:]:
+        if arg_i.startswith('--metrics='):
+            return arg_i.split('=', 1)[1]
+    return os.environ.get('SFORZANDO_METRICS', None)
+
+def enable(metrics_file=None):
+    ''' Print summary (and write metrics file) when the script exits. '''
+    metrics_file = metrics_file or metrics_file_from_argv()
+    def _at_exit():
+        summary()
+        if metrics_file:
+            write_metrics(metrics_file)
+    atexit.register(_at_exit)
+
+# EOF
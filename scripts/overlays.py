@@ -0,0 +1,229 @@
+#!/usr/bin/python
+
+'''
+    Overlays of image stamps: reticles, nearby sources, source groups and the
+    circle of projected distance.
+
+    `overlay_geometry` computes the overlay of a stamp as a small dict of
+    lines and circles (in pixels of the original stamp), which can be saved
+    as JSON. `draw_overlay` draws it onto an image of any size, either to
+    burn it into a JPEG (annotate-stamps.py) or at display time
+    (vis-inspect.py).
+'''
+
+import numpy as np
+
+from coords import radec_to_deg
+
+asec_per_deg = 3.6e3
+
+# image size in arcseconds for image files.
+stamp_sizes = {
+    'SDSS': 256 * 0.20,
+    'DES': 256 * 0.25 / 0.9375,
+    'DECaLS': 256 * 0.25 / 0.9375,
+    'MzLS-BASS': 256 * 0.25 / 0.9375,
+    'ps1': 120.,
+}
+
+plot_colors = {
+    'SDSS': '#4286f4', # blue
+    'LS': '#41d3f4', # cyan
+    'PS1': '#f47a42', # orange
+    'DES': '#e83be8', # magenta
+    '2MASS-PSC': '#d11440', # rosy
+    '2MASS-XSC': '#d11440',
+    'HyperLEDA': '#ffffff',
+    '6dFGS': '#ffffff',
+    'Gaia2': '#ffffff'
+}
+
+def source_pixels(event_info, nearby_srcs, im_w, im_h, stamp_size):
+
+    '''
+    Pixel coordinates of nearby sources, in one pass.
+
+    Parameters
+    ----------
+    event_info : dict
+        Event record in `candidate-events.json`.
+
+    nearby_srcs : list of tuple
+        Nearby sources in `nearest-host-candidate.json`.
+
+    im_w, im_h : int
+        Image size in pixels.
+
+    stamp_size : float
+        Image size in arcsec.
+
+    Returns
+    -------
+    xp, yp : ndarray
+        Pixel coordinates of sources.
+    '''
+
+    # get supernova coordinates,
+    ra_c, dec_c = radec_to_deg(event_info['ra'], event_info['dec'])
+    cos_dec_c = np.cos(np.radians(dec_c))
+
+    # relative shift in degrees.
+    ra_s = np.array([w[2] for w in nearby_srcs], dtype='f8')
+    dec_s = np.array([w[3] for w in nearby_srcs], dtype='f8')
+    dra = ((ra_s - ra_c + 180.) % 360. - 180.) * cos_dec_c
+    ddec = dec_s - dec_c
+
+    # then in pixels.
+    xp = (0.5 - dra * asec_per_deg / stamp_size) * (im_w - 1.)
+    yp = (0.5 - ddec * asec_per_deg / stamp_size) * (im_h - 1.)
+
+    return xp, yp
+
+def overlay_geometry(event_info, survey_name, im_w, im_h, nearby_srcs,
+        draw_crosshair=True, crosshair_len=(0.015, 0.035),
+        draw_sources=True, draw_source_groups=True, group_rad=2.0,
+        draw_cicle=True, circle_radius_kpc=25., linewidth_factor=1):
+
+    '''
+    Compute the overlay of an image stamp.
+
+    Parameters
+    ----------
+    event_info : dict
+        Event record in `candidate-events.json`.
+
+    survey_name : str
+        Image source, key of `stamp_sizes`.
+
+    im_w, im_h : int
+        Size of the stamp in pixels.
+
+    nearby_srcs : list of tuple
+        Nearby sources in `nearest-host-candidate.json`.
+
+    Other parameters are the options of `annotate_image`.
+
+    Returns
+    -------
+    overlay : dict
+        'size': [im_w, im_h],
+        'lines': list of [x_0, y_0, x_1, y_1, color, width],
+        'circles': list of [x_c, y_c, radius, color, width].
+    '''
+
+    from astropy.cosmology import WMAP9 as cosmo
+
+    lines, circles = list(), list()
+    r2pix = lambda x, y: \
+            ((0.5 * x + 0.5) * (im_w - 1.), (0.5 - 0.5 * y) * (im_h - 1))
+    stamp_size = stamp_sizes[survey_name]
+    rnd = lambda *w: [round(float(v), 2) for v in w]
+
+    # crosshair
+    if draw_crosshair:
+        ch_c = '#ffffff'
+        lines.append(rnd(*(r2pix(0., 0.05) + r2pix(0., 0.2))) \
+                + [ch_c, linewidth_factor])
+        lines.append(rnd(*(r2pix(0.051, 0.) + r2pix(0.2, 0.))) \
+                + [ch_c, linewidth_factor])
+
+    # pixel coordinates of all nearby sources.
+    if nearby_srcs and (draw_sources or draw_source_groups):
+        xp, yp = source_pixels(event_info, nearby_srcs,
+                im_w, im_h, stamp_size)
+
+    if nearby_srcs and draw_sources:
+
+        im_s = np.sqrt(im_h * im_w)
+        ch_li, ch_lo = crosshair_len[0] * im_s, crosshair_len[1] * im_s
+
+        # within image box.
+        in_box = (xp >= ch_lo) & (yp >= ch_lo) \
+                & (xp <= im_w - (1 + ch_lo)) & (yp <= im_h - (1 + ch_lo))
+
+        for i_src in np.flatnonzero(in_box):
+            xp_i, yp_i = xp[i_src], yp[i_src]
+            color_i = plot_colors[nearby_srcs[i_src][0]]
+            lines.append(rnd(xp_i - ch_lo, yp_i, xp_i - ch_li, yp_i) \
+                    + [color_i, linewidth_factor])
+            lines.append(rnd(xp_i, yp_i + ch_lo, xp_i, yp_i + ch_li) \
+                    + [color_i, linewidth_factor])
+
+    if nearby_srcs and draw_source_groups:
+
+        # index of the first source in each group.
+        grp_id = np.array([w[-1] for w in nearby_srcs])
+        grp_uid, i_first, grp_idx = np.unique(grp_id,
+                return_index=True, return_inverse=True)
+
+        # use proper motion in Gaia DR2 to separate galaxies and stars:
+        # a Gaia source with large proper motion.
+        is_stellar_src = np.array([(w[0] == 'Gaia2') and (w[4] is not None) \
+                and (w[4] / w[5] > 2.) for w in nearby_srcs], dtype=bool)
+        is_stellar = np.bincount(grp_idx, weights=is_stellar_src,
+                minlength=grp_uid.size) > 0
+
+        # group positions, and those within the image box.
+        xp_g, yp_g = xp[i_first], yp[i_first]
+        crad = np.sqrt(im_h * im_w) * (group_rad / stamp_size)
+        in_box = (xp_g >= crad) & (yp_g >= crad) \
+                & (xp_g <= im_w - (1 + crad)) & (yp_g <= im_h - (1 + crad))
+
+        for i_grp in np.flatnonzero(in_box):
+            circles.append(rnd(xp_g[i_grp], yp_g[i_grp], crad) + [
+                    ('#333fff' if is_stellar[i_grp] else '#ef6221'),
+                    linewidth_factor])
+
+    if draw_cicle:
+
+        # calc radius.
+        zred = float(event_info['redshift'])
+        kpc_per_asec = cosmo.kpc_proper_per_arcmin(zred).value / 60.
+
+        if kpc_per_asec != 0.: # in case of bad redshift
+            arad = (circle_radius_kpc / kpc_per_asec) / (stamp_size / im_w)
+            circles.append(rnd((im_w - 1) / 2., (im_h - 1) / 2., arad) \
+                    + ['#999999', linewidth_factor])
+
+    return dict(size=[im_w, im_h], lines=lines, circles=circles)
+
+def draw_overlay(img, overlay, scale_width=False):
+
+    '''
+    Draw an overlay onto a PIL image (in place).
+
+    Parameters
+    ----------
+    img : PIL.Image
+        Image to draw on, of any size: the overlay is scaled accordingly.
+
+    overlay : dict
+        Overlay from `overlay_geometry`.
+
+    scale_width : bool
+        Also scale the line width with the image.
+
+    Returns
+    -------
+    The same image.
+    '''
+
+    from PIL import ImageDraw
+
+    im_w, im_h = overlay['size']
+    sx, sy = (img.size[0] - 1.) / (im_w - 1.), (img.size[1] - 1.) / (im_h - 1.)
+    sw = np.sqrt(sx * sy) if scale_width else 1.
+
+    imdraw = ImageDraw.Draw(img)
+    for x0, y0, x1, y1, color, width in overlay['lines']:
+        imdraw.line([(x0 * sx, y0 * sy), (x1 * sx, y1 * sy)],
+                fill=color, width=max(int(round(width * sw)), 1))
+    for xc, yc, rad, color, width in overlay['circles']:
+        imdraw.ellipse([(xc - rad) * sx, (yc - rad) * sy,
+                (xc + rad) * sx, (yc + rad) * sy],
+                outline=color, width=max(int(round(width * sw)), 1))
+    del imdraw
+
+    return img
+
+# EOF
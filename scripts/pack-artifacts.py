@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+'''
+    Pack large intermediate files into compressed `.jsonz` files, with
+    random access to single events (see `jsonio.iter_packed`).
+
+    Usage:
+        python pack-artifacts.py pack [FILES...] [--codec zstd|zlib]
+            [--level N] [--block-size 256] [--remove]
+        python pack-artifacts.py unpack [FILES...]
+        python pack-artifacts.py info [FILES...]
+
+    FILES are given by their '.json' names (default: candidate-hosts.json,
+    candidate-hosts-dl.json and nearest-host-candidate.json), and are read
+    from the newest of the '.json', '.jsonl' and '.jsonz' files. Packed
+    files are read by the scripts using `jsonio` as they are. `--remove`
+    removes the '.json' and '.jsonl' files once packed; `unpack` writes
+    '.json' files.
+
+    get-image-stamps-ps1.py (Python 2) reads the '.json' files only: run
+    `unpack nearest-host-candidate.json` before it if that was removed.
+'''
+
+import os
+import time
+import argparse
+from collections import OrderedDict
+
+from jsonio import dump_json, open_events, stored_file, write_atomic, \
+        iter_packed, packed_codecs, PackedStore
+
+artifacts = ['candidate-hosts.json', 'candidate-hosts-dl.json',
+        'nearest-host-candidate.json']
+
+# files read as '.json' by scripts without `jsonio`.
+json_only = ['nearest-host-candidate.json']
+
+def pack(filename, codec=None, level=None, block_size=None, remove=False):
+    ''' Pack a file (by its '.json' name), returns the packed file. '''
+    source = stored_file(filename)
+    if source.endswith('.jsonz'):
+        return source # already packed.
+    packed = filename + 'z'
+    events = open_events(source)
+    try:
+        write_atomic(packed, iter_packed(events.items(), codec=codec,
+                level=level, block_size=block_size))
+    finally:
+        if hasattr(events, 'close'):
+            events.close()
+    if remove:
+        for file_i in [filename, filename + 'l']:
+            if os.path.isfile(file_i):
+                os.remove(file_i)
+    return packed
+
+def packed_info(filename):
+    ''' Sizes of a packed file, and time to read one event. '''
+    with PackedStore(filename) as events:
+        n_raw = sum([w[2] for w in events.blocks])
+        key = list(events.keys())[len(events) // 2] if len(events) else None
+        t_start = time.time()
+        if key is not None:
+            events[key]
+        t_read = time.time() - t_start
+        return OrderedDict([
+            ('codec', events.codec),
+            ('events', len(events)),
+            ('blocks', len(events.blocks)),
+            ('raw_mb', n_raw / 1048576.),
+            ('packed_mb', os.path.getsize(filename) / 1048576.),
+            ('ratio', n_raw / float(max(os.path.getsize(filename), 1))),
+            ('read_ms', t_read * 1e3),
+        ])
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['pack', 'unpack', 'info'])
+    parser.add_argument('files', nargs='*', default=artifacts)
+    parser.add_argument('--codec', default=None, choices=['zstd', 'zlib'],
+            help='Compression (default: %s).' % packed_codecs()[0])
+    parser.add_argument('--level', type=int, default=None)
+    parser.add_argument('--block-size', type=int, default=256,
+            help='Block size in kB, before compression.')
+    parser.add_argument('--remove', action='store_true',
+            help='Remove the unpacked files.')
+    args = parser.parse_intermixed_args()
+
+    files = [(w[:-1] if w[-6:] in ('.jsonl', '.jsonz') else w) \
+            for w in args.files]
+
+    for file_i in files:
+        if not os.path.isfile(stored_file(file_i)):
+            print(file_i, 'not found.')
+            continue
+
+        if args.mode == 'pack':
+            size_i = os.path.getsize(stored_file(file_i))
+            packed_i = pack(file_i, codec=args.codec, level=args.level,
+                    block_size=args.block_size * 1024, remove=args.remove)
+            print('%s: %.1f MB -> %.1f MB' % (packed_i, size_i / 1048576.,
+                    os.path.getsize(packed_i) / 1048576.))
+            if args.remove and (file_i in json_only):
+                print('Note: unpack %s before get-image-stamps-ps1.py.' \
+                        % file_i)
+
+        if args.mode == 'unpack':
+            events_i = open_events(file_i)
+            dump_json(events_i, file_i, pretty=False)
+            if hasattr(events_i, 'close'):
+                events_i.close()
+            print(file_i)
+
+        if args.mode == 'info':
+            if not stored_file(file_i).endswith('.jsonz'):
+                print(stored_file(file_i), 'not packed.')
+                continue
+            info_i = packed_info(stored_file(file_i))
+            print(stored_file(file_i) + ':', ', '.join(['%s=%s' % (k, \
+                    ('%.2f' % v) if isinstance(v, float) else v) \
+                    for k, v in info_i.items()]))
+
+# EOF
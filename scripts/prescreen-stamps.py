@@ -0,0 +1,299 @@
+#!/usr/bin/python
+
+'''
+    Pre-screen image stamps before visual inspection.
+
+    For every stamp, compute simple image statistics: fraction of blank
+    (black) and saturated pixels, dynamic range, and the flux excess inside
+    the circle of 25 proper kpc relative to the background of the stamp.
+    Stamps that are clearly bad (blank, flat, saturated, or outside the survey
+    footprint) are flagged as 'q', and stamps with a bright extended object
+    inside the circle as 'y'. For 'y', pixels around sources flagged as stars
+    ('S' in `nearest-host-candidate.json`) and around the event itself are
+    masked, and the bright emission must be wider than a point source and
+    not saturated; otherwise the stamp is left for human inspection.
+
+    These flags are pre-filled into `visual-inspection.json`, so that
+    `vis-inspect.py` only shows the ambiguous stamps, and into
+    `inspection.db` if it exists (verdicts of inspector 'auto', see
+    `inspect-server.py`). `assign-stamps.py` leaves auto-flagged stamps out
+    of the shards. Human results are never overwritten.
+
+    Statistics are saved into `prescreen-stats.json`, with the automatic flag
+    of each stamp (key 'auto'), for later checks.
+
+    Usage: python prescreen-stamps.py run [--dry-run]
+'''
+
+import os
+import sys
+import argparse
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+from PIL import Image
+
+import profiling
+from sforzando import stage
+from overlays import stamp_sizes
+from jsonio import load_json, dump_json, open_events, stored_file
+
+def stamp_stats(image_file, ring_rad_asec, stamp_size, blank_level=3.,
+        saturate_level=250., clip_sigma=5., star_offsets=(),
+        star_mask_asec=4., center_mask_asec=2.):
+
+    '''
+    Image statistics of a stamp.
+
+    Parameters
+    ----------
+    image_file : str
+        JPEG stamp.
+
+    ring_rad_asec : float
+        Radius of the circle of projected distance, in arcsec.
+
+    stamp_size : float
+        Size of the stamp in arcsec.
+
+    blank_level, saturate_level : float
+        Pixels below (above) these values (0-255) are blank (saturated).
+
+    clip_sigma : float
+        Pixels above background + `clip_sigma` * noise are counted as bright.
+
+    star_offsets : list of tuple
+        (east, north) offsets of stars from the stamp center, in arcsec.
+
+    star_mask_asec, center_mask_asec : float
+        Radii of the masks around stars and around the event, in arcsec.
+
+    Returns
+    -------
+    stats : dict
+        'blank_frac', 'saturated_frac': fraction of blank/saturated pixels.
+        'dynamic_range': difference of 99.5 and 0.5 percentiles.
+        'bg', 'noise': background level and noise (median and scaled MAD).
+        'ring_pix': number of pixels inside the circle, outside the masks.
+        'ring_bright_frac': fraction of bright pixels inside the circle.
+        'ring_excess': S/N of the flux excess inside the circle.
+        'ring_saturated': number of saturated pixels inside the circle.
+        'ring_extent': flux-weighted RMS radius of bright pixels, arcsec.
+    '''
+
+    img = np.asarray(Image.open(image_file).convert('L'), dtype='f4')
+    im_h, im_w = img.shape
+
+    # offsets from stamp center in arcsec (north up, east left).
+    pix_scale = stamp_size / im_w
+    yp, xp = np.ogrid[:im_h, :im_w]
+    x_asec = (xp - (im_w - 1) / 2.) * pix_scale
+    y_asec = (yp - (im_h - 1) / 2.) * pix_scale
+    rad = np.hypot(x_asec, y_asec)
+    in_ring = rad < ring_rad_asec
+
+    # mask the event and stars inside the circle.
+    masked = rad < center_mask_asec
+    for east_i, north_i in star_offsets:
+        masked |= np.hypot(x_asec + east_i, y_asec + north_i) \
+                < star_mask_asec
+    in_ring = in_ring & (~masked)
+    n_ring = int(in_ring.sum())
+
+    blank, saturated = img <= blank_level, img >= saturate_level
+    p_lo, p_hi = np.percentile(img, [0.5, 99.5])
+
+    # background and noise from valid pixels outside the circle.
+    bg_pix = img[(~in_ring) & (~blank) & (~saturated)]
+    if bg_pix.size < 16:
+        bg_pix = img[(~blank) & (~saturated)]
+    if bg_pix.size:
+        bg = float(np.median(bg_pix))
+        noise = float(1.4826 * np.median(np.abs(bg_pix - bg)))
+    else:
+        bg, noise = float('nan'), float('nan')
+    noise = max(noise, 1.) # JPEG quantization
+
+    # flux excess inside the circle, and extent of the bright pixels.
+    ring_bright_frac, ring_excess, ring_extent = 0., 0., 0.
+    if n_ring and np.isfinite(bg):
+        ring_pix = img[in_ring] - bg
+        bright = ring_pix > clip_sigma * noise
+        ring_bright_frac = float(bright.mean())
+        ring_excess = float(ring_pix[bright].sum() / (noise * np.sqrt(n_ring)))
+        if bright.any():
+            wt = ring_pix[bright]
+            x_b = np.broadcast_to(x_asec, img.shape)[in_ring][bright]
+            y_b = np.broadcast_to(y_asec, img.shape)[in_ring][bright]
+            x_c, y_c = np.average(x_b, weights=wt), np.average(y_b, weights=wt)
+            ring_extent = float(np.sqrt(np.average((x_b - x_c) ** 2 \
+                    + (y_b - y_c) ** 2, weights=wt)))
+
+    return OrderedDict([
+        ('blank_frac', float(blank.mean())),
+        ('saturated_frac', float(saturated.mean())),
+        ('dynamic_range', float(p_hi - p_lo)),
+        ('bg', bg),
+        ('noise', noise),
+        ('ring_pix', n_ring),
+        ('ring_bright_frac', ring_bright_frac),
+        ('ring_excess', ring_excess),
+        ('ring_saturated', int((saturated & in_ring).sum())),
+        ('ring_extent', ring_extent),
+    ])
+
+def auto_flag(stats, max_blank_frac=0.3, max_saturated_frac=0.2,
+        min_dynamic_range=12., min_ring_bright_frac=0.08,
+        min_ring_excess=50., min_ring_extent=2.):
+
+    '''
+    Flag of a stamp when the statistics are conclusive.
+
+    Returns
+    -------
+    'q' for bad stamps, 'y' for a bright extended object inside the circle
+    (not saturated, and wider than `min_ring_extent` arcsec), or None (left
+    for human inspection).
+    '''
+
+    if stats['blank_frac'] > max_blank_frac \
+            or stats['saturated_frac'] > max_saturated_frac \
+            or stats['dynamic_range'] < min_dynamic_range:
+        return 'q'
+    if stats['ring_pix'] \
+            and stats['ring_bright_frac'] > min_ring_bright_frac \
+            and stats['ring_excess'] > min_ring_excess \
+            and stats['ring_saturated'] == 0 \
+            and stats['ring_extent'] > min_ring_extent:
+        return 'y'
+    return None
+
+def stats_task(task):
+    ''' Statistics of a single stamp, for the process pool '''
+    event_i, imsrc_i, imfile_i, ring_rad_i, stars_i = task
+    try:
+        return event_i, imsrc_i, stamp_stats(imfile_i,
+                ring_rad_i, stamp_sizes[imsrc_i], star_offsets=stars_i)
+    except Exception as err:
+        print('Failed:', imfile_i, err)
+        return event_i, imsrc_i, None
+
+if (__name__ == '__main__') and ('run' in sys.argv):
+
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['run'])
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--ring-kpc', type=float, default=25.)
+    parser.add_argument('--output', default='./visual-inspection.json',
+            help='Inspection results to pre-fill.')
+    parser.add_argument('--db', default='./inspection.db',
+            help='Database of inspect-server.py to pre-fill, if it exists.')
+    parser.add_argument('--dry-run', action='store_true',
+            help='Only compute statistics.')
+    args = parser.parse_args()
+
+    from astropy.cosmology import WMAP9 as cosmo
+
+    # read events.
+    cand_events = load_json('candidate-events.json')
+
+    # stamps to be inspected.
+    annotated_images = load_json('./annotated-images.json')
+
+    # use stamps without annotation when available.
+    raw_stamps = dict()
+    for file_i in ['image-cutout.json', 'image-cutout-ps1.json']:
+        for event_j, images_j in load_json(file_i, missing_ok=True).items():
+            raw_stamps.setdefault(event_j, dict()).update(images_j)
+
+    # radius of the circle, in arcsec, for all events.
+    event_names = list(annotated_images.keys())
+    zred = np.array([abs(float(cand_events[w]['redshift'])) \
+            for w in event_names])
+
+    # offsets of stars (east, north) from events, in arcsec.
+    from report import load_events, load_sources
+    events = load_events(cand_events)
+    sources = load_sources(open_events('nearest-host-candidate.json'),
+            events['name']) if os.path.isfile(stored_file( \
+            'nearest-host-candidate.json')) else load_sources({}, [])
+    is_star = (sources['star_flag'] == 'S') & np.isfinite(sources['ra'])
+    ev_star = sources['event'][is_star]
+    east = (sources['ra'][is_star] - events['ra_deg'][ev_star]) \
+            * np.cos(np.deg2rad(events['dec_deg'][ev_star])) * 3600.
+    east = (east + 648000.) % 1296000. - 648000. # wrap in RA.
+    north = (sources['dec'][is_star] - events['dec_deg'][ev_star]) * 3600.
+    star_offsets = dict()
+    for i_ev, east_i, north_i in zip(ev_star, east, north):
+        star_offsets.setdefault(events['name'][i_ev], list()).append( \
+                (float(east_i), float(north_i)))
+    kpc_per_asec = cosmo.kpc_proper_per_arcmin(zred).value / 60.
+    with np.errstate(divide='ignore'):
+        ring_rad = np.where(kpc_per_asec > 0.,
+                args.ring_kpc / kpc_per_asec, 0.)
+
+    tasks = list()
+    for event_i, ring_rad_i in zip(event_names, ring_rad):
+        for imsrc_j, imfile_j in annotated_images[event_i].items():
+            if not imfile_j: # skip null
+                continue
+            rawfile_j = raw_stamps.get(event_i, {}).get(imsrc_j, None)
+            if rawfile_j and os.path.isfile(rawfile_j):
+                imfile_j = rawfile_j
+            tasks.append((event_i, imsrc_j, imfile_j, float(ring_rad_i),
+                    star_offsets.get(event_i, [])))
+
+    # compute statistics.
+    prescreen = OrderedDict([(w, OrderedDict()) for w in event_names])
+    N_failed = 0
+    with Pool(args.processes) as pool, profiling.phase('events'):
+        for event_i, imsrc_i, stats_i in tqdm(pool.imap_unordered( \
+                stats_task, tasks, chunksize=16), total=len(tasks)):
+            if stats_i is None:
+                N_failed += 1
+                continue
+            stats_i['auto'] = auto_flag(stats_i)
+            prescreen[event_i][imsrc_i] = stats_i
+
+    dump_json(prescreen, 'prescreen-stats.json')
+
+    # pre-fill inspection results.
+    inspection = load_json(args.output, missing_ok=True)
+
+    N_flags, N_prefilled = dict(q=0, y=0), 0
+    for event_i, stats_i in prescreen.items():
+        for imsrc_j, stats_j in stats_i.items():
+            if not stats_j['auto']:
+                continue
+            N_flags[stats_j['auto']] += 1
+            if imsrc_j in inspection.get(event_i, {}):
+                continue # never overwrite.
+            N_prefilled += 1
+            if args.dry_run:
+                continue
+            if event_i not in inspection:
+                inspection[event_i] = OrderedDict()
+            inspection[event_i][imsrc_j] = stats_j['auto']
+
+    if not args.dry_run:
+        dump_json(inspection, args.output)
+        print('Pre-filled in %s:' % args.output, N_prefilled)
+
+    # and into the database of the inspection server.
+    if (not args.dry_run) and os.path.isfile(args.db):
+        server = stage('inspect-server')
+        conn = server.connect(args.db)
+        print('Auto verdicts added to %s:' % args.db,
+                server.add_auto_flags(conn, prescreen))
+        conn.close()
+
+    print('Stamps:', len(tasks), 'Auto-flagged q:', N_flags['q'],
+          'y:', N_flags['y'], 'Not flagged:',
+          len(tasks) - N_failed - N_flags['q'] - N_flags['y'],
+          'Failed:', N_failed)
+
+# EOF
@@ -4,13 +4,20 @@
     List events with the nearest source beyond 30 proper kpc
 
     190506: Flags for survey coverage (YJ)
+
+    Use `--format csv|parquet|html --output FILE` for a machine-readable
+    table, default is the text table on stdout.
 '''
 
-import json
+import sys
+import argparse
 from collections import namedtuple, OrderedDict
 
 import numpy as np
-from astropy.coordinates import SkyCoord
+
+import profiling
+from report import Table, load_events, load_sources, nearest_groups
+from jsonio import load_json, open_events
 
 survey_datasets = [
     'SDSS',
@@ -30,19 +37,67 @@ source_name_order = [
     '6dFGS', 'Gaia2',
 ]
 
-if __name__ == '__main__':
-
-    # read events.
-    with open('candidate-events.json', 'r') as fp:
-        cand_events = json.load(fp, object_pairs_hook=OrderedDict)
-
-    # read nearest host candidates.
-    with open('nearest-host-candidate.json', 'r') as fp:
-        nearest_hosts = json.load(fp, object_pairs_hook=OrderedDict)
-
-    # read survey coverage
-    with open('survey-coverage.json', 'r') as fp:
-        survey_coverage = json.load(fp, object_pairs_hook=OrderedDict)
+def build_table(cand_events, nearest_hosts, survey_coverage):
+
+    '''
+    Table of events without a source within 20 proper kpc, with survey
+    coverage, the nearest source within 30 kpc and links.
+
+    Parameters
+    ----------
+    cand_events, nearest_hosts, survey_coverage : dict
+        Contents of candidate-events.json, nearest-host-candidate.json and
+        survey-coverage.json.
+
+    Returns
+    -------
+    events : report.Table
+    '''
+
+    # load into columns.
+    events = load_events(cand_events)
+    sources = load_sources(nearest_hosts, events['name'])
+
+    # survey coverage.
+    for survey_j in survey_datasets:
+        events['cov_' + survey_j] = np.array([('Y' if survey_j in \
+                survey_coverage[w] else ' ') for w in events['name']])
+
+    # nearest non-stellar cross-matched object within 30 proper kpc,
+    # and its source to display.
+    i_src, N_nearby = nearest_groups(sources, len(events),
+            max_dist_kpc=30., source_name_order=source_name_order)
+    has_src = i_src >= 0
+    i_src_ = np.maximum(i_src, 0)
+    for col_j in ['survey', 'srcid', 'ra', 'dec', 'sep_asec', 'dist_kpc']:
+        values_j = sources[col_j][i_src_] if len(sources) \
+                else np.zeros(len(events), dtype=sources[col_j].dtype)
+        events['src_' + col_j] = np.where(has_src, values_j,
+                None if values_j.dtype == object else np.nan)
+    events['N_nearby'] = N_nearby
+
+    # links.
+    events['ls_link'] = np.array(['http://legacysurvey.org/viewer' \
+            + '?ra={:.7f}&dec={:.7f}&zoom=16'.format(ra_i, dec_i) \
+            for ra_i, dec_i in zip(events['ra_deg'], events['dec_deg'])])
+    events['osc_link'] = np.array(['https://sne.space/sne/{:}/'.format(w) \
+            for w in events['name']])
+
+    # before printing the table: skip events with a source within 20 kpc.
+    return events.take(~(has_src & (events['src_dist_kpc'] < 20.)))
+
+def write_table(events, fmt='text', output=None):
+
+    '''
+    Write the table of `build_table` into a file (stdout if None), as
+    text, or as 'csv', 'parquet' or 'html'.
+    '''
+
+    if fmt != 'text':
+        events.write(output or sys.stdout, fmt=fmt,
+                names=[w for w in events.keys() if w not in \
+                        ('ra_deg', 'dec_deg')])
+        return
 
     fmtstr_event = '{:32} {:28} {:16} {:16} {:16}'
     fmtstr_hostcand = '{:16} {:24} {:10.5f} {:10.5f} {:10.5f} {:10.5f}'
@@ -50,86 +105,55 @@ if __name__ == '__main__':
     fmtstr_coverage = '{:6} {:6} {:6} {:6} {:6}'
     fmtstr_links = '{:96} {:96}'
 
+    fp_out = open(output, 'w') if output else sys.stdout
+
     print(fmtstr_event.format('Event', 'Type', 'RA', 'Dec', 'z') + ' ' \
             + fmtstr_coverage.format(*survey_datasets) + ' ' \
             + fmtstr_hostcand_alt.format('Src', 'Id', 'RA', 'Dec',
                 'Dist_asec', 'Dist_kpc') + ' ' \
-            + fmtstr_links.format('LS_Link', 'OSC_Link'))
-
-    for event_i, event_info_i in cand_events.items():
-
-        line_1 = fmtstr_event.format(
-            event_i,
-            event_info_i['type'],
-            event_info_i['ra'],
-            event_info_i['dec'],
-            event_info_i['redshift'],
-        )
-
-        # find survey coverage.
-        coverage_i = survey_coverage[event_i]
-        cov_i = [('Y' if w in coverage_i else ' ') for w in survey_datasets]
-        line_2 = fmtstr_coverage.format(*cov_i)
-
-        # get list of nearby host candidates, and group by cross-matching.
-        cands_i, cand_group_i = nearest_hosts[event_i], OrderedDict()
-        for src_j in cands_i:
-            if src_j[-1] not in cand_group_i:
-                cand_group_i[src_j[-1]] = list()
-            cand_group_i[src_j[-1]].append(src_j)
-
-        # check if object is stellar-like
-        is_stellar_i = OrderedDict()
-        for j_obj, srcs_j in cand_group_i.items():
-            is_stellar_i[j_obj] = any([w[6] == 'S' for w in srcs_j])
-
-        # calc mean proper dist. from field center.
-        prop_dist_i = OrderedDict()
-        for j_obj, srcs_j in cand_group_i.items():
-            prop_dist_i[j_obj] = np.mean([w[8] for w in srcs_j])
-
-        # check cross-matched soruces (groups) within 30 proper kpc.
-        nearby_grp_id_i = [k for (k, v) in prop_dist_i.items() \
-                if (v < 30.) and (not is_stellar_i[k])]
-
-        # do we have multiple objects?
-        N_nearby_grps_i = len(nearby_grp_id_i)
-
-        # locate the nearest group.
-        if N_nearby_grps_i:
-            nearby_grps_dist_i = [prop_dist_i[i] for i in nearby_grp_id_i]
-            i_nearest_grp = nearby_grp_id_i[np.argmin(nearby_grps_dist_i)]
-        else:
-            i_nearest_grp = -1
-
-        # nearby object found: choose which to display.
-        if i_nearest_grp > -1:
-            nearest_src_datasrc_i = [source_name_order.index(src_j[0]) \
-                    for src_j in cand_group_i[i_nearest_grp]]
-            nearest_src_i = cand_group_i[i_nearest_grp][\
-                    np.argmin(nearest_src_datasrc_i)]
-            nearest_src_i = nearest_src_i[:4] + nearest_src_i[7:]
-        else:
-            nearest_src_i = None
+            + fmtstr_links.format('LS_Link', 'OSC_Link'), file=fp_out)
+
+    src_cols = ['src_' + w for w in \
+            ['survey', 'srcid', 'ra', 'dec', 'sep_asec', 'dist_kpc']]
+    cov_cols = ['cov_' + w for w in survey_datasets]
+    for row_i in events.rows():
+        row_i = dict(zip(events.keys(), row_i))
+
+        line_1 = fmtstr_event.format(row_i['name'], row_i['type'],
+                row_i['ra'], row_i['dec'], row_i['redshift'])
+        line_2 = fmtstr_coverage.format(*[row_i[w] for w in cov_cols])
 
         # determine what to display at the third column.
-        if nearest_src_i:
-            line_3 = fmtstr_hostcand.format(*(nearest_src_i))
+        if row_i['src_survey'] is not None:
+            line_3 = fmtstr_hostcand.format(*[row_i[w] for w in src_cols])
         else:
             line_3 = fmtstr_hostcand_alt.format('', '', '', '', '', '')
 
-        # before printing the table:
-        if nearest_src_i and nearest_src_i[-2] < 20.:
-            continue
-
-        # create legacysurvey viewer link.
-        event_crd_i = SkyCoord(ra=event_info_i['ra'],
-                               dec=event_info_i['dec'],
-                               unit=('hour', 'deg'))
-        ls_link = 'http://legacysurvey.org/viewer' \
-                + '?ra={:.7f}&dec={:.7f}&zoom=16'.format( \
-                event_crd_i.ra.deg, event_crd_i.dec.deg)
-        osc_link = 'https://sne.space/sne/{:}/'.format(event_i)
-        line_4 = fmtstr_links.format(ls_link, osc_link)
-
-        print(' '.join((line_1, line_2, line_3, line_4)))
+        line_4 = fmtstr_links.format(row_i['ls_link'], row_i['osc_link'])
+
+        print(' '.join((line_1, line_2, line_3, line_4)), file=fp_out)
+
+    if output:
+        fp_out.close()
+
+if __name__ == '__main__':
+
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--format', default='text',
+            choices=['text', 'csv', 'parquet', 'html'])
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    # read events.
+    cand_events = load_json('candidate-events.json')
+
+    # read nearest host candidates (on demand, if stored as JSON Lines).
+    nearest_hosts = open_events('nearest-host-candidate.json')
+
+    # read survey coverage
+    survey_coverage = load_json('survey-coverage.json')
+
+    events = build_table(cand_events, nearest_hosts, survey_coverage)
+    write_table(events, fmt=args.format, output=args.output)
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+
+'''
+    Profiling of pipeline scripts: wall and CPU time per phase, peak memory,
+    slow events, and optionally a cProfile dump.
+
+    Scripts call `enable()` once, which is a no-op unless `--profile` is
+    given in the command line (or `--profile=FILE` to also write cProfile
+    stats into FILE, for `python -m pstats FILE` or snakeviz), or the
+    `SFORZANDO_PROFILE` environment variable is set to `1` or a file name.
+    The option is removed from `sys.argv`, so it works with argparse.
+
+    Time is recorded per phase, exclusive of nested phases:
+        load        reading JSON files (`jsonio.load_json`)
+        serialize   writing JSON files (`jsonio.dump_json`)
+        remote      remote calls (`netstats.call`)
+        events      the per-event loop (`iter_events`), or a `phase()` block
+    and the rest of the run is reported as 'other' (imports, setup).
+    Every event of `iter_events` is also timed, and the slowest ones are
+    listed. Peak memory is traced with `tracemalloc` (which slows down
+    allocation-heavy code, so do not compare profiled and plain timings).
+    Workers of process pools are not profiled: their time is in the phase
+    that waits for them.
+
+    A summary is printed at exit.
+
+    ** Keep this module compatible with python2 (get-image-stamps-ps1.py)
+'''
+
+import os
+import sys
+import time
+import atexit
+from collections import OrderedDict
+
+try:
+    import tracemalloc
+except ImportError: # Python 2
+    tracemalloc = None
+
+try:
+    cpu_time = time.process_time
+except AttributeError: # Python 2
+    cpu_time = lambda: sum(os.times()[:2])
+
+enabled = False
+profile_file, profiler = None, None
+t_start = (0., 0.)
+
+# stats of phases: name -> [n_calls, wall, cpu], exclusive of nested phases.
+phases = OrderedDict()
+
+# open phases: [name, wall_start, cpu_start, nested_wall, nested_cpu]
+stack = list()
+
+# (event name, wall time) of `iter_events`
+event_times = list()
+
+def push(name):
+    stack.append([name, time.time(), cpu_time(), 0., 0.])
+
+def pop():
+    name, wall_0, cpu_0, nested_wall, nested_cpu = stack.pop()
+    wall, cpu = time.time() - wall_0, cpu_time() - cpu_0
+    if name not in phases:
+        phases[name] = [0, 0., 0.]
+    phases[name][0] += 1
+    phases[name][1] += wall - nested_wall
+    phases[name][2] += cpu - nested_cpu
+    if stack:
+        stack[-1][3] += wall
+        stack[-1][4] += cpu
+    return wall
+
+class phase(object):
+
+    '''
+    Context manager that records the time of a phase.
+
+        with profiling.phase('events'):
+            ...
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if enabled:
+            push(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if enabled:
+            pop()
+        return False
+
+def iter_events(iterable, key=None):
+
+    '''
+    Time every item of the per-event loop, as phase 'events'.
+
+    Parameters
+    ----------
+    iterable : iterable
+        Items of the loop, e.g. `cand_events.items()`.
+
+    key : callable
+        Event name of an item. Default: the first element of tuples, or
+        the item itself.
+
+    Returns
+    -------
+    An iterator of the same items (`iterable` itself if not enabled).
+    '''
+
+    if not enabled:
+        return iterable
+    if key is None:
+        key = lambda w: w[0] if isinstance(w, tuple) else w
+    return _iter_events(iterable, key)
+
+def _iter_events(iterable, key):
+    for item in iterable:
+        push('events')
+        try:
+            yield item
+        finally:
+            event_times.append((str(key(item)), pop()))
+
+def event_outliers(times, n_max=10, n_mad=5.):
+    '''
+    Slowest events, beyond the median by `n_mad` times the median
+    absolute deviation.
+    '''
+    if len(times) < 3:
+        return list()
+    walls = sorted([w[1] for w in times])
+    median = walls[len(walls) // 2]
+    mad = sorted([abs(w - median) for w in walls])[len(walls) // 2]
+    cut = median + n_mad * max(mad, 1.e-3 * median)
+    slow = sorted([w for w in times if w[1] > cut], key=lambda w: -w[1])
+    return slow[:n_max]
+
+def summary(fp=None):
+
+    ''' Print a summary of phases, memory and slow events. '''
+
+    fp = fp or sys.stderr
+    while stack: # e.g., exit in the middle of a phase.
+        pop()
+
+    wall_total = time.time() - t_start[0]
+    cpu_total = cpu_time() - t_start[1]
+    rows = [(k, v[0], v[1], v[2]) for k, v in phases.items()]
+    rows.append(('other', 1, wall_total - sum([w[2] for w in rows]),
+            cpu_total - sum([w[3] for w in rows])))
+
+    fmtstr = '{:16} {:>8} {:>10} {:>10} {:>7}'
+    fp.write('\n' + fmtstr.format('Phase', 'Calls', 'Wall_s', 'CPU_s',
+            'Wall_%') + '\n')
+    for name_i, n_i, wall_i, cpu_i in rows + [('total', '',
+            wall_total, cpu_total)]:
+        fp.write(fmtstr.format(name_i, n_i, '%.3f' % wall_i,
+                '%.3f' % cpu_i,
+                '%.1f' % (100. * wall_i / max(wall_total, 1.e-9))) + '\n')
+
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        fp.write('Memory (tracemalloc): peak %.1f MB, at exit %.1f MB\n' \
+                % (peak / 1.e6, current / 1.e6))
+
+    if event_times:
+        walls = sorted([w[1] for w in event_times])
+        fp.write('Events: %d, mean %.4f s, median %.4f s, ' \
+                'p90 %.4f s, max %.4f s\n' % (len(walls),
+                sum(walls) / len(walls), walls[len(walls) // 2],
+                walls[min(int(0.9 * len(walls)), len(walls) - 1)],
+                walls[-1]))
+        for event_i, wall_i in event_outliers(event_times):
+            fp.write('    slow: {:32} {:10.4f} s\n'.format(event_i, wall_i))
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        fp.write('cProfile stats written into %s\n' % profile_file)
+
+def option_from_argv(argv=None):
+    '''
+    Find and remove `--profile[=FILE]` in the command line.
+
+    Returns
+    -------
+    None (not given), True, or the name of the cProfile file.
+    '''
+    argv = sys.argv if argv is None else argv
+    for arg_i in argv[1:]:
+        if arg_i == '--profile' or arg_i.startswith('--profile='):
+            argv.remove(arg_i)
+            return arg_i.split('=', 1)[1] if '=' in arg_i else True
+    value = os.environ.get('SFORZANDO_PROFILE', '')
+    if value in ('', '0'):
+        return None
+    return True if value == '1' else value
+
+def enable(option=None):
+
+    '''
+    Start profiling if `--profile` is given (see the module docstring),
+    and print a summary at exit.
+
+    Parameters
+    ----------
+    option : None, True or str
+        Profile (True) or profile and write cProfile stats into a file
+        (str). Default: from the command line or environment.
+    '''
+
+    global enabled, profile_file, profiler, t_start
+
+    option = option or option_from_argv()
+    if not option or enabled:
+        return
+
+    enabled, t_start = True, (time.time(), cpu_time())
+    if tracemalloc is not None:
+        tracemalloc.start()
+    if option is not True:
+        import cProfile
+        profile_file, profiler = option, cProfile.Profile()
+        profiler.enable()
+    if hasattr(os, 'register_at_fork'): # not in workers of process pools.
+        os.register_at_fork(after_in_child=disable_in_child)
+    atexit.register(summary)
+
+def disable_in_child():
+    global enabled
+    enabled = False
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    if profiler is not None:
+        profiler.disable()
+
+# EOF
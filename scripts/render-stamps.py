@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+'''
+    Render colour image stamps locally from FITS cutouts.
+
+    FITS cutouts are retrieved once by `get-image-stamps.py runfits` and
+    `get-image-stamps-ps1.py fits`. This script renders them into JPEG stamps
+    with the same sizes as the remote services, and writes `image-cutout.json`
+    and `image-cutout-ps1.json` for `annotate-stamps.py`. Re-run with another
+    stretch as often as needed.
+
+    Usage: python render-stamps.py run [--stretch 0.5 --Q 8 ...]
+'''
+
+import os
+import sys
+import argparse
+from collections import OrderedDict
+from multiprocessing import Pool
+from functools import partial
+
+from tqdm import tqdm
+
+import profiling
+from composite import render_composite, stretch_funcs
+from jsonio import load_json, dump_json
+
+def render_task(task, render_kw, desti_dir):
+    ''' Render one stamp, for the process pool. '''
+    event_i, imsrc_i, fits_i = task
+    fname_i = os.path.join(desti_dir,
+            '{}-{}.jpg'.format(event_i.replace(' ', '_'), imsrc_i))
+    try:
+        return event_i, imsrc_i, \
+                render_composite(fits_i, imsrc_i, fname_i, **render_kw)
+    except Exception as err:
+        print('Failed to render', event_i, imsrc_i, ':', err)
+        return event_i, imsrc_i, None
+
+if (__name__ == '__main__') and ('run' in sys.argv):
+
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['run'])
+    parser.add_argument('--method', default='lupton',
+            choices=sorted(stretch_funcs.keys()))
+    parser.add_argument('--Q', type=float, default=8.)
+    parser.add_argument('--stretch', type=float, default=0.5)
+    parser.add_argument('--minimum', type=float, default=0.)
+    parser.add_argument('--quality', type=int, default=90)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--desti-dir', default='./image-stamps-local/')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.desti_dir):
+        os.makedirs(args.desti_dir)
+
+    render_kw = dict(method=args.method, Q=args.Q, stretch=args.stretch,
+            minimum=args.minimum, quality=args.quality)
+
+    # FITS cutouts: (input file, output file)
+    cutout_files = [
+        ('image-cutout-fits.json', 'image-cutout.json'),
+        ('image-cutout-ps1-fits.json', 'image-cutout-ps1.json'),
+    ]
+
+    for fits_list_i, cutout_file_i in cutout_files:
+
+        if not os.path.isfile(fits_list_i):
+            continue
+
+        fits_cutout = load_json(fits_list_i)
+
+        # keep the order of events and image sources.
+        image_cutout, tasks = OrderedDict(), list()
+        for event_j, fits_info_j in fits_cutout.items():
+            image_cutout[event_j] = OrderedDict()
+            for imsrc_k, fits_k in fits_info_j.items():
+                image_cutout[event_j][imsrc_k] = None
+                if fits_k:
+                    tasks.append((event_j, imsrc_k, fits_k))
+
+        # render in parallel.
+        worker = partial(render_task, render_kw=render_kw,
+                desti_dir=args.desti_dir)
+        with Pool(args.processes) as pool, profiling.phase('events'):
+            for event_j, imsrc_k, jpeg_k in tqdm(pool.imap_unordered( \
+                    worker, tasks, chunksize=16), total=len(tasks)):
+                image_cutout[event_j][imsrc_k] = jpeg_k
+
+        dump_json(image_cutout, cutout_file_i, pretty=False)
+
+# EOF
@@ -0,0 +1,385 @@
+#!/usr/bin/python
+
+'''
+    Columnar tables for reports (print-table.py, generate-new-list.py).
+
+    Candidate events, nearby sources and inspection results are loaded once
+    into columns (NumPy arrays), and per-event quantities are computed with
+    vectorized group-by operations instead of per-event Python loops.
+    Tables can be written as text, CSV, Parquet (needs pyarrow) or HTML.
+'''
+
+import csv
+import html
+from collections import OrderedDict
+
+import numpy as np
+
+from coords import parse_radec
+
+class Table(object):
+
+    '''
+    A minimal columnar table: ordered dict of equal-length arrays.
+
+    Parameters
+    ----------
+    columns : list of (str, array-like)
+        Column names and values.
+    '''
+
+    def __init__(self, columns=()):
+        self.columns = OrderedDict()
+        for name, values in columns:
+            self[name] = values
+
+    def __len__(self):
+        for values in self.columns.values():
+            return len(values)
+        return 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __setitem__(self, name, values):
+        values = np.asarray(values)
+        if self.columns and (len(values) != len(self)):
+            raise ValueError('Column `%s` has a different length.' % name)
+        self.columns[name] = values
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def keys(self):
+        return list(self.columns.keys())
+
+    def take(self, idx):
+        ''' New table with selected rows (index or boolean mask) '''
+        return Table([(k, v[idx]) for k, v in self.columns.items()])
+
+    def rows(self, names=None):
+        ''' Iterate over rows as tuples of Python objects. '''
+        names = names or self.keys()
+        cols = [self.columns[w].tolist() for w in names]
+        return zip(*cols)
+
+    def write(self, fp, fmt='csv', names=None):
+
+        '''
+        Write the table.
+
+        Parameters
+        ----------
+        fp : str or file object
+            Output file. Parquet needs a file name.
+
+        fmt : str
+            'csv', 'parquet' or 'html'.
+
+        names : list of str
+            Columns to write, default all.
+        '''
+
+        names = names or self.keys()
+        if fmt == 'parquet':
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise RuntimeError('Parquet output needs `pyarrow`.')
+            pq.write_table(pa.table(OrderedDict([(w, self.columns[w]) \
+                    for w in names])), fp)
+            return
+
+        if isinstance(fp, str):
+            with open(fp, 'w', newline='') as fp_w:
+                return self.write(fp_w, fmt=fmt, names=names)
+
+        if fmt == 'csv':
+            writer = csv.writer(fp)
+            writer.writerow(names)
+            writer.writerows([[format_cell(v) for v in w] \
+                    for w in self.rows(names)])
+        elif fmt == 'html':
+            fp.write('<table>\n<tr>' + ''.join(['<th>%s</th>' \
+                    % html.escape(w) for w in names]) + '</tr>\n')
+            for row in self.rows(names):
+                fp.write('<tr>' + ''.join(['<td>%s</td>' \
+                        % html.escape(format_cell(w)) for w in row]) \
+                        + '</tr>\n')
+            fp.write('</table>\n')
+        else:
+            raise ValueError('Unknown table format `%s`.' % fmt)
+
+def format_cell(value):
+    ''' Cell as text: empty for None/NaN '''
+    if value is None:
+        return ''
+    if isinstance(value, float) and not np.isfinite(value):
+        return ''
+    return str(value)
+
+def group_index(*keys):
+
+    '''
+    Group rows by one or more key columns.
+
+    Returns
+    -------
+    group : ndarray
+        Group index of every row, numbered by first appearance.
+
+    first : ndarray
+        Row index of the first row of every group.
+    '''
+
+    if len(keys) == 1:
+        key = np.asarray(keys[0])
+    else: # combine into structured keys.
+        key = np.rec.fromarrays([np.asarray(w) for w in keys])
+    if not len(key):
+        return np.zeros(0, dtype='i8'), np.zeros(0, dtype='i8')
+    _, first, inverse = np.unique(key, return_index=True,
+            return_inverse=True)
+    inverse = inverse.ravel()
+
+    # renumber by first appearance.
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return rank[inverse], first[order]
+
+def group_mean(group, values, N_groups):
+    ''' Mean of values per group '''
+    return np.bincount(group, weights=values, minlength=N_groups) \
+            / np.maximum(np.bincount(group, minlength=N_groups), 1)
+
+def group_any(group, mask, N_groups):
+    ''' True if any row of a group is True '''
+    return np.bincount(group, weights=mask.astype('f8'),
+            minlength=N_groups) > 0
+
+def group_min(group, values, N_groups):
+    ''' Minimum value per group, inf for groups without rows '''
+    vmin = np.full(N_groups, np.inf)
+    np.minimum.at(vmin, group, values)
+    return vmin
+
+def group_argmin(group, values, N_groups, tiebreak=None):
+
+    '''
+    Row index of the minimum value per group (first row on ties).
+
+    Returns
+    -------
+    idx : ndarray
+        Row index per group, -1 for groups without rows.
+    '''
+
+    rows = np.arange(len(group))
+    keys = [rows] if tiebreak is None else [rows, tiebreak]
+    order = np.lexsort(keys + [values, group])
+    idx = np.full(N_groups, -1, dtype='i8')
+    is_first = np.ones(order.size, dtype=bool)
+    is_first[1:] = group[order][1:] != group[order][:-1]
+    idx[group[order][is_first]] = order[is_first]
+    return idx
+
+def load_events(cand_events):
+
+    '''
+    Columns of candidate events.
+
+    Returns
+    -------
+    Table with 'name', 'type', 'ra', 'dec', 'redshift' (as in the JSON file,
+    strings) and 'ra_deg', 'dec_deg'.
+    '''
+
+    names = list(cand_events.keys())
+    get = lambda key: [cand_events[w][key] for w in names]
+    events = Table([
+        ('name', np.array(names, dtype=object)),
+        ('type', np.array(get('type'), dtype=object)),
+        ('ra', np.array(get('ra'), dtype=object)),
+        ('dec', np.array(get('dec'), dtype=object)),
+        ('redshift', np.array(get('redshift'), dtype=object)),
+    ])
+
+    # all events at once, NaN for malformed coordinates.
+    events['ra_deg'], events['dec_deg'], _ = parse_radec(
+            events['ra'].astype(str), events['dec'].astype(str))
+
+    return events
+
+def load_sources(nearest_hosts, event_names):
+
+    '''
+    Flat columns of nearby sources (`nearest-host-candidate.json`).
+
+    Returns
+    -------
+    Table with 'event' (index in `event_names`), 'survey', 'srcid', 'ra',
+    'dec', 'pm', 'pm_err', 'star_flag', 'sep_asec', 'dist_kpc' and 'xmatch'
+    (index of cross-matched object).
+    '''
+
+    event_idx = {w: i for i, w in enumerate(event_names)}
+    rows = [(event_idx[k],) + tuple(w) for k, v in nearest_hosts.items() \
+            if k in event_idx for w in v]
+    cols = list(zip(*rows)) if rows else [()] * 11
+    num = lambda w: np.array([np.nan if v is None else v for v in w],
+            dtype='f8')
+    return Table([
+        ('event', np.array(cols[0], dtype='i8')),
+        ('survey', np.array(cols[1], dtype=object)),
+        ('srcid', np.array(cols[2], dtype=object)),
+        ('ra', num(cols[3])),
+        ('dec', num(cols[4])),
+        ('pm', num(cols[5])),
+        ('pm_err', num(cols[6])),
+        ('star_flag', np.array(cols[7], dtype=object)),
+        ('sep_asec', num(cols[8])),
+        ('dist_kpc', num(cols[9])),
+        ('xmatch', np.array(cols[10], dtype='i8')),
+    ])
+
+def load_inspection(vis_insp, event_names, image_sources):
+
+    '''
+    Inspection flags as an (N_events, N_image_sources) array of strings,
+    None for stamps without results.
+    '''
+
+    event_idx = {w: i for i, w in enumerate(event_names)}
+    src_idx = {w: i for i, w in enumerate(image_sources)}
+    flags = np.full((len(event_names), len(image_sources)), None,
+            dtype=object)
+    for event_i, images_i in vis_insp.items():
+        if event_i not in event_idx:
+            continue
+        for imsrc_j, flags_j in images_i.items():
+            if imsrc_j in src_idx:
+                flags[event_idx[event_i], src_idx[imsrc_j]] = flags_j
+    return flags
+
+def has_flag(flags, flag):
+    ''' Element-wise test of a flag in an array of flag strings '''
+    return np.array([(w is not None) and (flag in w) for w in flags.flat],
+            dtype=bool).reshape(flags.shape)
+
+def nearest_groups(sources, N_events, max_dist_kpc=30.,
+        source_name_order=None):
+
+    '''
+    Nearest non-stellar cross-matched object of every event.
+
+    Sources are grouped by (event, cross-match index). An object is stellar
+    if any of its sources is flagged 'S', its distance is the mean projected
+    distance of its sources. Among objects within `max_dist_kpc`, the
+    nearest one is selected, and the source to display is the first one
+    in `source_name_order`.
+
+    Returns
+    -------
+    i_src : ndarray
+        Row in `sources` of the displayed source per event, -1 if none.
+
+    N_nearby : ndarray
+        Number of non-stellar objects within `max_dist_kpc` per event.
+    '''
+
+    if not len(sources):
+        return np.full(N_events, -1, dtype='i8'), \
+                np.zeros(N_events, dtype='i8')
+
+    grp, grp_first = group_index(sources['event'], sources['xmatch'])
+    N_grps = grp_first.size
+    grp_event = sources['event'][grp_first]
+    grp_dist = group_mean(grp, sources['dist_kpc'], N_grps)
+    grp_stellar = group_any(grp, sources['star_flag'] == 'S', N_grps)
+
+    # nearest group within the distance cut.
+    is_nearby = (grp_dist < max_dist_kpc) & (~grp_stellar)
+    i_nearby = np.flatnonzero(is_nearby)
+    N_nearby = np.bincount(grp_event[i_nearby], minlength=N_events)
+    i_nearest = group_argmin(grp_event[i_nearby], grp_dist[i_nearby],
+            N_events)
+    has_nearest = i_nearest >= 0
+    nearest_grp = np.full(N_events, -1, dtype='i8')
+    nearest_grp[has_nearest] = i_nearby[i_nearest[has_nearest]]
+
+    # source to display in the nearest group.
+    if source_name_order is None:
+        rank = np.zeros(len(sources))
+    else:
+        rank_of = {w: i for i, w in enumerate(source_name_order)}
+        rank = np.array([rank_of[w] for w in sources['survey']])
+    i_show = group_argmin(grp, rank, N_grps)
+    i_src = np.full(N_events, -1, dtype='i8')
+    i_src[has_nearest] = i_show[nearest_grp[has_nearest]]
+
+    return i_src, N_nearby
+
+# star-flag policies of `nearest_distance`.
+star_policies = ['object', 'source', 'none', 'display']
+
+def nearest_distance(sources, N_events, star_policy='object',
+        source_name_order=None):
+
+    '''
+    Projected distance (kpc) of the nearest non-stellar neighbor of every
+    event, inf if there is none.
+
+    Parameters
+    ----------
+    sources : Table
+        Nearby sources (`load_sources`).
+
+    N_events : int
+        Number of events.
+
+    star_policy : str
+        'object': cross-matched objects (as in `nearest_groups`), stellar
+        if any of its sources is flagged 'S', at the mean distance of its
+        sources. 'source': single sources not flagged 'S' (as in
+        get-image-stamps.py). 'none': all sources, star flags ignored.
+        'display': distance of the source displayed for the nearest object
+        within 30 kpc (as in print-table.py, see `nearest_groups`).
+
+    source_name_order : list of str
+        Order of surveys for the displayed source ('display').
+
+    Returns
+    -------
+    dist_kpc : ndarray
+        An event is hostless at a threshold `d` if `dist_kpc >= d`.
+    '''
+
+    if star_policy == 'display':
+        i_src, _ = nearest_groups(sources, N_events, max_dist_kpc=30.,
+                source_name_order=source_name_order)
+        dist = np.full(N_events, np.inf)
+        has_src = i_src >= 0
+        dist[has_src] = sources['dist_kpc'][i_src[has_src]]
+        return np.where(np.isnan(dist), np.inf, dist)
+
+    if star_policy == 'object':
+        grp, grp_first = group_index(sources['event'], sources['xmatch'])
+        N_grps = grp_first.size
+        event = sources['event'][grp_first]
+        dist = group_mean(grp, sources['dist_kpc'], N_grps)
+        use = ~group_any(grp, sources['star_flag'] == 'S', N_grps)
+    elif star_policy == 'source':
+        event, dist = sources['event'], sources['dist_kpc']
+        use = sources['star_flag'] != 'S'
+    elif star_policy == 'none':
+        event, dist = sources['event'], sources['dist_kpc']
+        use = np.ones(len(sources), dtype=bool)
+    else:
+        raise ValueError('Unknown star-flag policy `%s`.' % star_policy)
+
+    use &= np.isfinite(dist)
+    return group_min(event[use], dist[use], N_events)
+
+# EOF
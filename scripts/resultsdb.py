@@ -0,0 +1,342 @@
+#!/usr/bin/python
+
+'''
+    Indexed database of pipeline results.
+
+    Candidate events, nearby sources (`nearest-host-candidate.json`) and
+    visual inspection results are loaded once into a SQLite file, with an
+    index on event names and R*Tree spatial indices on event and source
+    positions. Queries then take milliseconds without loading the JSON files.
+
+    Usage:
+        python resultsdb.py build
+        python resultsdb.py event "SN 2011fe"
+        python resultsdb.py cone 210.774 54.274 120 [--hosts]
+        python resultsdb.py select --min-kpc 30 --flag y
+
+    Options of `cone` and `select`:
+        --max-kpc/--min-kpc: projected distance of the nearest non-stellar
+            source (events), or of the source itself (`cone --hosts`).
+        --flag: events with this inspection flag in any stamp.
+'''
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+from coords import ang_sep
+from jsonio import load_json, stored_file
+
+db_file = './results.db'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS events (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT NOT NULL UNIQUE,
+    type        TEXT,
+    ra          TEXT,
+    dec         TEXT,
+    redshift    REAL,
+    ra_deg      REAL,
+    dec_deg     REAL,
+    nearest_kpc REAL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    id          INTEGER PRIMARY KEY,
+    event_id    INTEGER NOT NULL REFERENCES events(id),
+    survey      TEXT,
+    srcid       TEXT,
+    ra          REAL,
+    dec         REAL,
+    pm          REAL,
+    pm_err      REAL,
+    star_flag   TEXT,
+    sep_asec    REAL,
+    dist_kpc    REAL,
+    xmatch      INTEGER
+);
+CREATE TABLE IF NOT EXISTS inspection (
+    event_id    INTEGER NOT NULL REFERENCES events(id),
+    imsrc       TEXT NOT NULL,
+    flags       TEXT NOT NULL,
+    PRIMARY KEY (event_id, imsrc)
+);
+CREATE INDEX IF NOT EXISTS sources_event ON sources (event_id);
+CREATE INDEX IF NOT EXISTS sources_dist ON sources (dist_kpc);
+CREATE INDEX IF NOT EXISTS events_nearest ON events (nearest_kpc);
+CREATE INDEX IF NOT EXISTS inspection_flags ON inspection (flags);
+CREATE VIRTUAL TABLE IF NOT EXISTS events_rtree
+    USING rtree(id, ra_min, ra_max, dec_min, dec_max);
+CREATE VIRTUAL TABLE IF NOT EXISTS sources_rtree
+    USING rtree(id, ra_min, ra_max, dec_min, dec_max);
+'''
+
+def build_db(filename=db_file, inspection_file='./visual-inspection.json'):
+
+    '''
+    Build the database from the JSON files in the working directory.
+    '''
+
+    from report import load_events, load_sources, nearest_distance
+
+    if os.path.isfile(filename):
+        os.remove(filename)
+    conn = sqlite3.connect(filename)
+    conn.executescript(schema)
+
+    cand_events = load_json('candidate-events.json')
+    events = load_events(cand_events)
+
+    # nearest non-stellar object of every event (mean distance of its
+    # sources, as in print-table.py).
+    if os.path.isfile(stored_file('nearest-host-candidate.json')):
+        nearest_hosts = load_json('nearest-host-candidate.json')
+        sources = load_sources(nearest_hosts, events['name'])
+        nearest_kpc = nearest_distance(sources, len(events))
+        nearest_kpc[np.isinf(nearest_kpc)] = np.nan
+    else:
+        sources, nearest_kpc = None, np.full(len(events), np.nan)
+
+    def zred(w):
+        try:
+            return float(w)
+        except (TypeError, ValueError):
+            return None
+
+    nan2none = lambda w: None if (w is None or w != w) else w
+    ev_ids = np.arange(1, len(events) + 1)
+    conn.executemany('INSERT INTO events VALUES (?,?,?,?,?,?,?,?,?)',
+            [(int(i), n, t, r, d, zred(z), float(ra), float(de), nan2none(k)) \
+            for i, n, t, r, d, z, ra, de, k in zip(ev_ids, events['name'],
+            events['type'], events['ra'], events['dec'], events['redshift'],
+            events['ra_deg'], events['dec_deg'], nearest_kpc.tolist())])
+    conn.executemany('INSERT INTO events_rtree VALUES (?,?,?,?,?)',
+            [(int(i), ra, ra, de, de) for i, ra, de in \
+            zip(ev_ids, events['ra_deg'].tolist(), events['dec_deg'].tolist())])
+
+    if sources is not None and len(sources):
+        src_ids = np.arange(1, len(sources) + 1)
+        cols = ['event', 'survey', 'srcid', 'ra', 'dec', 'pm', 'pm_err',
+                'star_flag', 'sep_asec', 'dist_kpc', 'xmatch']
+        rows = [(int(i), int(w[0]) + 1, w[1], str(w[2])) \
+                + tuple([nan2none(v) for v in w[3:]]) \
+                for i, w in zip(src_ids, sources.rows(cols))]
+        conn.executemany('INSERT INTO sources VALUES '
+                '(?,?,?,?,?,?,?,?,?,?,?,?)', rows)
+        ok = np.isfinite(sources['ra']) & np.isfinite(sources['dec'])
+        conn.executemany('INSERT INTO sources_rtree VALUES (?,?,?,?,?)',
+                [(int(i), ra, ra, de, de) for i, ra, de in \
+                zip(src_ids[ok], sources['ra'][ok].tolist(),
+                    sources['dec'][ok].tolist())])
+
+    if os.path.isfile(inspection_file):
+        vis_insp = load_json(inspection_file)
+        ev_id = dict(zip(events['name'], ev_ids.tolist()))
+        conn.executemany('INSERT INTO inspection VALUES (?,?,?)',
+                [(ev_id[k], imsrc, flags) for k, v in vis_insp.items() \
+                if k in ev_id for imsrc, flags in v.items()])
+
+    conn.commit()
+    return conn
+
+def connect(filename=db_file):
+    if not os.path.isfile(filename):
+        raise RuntimeError('Results database not found, run `build` first.')
+    return sqlite3.connect(filename)
+
+def cone_boxes(ra, dec, radius):
+    ''' (ra_min, ra_max, dec_min, dec_max) boxes that cover a cone. '''
+    dec_min, dec_max = max(dec - radius, -90.), min(dec + radius, 90.)
+    if (dec_max >= 90.) or (dec_min <= -90.):
+        return [(0., 360., dec_min, dec_max)]
+    dra = radius / np.cos(np.radians(max(abs(dec_min), abs(dec_max))))
+    if dra >= 180.:
+        return [(0., 360., dec_min, dec_max)]
+    ra_lo, ra_hi = ra - dra, ra + dra
+    if ra_lo < 0.:
+        return [(0., ra_hi, dec_min, dec_max),
+                (ra_lo + 360., 360., dec_min, dec_max)]
+    if ra_hi > 360.:
+        return [(ra_lo, 360., dec_min, dec_max),
+                (0., ra_hi - 360., dec_min, dec_max)]
+    return [(ra_lo, ra_hi, dec_min, dec_max)]
+
+def flag_clause(flag, event_col='events.id'):
+    ''' SQL condition: events with an inspection flag. '''
+    return ('EXISTS (SELECT 1 FROM inspection WHERE inspection.event_id = '
+            '%s AND instr(inspection.flags, ?) > 0)' % event_col)
+
+def cone_search(conn, ra, dec, radius_asec, hosts=False, min_kpc=None,
+        max_kpc=None, flag=None):
+
+    '''
+    Events (or nearby sources) within a cone.
+
+    Parameters
+    ----------
+    ra, dec : float
+        Center in degrees.
+
+    radius_asec : float
+        Radius in arcsec.
+
+    hosts : bool
+        Search nearby sources instead of events.
+
+    min_kpc, max_kpc, flag :
+        Filters, see module docstring.
+
+    Returns
+    -------
+    List of (separation in arcsec, row as a dict), sorted by separation.
+    '''
+
+    table = 'sources' if hosts else 'events'
+    ra_col, dec_col = ('ra', 'dec') if hosts else ('ra_deg', 'dec_deg')
+    dist_col = 'dist_kpc' if hosts else 'nearest_kpc'
+    event_col = 'sources.event_id' if hosts else 'events.id'
+
+    conds, params = list(), list()
+    if min_kpc is not None:
+        if hosts:
+            conds.append('sources.dist_kpc >= ?')
+        else: # no source at all also counts, as in `select_events`.
+            conds.append('(events.nearest_kpc >= ? '
+                    'OR events.nearest_kpc IS NULL)')
+        params.append(min_kpc)
+    if max_kpc is not None:
+        conds.append('%s.%s < ?' % (table, dist_col))
+        params.append(max_kpc)
+    if flag:
+        conds.append(flag_clause(flag, event_col))
+        params.append(flag)
+
+    radius = radius_asec / 3.6e3
+    rows, keys = list(), None
+    for box in cone_boxes(ra, dec, radius):
+        sql = ('SELECT {t}.* FROM {t}_rtree JOIN {t} ON {t}.id = {t}_rtree.id '
+               'WHERE ra_max >= ? AND ra_min <= ? '
+               'AND dec_max >= ? AND dec_min <= ?').format(t=table)
+        sql += ''.join([' AND ' + w for w in conds])
+        cur = conn.execute(sql, (box[0], box[1], box[2], box[3]) \
+                + tuple(params))
+        keys = [w[0] for w in cur.description]
+        rows.extend(cur.fetchall())
+
+    if not rows:
+        return list()
+    rows = [dict(zip(keys, w)) for w in rows]
+    sep = ang_sep(ra, dec, np.array([w[ra_col] for w in rows]),
+            np.array([w[dec_col] for w in rows])) * 3.6e3
+    return sorted([(float(s), w) for s, w in zip(sep, rows) \
+            if s <= radius_asec], key=lambda w: w[0])
+
+def get_event(conn, name):
+    ''' Event, its nearby sources and inspection results, or None. '''
+    cur = conn.execute('SELECT * FROM events WHERE name = ?', (name,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    event = OrderedDict(zip([w[0] for w in cur.description], row))
+    cur = conn.execute('SELECT * FROM sources WHERE event_id = ? '
+            'ORDER BY dist_kpc', (event['id'],))
+    keys = [w[0] for w in cur.description]
+    event['sources'] = [OrderedDict(zip(keys, w)) for w in cur]
+    event['inspection'] = OrderedDict(conn.execute('SELECT imsrc, flags '
+            'FROM inspection WHERE event_id = ?', (event['id'],)).fetchall())
+    return event
+
+def select_events(conn, min_kpc=None, max_kpc=None, flag=None):
+    ''' Events filtered by nearest source distance and inspection flag. '''
+    conds, params = list(), list()
+    if min_kpc is not None: # no source at all also counts.
+        conds.append('(nearest_kpc >= ? OR nearest_kpc IS NULL)')
+        params.append(min_kpc)
+    if max_kpc is not None:
+        conds.append('nearest_kpc < ?')
+        params.append(max_kpc)
+    if flag:
+        conds.append(flag_clause(flag))
+        params.append(flag)
+    sql = 'SELECT * FROM events'
+    if conds:
+        sql += ' WHERE ' + ' AND '.join(conds)
+    cur = conn.execute(sql + ' ORDER BY id', params)
+    keys = [w[0] for w in cur.description]
+    return [OrderedDict(zip(keys, w)) for w in cur]
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=db_file)
+    parser.add_argument('--json', action='store_true')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    subparsers.add_parser('build')
+    parser_event = subparsers.add_parser('event')
+    parser_event.add_argument('name')
+    parser_cone = subparsers.add_parser('cone')
+    parser_cone.add_argument('ra', type=float)
+    parser_cone.add_argument('dec', type=float)
+    parser_cone.add_argument('radius', type=float, help='in arcsec')
+    parser_cone.add_argument('--hosts', action='store_true')
+    parser_select = subparsers.add_parser('select')
+    for parser_i in (parser_cone, parser_select):
+        parser_i.add_argument('--min-kpc', type=float, default=None)
+        parser_i.add_argument('--max-kpc', type=float, default=None)
+        parser_i.add_argument('--flag', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        conn = build_db(args.db)
+        for table_i in ['events', 'sources', 'inspection']:
+            print(table_i, conn.execute('SELECT COUNT(*) FROM %s' \
+                    % table_i).fetchone()[0])
+        sys.exit(0)
+
+    conn = connect(args.db)
+
+    if args.command == 'event':
+        result = get_event(conn, args.name)
+        if result is None:
+            sys.exit('Event not found: ' + args.name)
+        if args.json:
+            print(json.dumps(result, indent=4))
+        else:
+            print(' '.join([str(result[w]) for w in \
+                    ['name', 'type', 'ra', 'dec', 'redshift']]))
+            print('Inspection:', dict(result['inspection']))
+            for src_i in result['sources']:
+                dist_i, sep_i = [('%8.2f' % src_i[w]) if src_i[w] is not None \
+                        else '%8s' % '-' for w in ['dist_kpc', 'sep_asec']]
+                print('    {:12} {:24} {} kpc {} asec {:3} {}'.format( \
+                        str(src_i['survey']), str(src_i['srcid']), dist_i,
+                        sep_i, str(src_i['star_flag']), src_i['xmatch']))
+
+    if args.command == 'cone':
+        result = cone_search(conn, args.ra, args.dec, args.radius,
+                hosts=args.hosts, min_kpc=args.min_kpc,
+                max_kpc=args.max_kpc, flag=args.flag)
+        if args.json:
+            print(json.dumps([dict(w, sep=s) for s, w in result], indent=4))
+        else:
+            for sep_i, row_i in result:
+                print('%10.2f' % sep_i, ' '.join([str(w) \
+                        for w in list(row_i.values())[1:]]))
+
+    if args.command == 'select':
+        result = select_events(conn, min_kpc=args.min_kpc,
+                max_kpc=args.max_kpc, flag=args.flag)
+        if args.json:
+            print(json.dumps(result, indent=4))
+        else:
+            for row_i in result:
+                print(' '.join([str(w) for w in list(row_i.values())[1:]]))
+
+# EOF
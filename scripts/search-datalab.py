@@ -6,51 +6,97 @@
 
 import os
 import sys
-import json
+import argparse
 from collections import OrderedDict, namedtuple
 
 import numpy as np
 from tqdm import tqdm
 
-from astropy.coordinates import SkyCoord
-from dl import authClient as ac, queryClient as qc
-from dl.helpers.utils import convert
 from getpass import getpass
 
-if __name__ == '__main__':
-
-    # initialize datalab
-    token = ac.login(input('Data Lab user name: '), getpass('Password: '))
-
-    # read candidates
-    with open('candidate-events.json', 'r') as fp:
-        candidate_events = json.load(fp, object_pairs_hook=OrderedDict)
-
-    if os.path.isfile('candidate-hosts-dl.json'):
-        with open('candidate-hosts-dl.json', 'r') as fp:
-            candidate_hosts = json.load(fp, object_pairs_hook=OrderedDict)
-    else:
+import netstats
+import profiling
+from coords import event_coords
+from jsonio import load_json, dump_json, JsonlStore
+
+def datalab_clients():
+    ''' Data Lab clients (auth, query), pointed to the service URL. '''
+    from dl import authClient as ac, queryClient as qc
+
+    # other Data Lab server (e.g., local stand-in)
+    datalab_url = netstats.service_url('datalab', None)
+    if datalab_url:
+        ac.set_svc_url(datalab_url + '/auth')
+        qc.set_svc_url(datalab_url + '/query')
+    return ac, qc
+
+# environment variable with a token, to skip the login (sky-shards.py)
+token_env = 'DATALAB_TOKEN'
+
+def login():
+    '''
+    Log into Data Lab, interactively, unless a token is given in the
+    environment variable `token_env`. Returns the token.
+    '''
+    if os.environ.get(token_env):
+        return os.environ[token_env]
+    ac, qc = datalab_clients()
+    return ac.login(input('Data Lab user name: '), getpass('Password: '))
+
+def search_datalab(candidate_events, token, candidate_hosts=None,
+        checkpoint='candidate-hosts-dl.json'):
+
+    '''
+    Search DES DR1 and LS DR7 galaxies within a 60 arcsec box around
+    events.
+
+    Parameters
+    ----------
+    candidate_events : dict
+        Candidate events (candidate-events.json).
+
+    token : str
+        Data Lab token, from `login()`.
+
+    candidate_hosts : OrderedDict or jsonio.JsonlStore
+        Results found so far, events in it are skipped. New results are
+        written into a JsonlStore at once.
+
+    checkpoint : str
+        File to save the results into every 269 events, or None.
+
+    Returns
+    -------
+    candidate_hosts : OrderedDict
+        Event name -> 'DES' and 'LS' query results (CSV strings).
+    '''
+
+    ac, qc = datalab_clients()
+
+    if candidate_hosts is None:
         candidate_hosts = OrderedDict()
 
     # 'radius' of the box.
     box_radius = 60. / 60. / 60. # 60 asec in degrees
 
+    # coordinates of events in degrees.
+    event_crds = event_coords(candidate_events)
+
     # for each event: search for
     I_counter = 0
-    for cand_i, cand_info_i in tqdm(candidate_events.items(),
-                                    total=candidate_events.__len__()):
+    for cand_i, cand_info_i in profiling.iter_events(tqdm( \
+            candidate_events.items(), total=candidate_events.__len__())):
 
         if cand_i in candidate_hosts:
+            netstats.cache_hit('datalab', 2)
             continue
 
         # some events do not have complete RA/Dec info.
-        if not (cand_info_i['ra'] and cand_info_i['dec']):
+        if cand_i not in event_crds:
             continue
 
-        crd_i = SkyCoord(ra=cand_info_i['ra'],
-                         dec=cand_info_i['dec'],
-                         unit=('hour', 'deg'))
-        cos_delta_i = np.cos(crd_i.dec.radian)
+        ra_i, dec_i = event_crds[cand_i]
+        cos_delta_i = np.cos(np.radians(dec_i))
 
         # DES
         des_query = '''
@@ -59,12 +105,13 @@ if __name__ == '__main__':
             WHERE ra BETWEEN %f AND %f
                 AND dec BETWEEN %f AND %f
         ''' % (
-            crd_i.ra.deg  - box_radius / cos_delta_i,
-            crd_i.ra.deg  + box_radius / cos_delta_i,
-            crd_i.dec.deg - box_radius,
-            crd_i.dec.deg + box_radius
+            ra_i - box_radius / cos_delta_i,
+            ra_i + box_radius / cos_delta_i,
+            dec_i - box_radius,
+            dec_i + box_radius
         )
-        des_qr = qc.query(token, sql=des_query)
+        des_qr = netstats.call('datalab',
+                lambda: qc.query(token, sql=des_query), retries=2)
 
         # Legacy Survey DR7
         ls_query = '''
@@ -73,12 +120,13 @@ if __name__ == '__main__':
             WHERE ra BETWEEN %f AND %f
                 AND dec BETWEEN %f AND %f
         ''' % (
-            crd_i.ra.deg  - box_radius / cos_delta_i,
-            crd_i.ra.deg  + box_radius / cos_delta_i,
-            crd_i.dec.deg - box_radius,
-            crd_i.dec.deg + box_radius
+            ra_i - box_radius / cos_delta_i,
+            ra_i + box_radius / cos_delta_i,
+            dec_i - box_radius,
+            dec_i + box_radius
         )
-        ls_qr = qc.query(token, sql=ls_query)
+        ls_qr = netstats.call('datalab',
+                lambda: qc.query(token, sql=ls_query), retries=2)
 
         # put into dict.
         candidate_hosts[cand_i] = OrderedDict([
@@ -87,9 +135,37 @@ if __name__ == '__main__':
         ])
 
         I_counter += 1
-        if not (I_counter % 269): # save into a file.
-            with open('candidate-hosts-dl.json', 'w') as fp:
-                json.dump(candidate_hosts, fp, indent=4)
+        if checkpoint and not (I_counter % 269): # save into a file.
+            dump_json(candidate_hosts, checkpoint, pretty=False)
+
+    return candidate_hosts
+
+if __name__ == '__main__':
+
+    netstats.enable()
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stream', action='store_true',
+            help='Write candidate-hosts-dl.jsonl, one event at a time.')
+    args = parser.parse_args()
+
+    # initialize datalab
+    token = login()
+
+    # read candidates
+    candidate_events = load_json('candidate-events.json')
+
+    # one line per event, written at once.
+    if args.stream:
+        with JsonlStore('candidate-hosts-dl.jsonl') as candidate_hosts:
+            search_datalab(candidate_events, token,
+                    candidate_hosts=candidate_hosts, checkpoint=None)
+
+    else:
+        candidate_hosts = load_json('candidate-hosts-dl.json',
+                missing_ok=True)
+        candidate_hosts = search_datalab(candidate_events, token,
+                candidate_hosts=candidate_hosts)
 
-    with open('candidate-hosts-dl.json', 'w') as fp:
-        json.dump(candidate_hosts, fp, indent=4)
+        dump_json(candidate_hosts, 'candidate-hosts-dl.json', pretty=False)
@@ -6,65 +6,86 @@
 
 import os
 import sys
-import json
+import argparse
 from collections import OrderedDict
 
 import numpy as np
 
 from tqdm import tqdm
-from astropy.coordinates import SkyCoord
-import astropy.units as u
-from astroquery.vizier import Vizier
-
-# New, 190506
-from astropy.cosmology import WMAP9 as cosmo
 
 from catalogs import *
+import netstats
+import profiling
+from coords import event_coords
+from jsonio import load_json, dump_json, JsonlStore
 
 def as_tuple(rec):
     ''' Convert a table record into a tuple '''
     rv = [w if (not np.ma.is_masked(w)) else None for w in rec]
     return tuple(rv)
 
-# encoder for numpy types from: https://github.com/mpld3/mpld3/issues/434
-class npEncoder(json.JSONEncoder):
-    """ Special json encoder for np types """
-    def default(self, obj):
-        if isinstance(obj, (np.int_, np.intc, np.intp, np.int8,
-            np.int16, np.int32, np.int64, np.uint8,
-            np.uint16,np.uint32, np.uint64)):
-            return int(obj)
-        elif isinstance(obj, (np.float_, np.float16, np.float32,
-            np.float64)):
-            return float(obj)
-        elif isinstance(obj,(np.ndarray,)):
-            return obj.tolist()
-        return json.JSONEncoder.default(self, obj)
+def tablelist_nbytes(tab_list):
+    ''' Approx. size of tables returned by Vizier '''
+    return sum([tab_i.as_array().nbytes for tab_i in tab_list])
 
-if __name__ == '__main__':
+def search_vizier(candidate_events, candidate_hosts=None,
+        checkpoint='candidate-hosts.json'):
 
-    # read candidates
-    with open('candidate-events.json', 'r') as fp:
-        candidate_events = json.load(fp, object_pairs_hook=OrderedDict)
+    '''
+    Search Vizier catalogs around events, within 30 proper kpc (at most
+    120 arcsec).
+
+    Parameters
+    ----------
+    candidate_events : dict
+        Candidate events (candidate-events.json).
+
+    candidate_hosts : OrderedDict or jsonio.JsonlStore
+        Results found so far, events in it are skipped. New results are
+        written into a JsonlStore at once.
+
+    checkpoint : str
+        File to save the results into every 269 events, or None.
+
+    Returns
+    -------
+    candidate_hosts : OrderedDict
+        Event name -> 'search_radius' and list of records per catalog.
+    '''
+
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+    from astroquery.vizier import Vizier
+
+    # New, 190506
+    from astropy.cosmology import WMAP9 as cosmo
+
+    # other Vizier server (e.g., local stand-in), as 'http://host:port'
+    vizier_url = netstats.service_url('vizier', None)
+    if vizier_url:
+        Vizier._server_to_url = lambda return_type='votable': \
+                vizier_url + '/viz-bin/' + return_type
 
-    candidate_hosts = OrderedDict()
+    if candidate_hosts is None:
+        candidate_hosts = OrderedDict()
+
+    # coordinates of events in degrees.
+    event_crds = event_coords(candidate_events)
 
     # for each event: search for
     I_counter = 0
-    for cand_i, cand_info_i in tqdm(candidate_events.items(),
-                                    total=candidate_events.__len__()):
+    for cand_i, cand_info_i in profiling.iter_events(tqdm( \
+            candidate_events.items(), total=candidate_events.__len__())):
 
         if cand_i in candidate_hosts:
             continue
 
         # some events do not have complete RA/Dec info.
-        if not (cand_info_i['ra'] and cand_info_i['dec']):
+        if cand_i not in event_crds:
             continue
 
         # construct coord
-        crd_i = SkyCoord(ra=cand_info_i['ra'],
-                         dec=cand_info_i['dec'],
-                         unit=('hour', 'deg'))
+        crd_i = SkyCoord(*event_crds[cand_i], unit=('deg', 'deg'))
 
         # New 190506: use 30 kpc redshift cut.
         zred_i = np.abs(float(cand_info_i['redshift']))
@@ -75,9 +96,11 @@ if __name__ == '__main__':
             rad_i = 120.
 
         # search catalogs. (30" limit)
-        tab_list_i = Vizier.query_region(crd_i,
-                                         radius=rad_i * u.arcsec,
-                                         catalog=vizier_cats)
+        tab_list_i = netstats.call('vizier',
+                lambda: Vizier.query_region(crd_i,
+                                            radius=rad_i * u.arcsec,
+                                            catalog=vizier_cats),
+                retries=2, nbytes=tablelist_nbytes)
 
         sources_i = OrderedDict([('search_radius', rad_i)])
         for cat_name_i, tab_i in tab_list_i._dict.items():
@@ -88,12 +111,35 @@ if __name__ == '__main__':
         candidate_hosts[cand_i] = sources_i
 
         I_counter += 1
-        if not (I_counter % 269): # save into a file.
-            with open('candidate-hosts.json', 'w') as fp:
-                json.dump(candidate_hosts, fp, indent=4, cls=npEncoder)
+        if checkpoint and not (I_counter % 269): # save into a file.
+            dump_json(candidate_hosts, checkpoint, pretty=False)
+
+    return candidate_hosts
+
+if __name__ == '__main__':
+
+    netstats.enable()
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stream', action='store_true',
+            help='Write candidate-hosts.jsonl, one event at a time '
+                 '(continues an interrupted run).')
+    args = parser.parse_args()
+
+    # read candidates
+    candidate_events = load_json('candidate-events.json')
+
+    # one line per event, written at once.
+    if args.stream:
+        with JsonlStore('candidate-hosts.jsonl') as candidate_hosts:
+            search_vizier(candidate_events, candidate_hosts=candidate_hosts,
+                    checkpoint=None)
+
+    else:
+        candidate_hosts = search_vizier(candidate_events)
 
-    # save into a file.
-    with open('candidate-hosts.json', 'w') as fp:
-        json.dump(candidate_hosts, fp, indent=4, cls=npEncoder)
+        # save into a file.
+        dump_json(candidate_hosts, 'candidate-hosts.json', pretty=False)
 
 # EOF
@@ -0,0 +1,239 @@
+#!/usr/bin/python
+
+'''
+    One command for all stages of the pipeline.
+
+    `python sforzando.py STAGE [ARGS...]` runs a script as if it were
+    started directly, e.g. `sforzando.py get-image-stamps run`, and
+    `python sforzando.py list` lists the stages.
+
+    `python sforzando.py run` chains the main stages in one process:
+        find-hostless-events -> search-vizier -> search-datalab ->
+        sort-nearby-sources -> get-image-stamps -> print-table
+    Results are passed between stages in memory, instead of being written
+    and parsed again by the next stage. Outputs are written at checkpoints:
+    `--checkpoint all` (default) writes the output of every stage once it
+    is done (and periodically during the remote searches), so the usual
+    scripts can continue from there; `--checkpoint final` writes only the
+    outputs used by later steps (nearest-host-candidate.json,
+    survey-coverage.json, image-cutout.json and the table), and
+    `--checkpoint none` only the table. The inputs of a stage that is not
+    run are read from files.
+
+    From Python, `stage(name)` imports a script as a module, e.g.
+        sort_sources = stage('sort-nearby-sources').sort_sources
+'''
+
+import os
+import sys
+import glob
+import runpy
+import argparse
+import importlib.util
+from collections import OrderedDict
+
+import netstats
+import profiling
+from jsonio import load_json, dump_json
+
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# stages chained by `run`.
+run_stages = ['find-hostless-events', 'search-vizier', 'search-datalab',
+        'sort-nearby-sources', 'get-image-stamps', 'print-table']
+
+# outputs: file name -> (written with `--checkpoint final`, pretty)
+outputs = OrderedDict([
+    ('candidate-events.json', (False, True)),
+    ('candidate-hosts.json', (False, False)),
+    ('candidate-hosts-dl.json', (False, False)),
+    ('nearest-host-candidate.json', (True, False)),
+    ('survey-coverage.json', (True, True)),
+    ('image-cutout.json', (True, False)),
+])
+
+def stage_names():
+    ''' Names of all scripts that can be run as stages. '''
+    return sorted([os.path.basename(w)[:-3] for w in \
+            glob.glob(os.path.join(scripts_dir, '*-*.py'))])
+
+def stage(name):
+
+    '''
+    Import a script as a module (its `__main__` blocks are not run).
+
+    Parameters
+    ----------
+    name : str
+        Name of the script, e.g. 'sort-nearby-sources'.
+
+    Returns
+    -------
+    module, also in `sys.modules` as e.g. 'sort_nearby_sources'.
+    '''
+
+    module_name = name.replace('-', '_')
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    filename = os.path.join(scripts_dir, name + '.py')
+    if not os.path.isfile(filename):
+        raise ValueError('Unknown stage `%s`.' % name)
+    spec = importlib.util.spec_from_file_location(module_name, filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
+def run_script(name, argv):
+    ''' Run a script as `__main__`, with command-line arguments `argv`. '''
+    filename = os.path.join(scripts_dir, name + '.py')
+    if not os.path.isfile(filename):
+        raise ValueError('Unknown stage `%s`.' % name)
+    sys.argv = [filename] + list(argv)
+    runpy.run_path(filename, run_name='__main__')
+
+class Results(object):
+
+    '''
+    Outputs of stages in memory, read from files when not produced in this
+    process, and written at checkpoints.
+    '''
+
+    def __init__(self, checkpoint='all'):
+        self.data, self.checkpoint = dict(), checkpoint
+
+    def __getitem__(self, filename):
+        if filename not in self.data:
+            self.data[filename] = load_json(filename)
+        return self.data[filename]
+
+    def get(self, filename, default=None):
+        ''' Output in memory or in a file, or `default` if neither. '''
+        if (filename not in self.data) and (not os.path.isfile(filename)):
+            return default
+        return self[filename]
+
+    def __setitem__(self, filename, value):
+        self.data[filename] = value
+        final, pretty = outputs[filename]
+        if self.checkpoint == 'all' or (self.checkpoint == 'final' \
+                and final):
+            dump_json(value, filename, pretty=pretty)
+
+    def periodic(self, filename):
+        ''' File for periodic saves of a long stage, or None. '''
+        return filename if self.checkpoint == 'all' else None
+
+def run_pipeline(stages=None, checkpoint='all', table_format='text',
+        table_output=None):
+
+    '''
+    Run the main stages in this process.
+
+    Parameters
+    ----------
+    stages : list of str
+        Stages to run, in the order of `run_stages` (default: all).
+
+    checkpoint : 'all', 'final' or 'none'
+        Which outputs to write (see the module docstring).
+
+    table_format, table_output : str
+        Format and file of the table (see print-table.py).
+
+    Returns
+    -------
+    Results, with outputs of all stages.
+    '''
+
+    stages = stages or run_stages
+    res = Results(checkpoint=checkpoint)
+
+    # log in first, not in the middle of the run.
+    if 'search-datalab' in stages:
+        token = stage('search-datalab').login()
+
+    if 'find-hostless-events' in stages:
+        res['candidate-events.json'] = \
+                stage('find-hostless-events').find_candidates(verbose=False)
+        print('Number of candidates:', len(res['candidate-events.json']))
+
+    if 'search-vizier' in stages:
+        res['candidate-hosts.json'] = stage('search-vizier').search_vizier( \
+                res['candidate-events.json'],
+                checkpoint=res.periodic('candidate-hosts.json'))
+
+    if 'search-datalab' in stages:
+        res['candidate-hosts-dl.json'] = \
+                stage('search-datalab').search_datalab( \
+                res['candidate-events.json'], token,
+                candidate_hosts=res.get('candidate-hosts-dl.json'),
+                checkpoint=res.periodic('candidate-hosts-dl.json'))
+
+    if 'sort-nearby-sources' in stages:
+        nearest_src, survey_coverage = \
+                stage('sort-nearby-sources').sort_sources( \
+                res['candidate-events.json'], res['candidate-hosts.json'],
+                res['candidate-hosts-dl.json'])
+        res['nearest-host-candidate.json'] = nearest_src
+        res['survey-coverage.json'] = survey_coverage
+
+    if 'get-image-stamps' in stages:
+        res['image-cutout.json'] = stage('get-image-stamps').get_stamps( \
+                res['candidate-events.json'],
+                res['nearest-host-candidate.json'],
+                image_cutout=res.get('image-cutout.json'),
+                checkpoint=res.periodic('image-cutout.json'))
+
+    if 'print-table' in stages:
+        print_table = stage('print-table')
+        events = print_table.build_table(res['candidate-events.json'],
+                res['nearest-host-candidate.json'],
+                res['survey-coverage.json'])
+        print_table.write_table(events, fmt=table_format,
+                output=table_output)
+
+    return res
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print(__doc__)
+        print('Stages:', ', '.join(stage_names()))
+        sys.exit(0)
+
+    command = sys.argv[1]
+
+    if command == 'list':
+        for name_i in stage_names():
+            print(name_i)
+
+    elif command == 'run':
+
+        netstats.enable()
+        profiling.enable()
+
+        parser = argparse.ArgumentParser(prog='sforzando.py run')
+        parser.add_argument('--stages', nargs='+', choices=run_stages,
+                help='Stages to run (default: all, in order).')
+        parser.add_argument('--checkpoint', default='all',
+                choices=['all', 'final', 'none'],
+                help='Outputs to write (default: all).')
+        parser.add_argument('--format', default='text',
+                choices=['text', 'csv', 'parquet', 'html'],
+                help='Format of the table.')
+        parser.add_argument('--output', default=None,
+                help='File of the table (default: stdout).')
+        args = parser.parse_args(sys.argv[2:])
+
+        run_pipeline(args.stages, checkpoint=args.checkpoint,
+                table_format=args.format, table_output=args.output)
+
+    else:
+        run_script(command, sys.argv[2:])
+
+# EOF
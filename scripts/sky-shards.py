@@ -0,0 +1,411 @@
+#!/usr/bin/python
+
+'''
+    Split a run into sky shards, for several nodes, and merge the results.
+
+    Modes:
+        split:  partition `candidate-events.json` by HEALPix pixel (NESTED,
+                see `skypix.py`) into `--shards` shards of about the same
+                number of events. Every shard is a contiguous range of
+                pixels, so neighbouring events (and the caches of remote
+                services) stay on the same node. Each shard is a directory
+                (shards/shard-000/ ...) with its own candidate-events.json
+                and manifest.json.
+        run:    run the stages of one shard (`--shard 3`), of which a node
+                only needs its shard directory, or of all shards with
+                `--processes` local processes standing in for nodes. The
+                manifest of a shard records every stage done.
+        verify: check that every event is in exactly one shard, that all
+                shards are done, and that shard outputs only have events
+                of their own shard (so no event is processed twice).
+        merge:  verify, then merge the outputs of all shards into the
+                usual files, in the order of candidate-events.json (the
+                same whatever the order in which shards finished), and copy
+                image stamps.
+
+    Stages (`--stages`): search-vizier, search-datalab, sort-nearby-sources,
+    get-image-stamps and annotate-stamps. The Data Lab login is done once,
+    and the token is given to all shards (environment variable
+    DATALAB_TOKEN, see `search-datalab.login`).
+
+    Usage:
+        python sky-shards.py split --shards 8 [--nside 32]
+        python sky-shards.py run --shard 3
+        python sky-shards.py run --processes 4
+        python sky-shards.py merge [--stages ...]
+
+    `verify` and `merge` expect the stages given with `--stages` (default:
+    all) to be done in every shard.
+'''
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from sforzando import stage
+from skypix import ang2pix_nest, pixel_area
+from coords import event_coords
+from jsonio import load_json, dump_json
+
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# stage: command line.
+shard_stages = OrderedDict([
+    ('search-vizier', ['search-vizier.py']),
+    ('search-datalab', ['search-datalab.py']),
+    ('sort-nearby-sources', ['sort-nearby-sources.py']),
+    ('get-image-stamps', ['get-image-stamps.py', 'run']),
+    ('annotate-stamps', ['annotate-stamps.py', 'runls']),
+])
+
+# outputs of stages: file -> (has every event of the shard, pretty)
+shard_outputs = OrderedDict([
+    ('candidate-hosts.json', (False, False)),
+    ('candidate-hosts-dl.json', (False, False)),
+    ('nearest-host-candidate.json', (True, False)),
+    ('survey-coverage.json', (True, True)),
+    ('image-cutout.json', (False, False)),
+    ('annotated-images.json', (False, True)),
+])
+
+# directories of image files, copied when merging.
+shard_image_dirs = ['image-stamps', 'annotated']
+
+def file_sha256(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def shard_name(i_shard):
+    return 'shard-%03d' % i_shard
+
+def split_events(pix, n_shards):
+
+    '''
+    Assign events to shards: contiguous ranges of pixels, with about the
+    same number of events. Events of the same pixel are never split.
+
+    Parameters
+    ----------
+    pix : int array
+        NESTED pixel of every event (-1 for no coordinates, which go into
+        the first shard).
+
+    n_shards : int
+        Number of shards.
+
+    Returns
+    -------
+    shard : int array
+        Shard of every event.
+    '''
+
+    N = len(pix)
+    order = np.argsort(pix, kind='stable')
+    sorted_pix = pix[order]
+
+    cuts = [0]
+    for k in range(1, n_shards):
+        target = int(round(k * N / float(n_shards)))
+        if target >= N:
+            cut = N
+        else: # move to the nearest pixel boundary.
+            lo = np.searchsorted(sorted_pix, sorted_pix[target], 'left')
+            hi = np.searchsorted(sorted_pix, sorted_pix[target], 'right')
+            cut = lo if (target - lo) <= (hi - target) else hi
+        cuts.append(max(cut, cuts[-1]))
+    cuts.append(N)
+
+    shard = np.zeros(N, dtype='i8')
+    for k in range(n_shards):
+        shard[order[cuts[k]:cuts[k + 1]]] = k
+    return shard
+
+def split(cand_events, n_shards, nside, shard_dir, input_file):
+
+    ''' Write shard directories and manifests. Returns the manifest. '''
+
+    names = list(cand_events.keys())
+    event_crds = event_coords(cand_events, verbose=False)
+    pix = np.full(len(names), -1, dtype='i8')
+    has_crd = np.array([w in event_crds for w in names], dtype=bool)
+    if has_crd.any():
+        ra, dec = np.array([event_crds[w] for w in names \
+                if w in event_crds]).T
+        pix[has_crd] = ang2pix_nest(nside, ra, dec)
+    shard = split_events(pix, n_shards)
+
+    manifest = OrderedDict([
+        ('input', input_file),
+        ('input_sha256', file_sha256(input_file)),
+        ('nside', nside),
+        ('pixel_area_deg2', pixel_area(nside)),
+        ('n_events', len(names)),
+        ('shards', list()),
+    ])
+
+    for i_shard in range(n_shards):
+        idx = np.flatnonzero(shard == i_shard)
+        events_i = [names[i] for i in idx]
+        pix_i = pix[idx][pix[idx] >= 0]
+        dir_i = os.path.join(shard_dir, shard_name(i_shard))
+        for subdir in [''] + shard_image_dirs:
+            if not os.path.isdir(os.path.join(dir_i, subdir)):
+                os.makedirs(os.path.join(dir_i, subdir))
+
+        dump_json(OrderedDict([(w, cand_events[w]) for w in events_i]),
+                os.path.join(dir_i, 'candidate-events.json'))
+        dump_json(OrderedDict([
+            ('shard', i_shard),
+            ('n_shards', n_shards),
+            ('nside', nside),
+            ('pixel_range', [int(pix_i.min()), int(pix_i.max())] \
+                    if pix_i.size else None),
+            ('n_pixels', int(np.unique(pix_i).size)),
+            ('input_sha256', manifest['input_sha256']),
+            ('events', events_i),
+            ('stages', OrderedDict()),
+        ]), os.path.join(dir_i, 'manifest.json'))
+
+        manifest['shards'].append(OrderedDict([
+            ('name', shard_name(i_shard)),
+            ('n_events', len(events_i)),
+            ('pixel_range', [int(pix_i.min()), int(pix_i.max())] \
+                    if pix_i.size else None),
+        ]))
+
+    dump_json(manifest, os.path.join(shard_dir, 'manifest.json'))
+    return manifest
+
+def run_shard(dir_i, stages, token=None):
+
+    '''
+    Run stages in a shard directory, one process per stage. The manifest
+    is updated after every stage. Stages already done are skipped.
+    `token` (Data Lab) is given to search-datalab in its environment.
+
+    Returns
+    -------
+    True if all stages are done.
+    '''
+
+    manifest_file = os.path.join(dir_i, 'manifest.json')
+    manifest = load_json(manifest_file)
+    if not manifest['events']:
+        return True
+
+    for stage_j in stages:
+        if manifest['stages'].get(stage_j, {}).get('status') == 'done':
+            continue
+        cmd_j = [sys.executable, os.path.join(scripts_dir,
+                shard_stages[stage_j][0])] + shard_stages[stage_j][1:]
+        env_j = dict(os.environ)
+        if token and (stage_j == 'search-datalab'):
+            env_j[stage('search-datalab').token_env] = token
+        t_start = time.time()
+        with open(os.path.join(dir_i, 'log-%s.txt' % stage_j), 'wb') as log:
+            proc = subprocess.run(cmd_j, cwd=dir_i, stdout=log,
+                    stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                    env=env_j)
+        manifest['stages'][stage_j] = OrderedDict([
+            ('status', 'done' if proc.returncode == 0 else 'failed'),
+            ('returncode', proc.returncode),
+            ('host', os.uname()[1]),
+            ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('wall_s', time.time() - t_start),
+        ])
+        dump_json(manifest, manifest_file)
+        if proc.returncode:
+            return False
+    return True
+
+def verify(shard_dir, input_file, stages=None):
+
+    '''
+    Check that every event was processed exactly once, and that all
+    `stages` are done in every shard (default: all stages recorded in any
+    shard manifest, done or failed).
+
+    Returns
+    -------
+    errors : list of str
+        Empty if all checks passed.
+
+    shard_events : OrderedDict
+        Event -> shard directory.
+    '''
+
+    errors = list()
+    manifest = load_json(os.path.join(shard_dir, 'manifest.json'))
+    if file_sha256(input_file) != manifest['input_sha256']:
+        errors.append('%s changed since the split.' % input_file)
+    cand_events = load_json(input_file)
+
+    # every event in exactly one shard.
+    shard_events, stages_done, stages_seen = OrderedDict(), dict(), set()
+    for shard_i in manifest['shards']:
+        dir_i = os.path.join(shard_dir, shard_i['name'])
+        manifest_i = load_json(os.path.join(dir_i, 'manifest.json'))
+        for event_j in manifest_i['events']:
+            if event_j in shard_events:
+                errors.append('%s is in %s and %s.' % (event_j,
+                        shard_events[event_j], shard_i['name']))
+            shard_events[event_j] = dir_i
+        if list(load_json(os.path.join(dir_i,
+                'candidate-events.json')).keys()) != manifest_i['events']:
+            errors.append('%s: events differ from the manifest.' \
+                    % shard_i['name'])
+        if manifest_i['events']:
+            stages_done[shard_i['name']] = set([k for k, v in \
+                    manifest_i['stages'].items() if v['status'] == 'done'])
+            stages_seen.update(manifest_i['stages'].keys())
+            failed_i = [k for k, v in manifest_i['stages'].items() \
+                    if v['status'] == 'failed']
+            if failed_i: # also listed as not done below, if expected.
+                errors.append('%s: failed: %s' % (shard_i['name'],
+                        ', '.join(failed_i)))
+
+    missing = [w for w in cand_events if w not in shard_events]
+    extra = [w for w in shard_events if w not in cand_events]
+    if missing:
+        errors.append('Events in no shard: %d (%s ...)' % (len(missing),
+                ', '.join(missing[:5])))
+    if extra:
+        errors.append('Events not in %s: %d (%s ...)' % (input_file,
+                len(extra), ', '.join(extra[:5])))
+
+    # all shards done.
+    stages = stages or sorted(stages_seen)
+    for name_i, done_i in stages_done.items():
+        not_done = [w for w in stages if w not in done_i]
+        if not_done:
+            errors.append('%s: not done: %s' % (name_i, ', '.join(not_done)))
+
+    # outputs: only events of the shard, all of them if expected.
+    for name_i in stages_done:
+        dir_i = os.path.join(shard_dir, name_i)
+        events_i = set(load_json(os.path.join(dir_i,
+                'manifest.json'))['events'])
+        for file_j, (complete_j, _) in shard_outputs.items():
+            if not os.path.isfile(os.path.join(dir_i, file_j)):
+                continue
+            keys_j = set(load_json(os.path.join(dir_i, file_j)).keys())
+            if keys_j - events_i:
+                errors.append('%s/%s: %d events of other shards.' \
+                        % (name_i, file_j, len(keys_j - events_i)))
+            if complete_j and (events_i - keys_j):
+                errors.append('%s/%s: %d events missing.' \
+                        % (name_i, file_j, len(events_i - keys_j)))
+
+    return errors, shard_events
+
+def copy_if_newer(src, desti):
+    ''' Copy a file unless `desti` has the same size and time. '''
+    if os.path.isfile(desti):
+        st_src, st_desti = os.stat(src), os.stat(desti)
+        if st_src.st_size == st_desti.st_size \
+                and int(st_src.st_mtime) == int(st_desti.st_mtime):
+            return False
+    shutil.copy2(src, desti)
+    return True
+
+def merge(shard_dir, input_file, shard_events):
+
+    ''' Merge outputs of shards, in the order of `input_file`. '''
+
+    cand_events = load_json(input_file)
+    for file_i, (_, pretty_i) in shard_outputs.items():
+        shard_data, found = dict(), False
+        merged = OrderedDict()
+        for event_j in cand_events:
+            dir_j = shard_events[event_j]
+            if dir_j not in shard_data:
+                shard_data[dir_j] = load_json(os.path.join(dir_j, file_i),
+                        missing_ok=True)
+                found |= os.path.isfile(os.path.join(dir_j, file_i))
+            if event_j in shard_data[dir_j]:
+                merged[event_j] = shard_data[dir_j][event_j]
+        if found:
+            dump_json(merged, file_i, pretty=pretty_i)
+            print('%-28s %d events' % (file_i, len(merged)))
+
+    # image files, at the same relative paths.
+    N_copied = 0
+    for dir_i in sorted(set(shard_events.values())):
+        for subdir_j in shard_image_dirs:
+            src_dir = os.path.join(dir_i, subdir_j)
+            if not os.path.isdir(src_dir):
+                continue
+            if not os.path.isdir(subdir_j):
+                os.makedirs(subdir_j)
+            for file_k in sorted(os.listdir(src_dir)):
+                N_copied += copy_if_newer(os.path.join(src_dir, file_k),
+                        os.path.join(subdir_j, file_k))
+    print('Image files copied:', N_copied)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['split', 'run', 'verify', 'merge'])
+    parser.add_argument('--shards', type=int, default=4,
+            help='Number of shards (split).')
+    parser.add_argument('--nside', type=int, default=32,
+            help='HEALPix resolution of the partition (split).')
+    parser.add_argument('--shard', type=int, action='append',
+            help='Shard to run (default: all).')
+    parser.add_argument('--processes', type=int, default=1,
+            help='Shards run at the same time, as local processes.')
+    parser.add_argument('--stages', nargs='+', choices=list(shard_stages),
+            default=list(shard_stages))
+    parser.add_argument('--shard-dir', default='./shards/')
+    parser.add_argument('--input', default='candidate-events.json')
+    args = parser.parse_args()
+
+    if args.mode == 'split':
+        manifest = split(load_json(args.input), args.shards, args.nside,
+                args.shard_dir, args.input)
+        for shard_i in manifest['shards']:
+            print('{:12} {:8d} events, pixels {}'.format(shard_i['name'],
+                    shard_i['n_events'], shard_i['pixel_range']))
+
+    if args.mode == 'run':
+        manifest = load_json(os.path.join(args.shard_dir, 'manifest.json'))
+        names = [w['name'] for w in manifest['shards']]
+        if args.shard:
+            names = [shard_name(w) for w in args.shard]
+
+        # log in once, for all shards.
+        token = stage('search-datalab').login() \
+                if 'search-datalab' in args.stages else None
+
+        def _run(name_i):
+            return name_i, run_shard(os.path.join(args.shard_dir, name_i),
+                    args.stages, token=token)
+        with ThreadPoolExecutor(args.processes) as pool:
+            for name_i, done_i in pool.map(_run, names):
+                print('{:12} {}'.format(name_i, 'done' if done_i else \
+                        'failed, see logs in the shard directory'))
+
+    if args.mode in ('verify', 'merge'):
+        errors, shard_events = verify(args.shard_dir, args.input,
+                stages=args.stages)
+        for err_i in errors:
+            print('Error:', err_i)
+        if errors:
+            sys.exit(1)
+        print('Verified: %d events, each in exactly one shard.' \
+                % len(shard_events))
+        if args.mode == 'merge':
+            merge(args.shard_dir, args.input, shard_events)
+
+# EOF
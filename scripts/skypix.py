@@ -0,0 +1,204 @@
+#!/usr/bin/python
+
+'''
+    HEALPix pixels in the NESTED scheme, vectorized with NumPy (without
+    healpy).
+
+    Pixels of the NESTED scheme are ordered along a space-filling curve:
+    nearby positions have nearby pixel numbers, and a pixel at `nside` is
+    the parent of pixels `4 * ipix ... 4 * ipix + 3` at `2 * nside`. A range
+    of pixel numbers is therefore a compact patch of sky.
+
+    Usage: python skypix.py test
+'''
+
+import sys
+
+import numpy as np
+
+# row and column of the 12 base pixels (faces).
+jrll = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+jpll = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7])
+
+def nside_to_order(nside):
+    ''' log2(nside), nside must be a power of 2 (up to 2 ** 29). '''
+    order = int(nside).bit_length() - 1
+    if nside < 1 or (1 << order) != nside or order > 29:
+        raise ValueError('nside must be a power of 2, up to 2 ** 29.')
+    return order
+
+def nside_to_npix(nside):
+    return 12 * nside * nside
+
+def npix_to_nside(npix):
+    nside = int(round(np.sqrt(npix / 12.)))
+    if nside_to_npix(nside) != npix:
+        raise ValueError('Invalid number of pixels.')
+    nside_to_order(nside)
+    return nside
+
+def pixel_area(nside):
+    ''' Area of one pixel in square degrees. '''
+    return 4. * np.pi * (180. / np.pi) ** 2 / nside_to_npix(nside)
+
+def spread_bits(v, order):
+    ''' Bits of `v` into the even bits of the result. '''
+    rv = np.zeros_like(v)
+    for i_bit in range(order):
+        rv |= ((v >> i_bit) & 1) << (2 * i_bit)
+    return rv
+
+def compress_bits(v, order):
+    ''' Even bits of `v` into the result. '''
+    rv = np.zeros_like(v)
+    for i_bit in range(order):
+        rv |= ((v >> (2 * i_bit)) & 1) << i_bit
+    return rv
+
+def ang2pix_nest(nside, ra, dec):
+
+    '''
+    HEALPix pixels (NESTED) of positions.
+
+    Parameters
+    ----------
+    nside : int
+        Resolution, a power of 2.
+
+    ra, dec : float or array
+        Coordinates in degrees.
+
+    Returns
+    -------
+    ipix : int64 array (or int, for scalar input)
+    '''
+
+    order = nside_to_order(nside)
+    scalar = np.ndim(ra) == 0 and np.ndim(dec) == 0
+    ra, dec = np.broadcast_arrays(np.atleast_1d(np.asarray(ra, 'f8')),
+            np.atleast_1d(np.asarray(dec, 'f8')))
+
+    z = np.sin(np.radians(dec))
+    za = np.abs(z)
+    tt = np.mod(ra, 360.) / 90. # in [0, 4)
+    tt = np.where(tt >= 4., 0., tt)
+
+    face = np.zeros(ra.shape, dtype='i8')
+    ix, iy = np.zeros_like(face), np.zeros_like(face)
+
+    # equatorial region
+    eq = za <= 2. / 3.
+    temp1 = nside * (0.5 + tt[eq])
+    temp2 = nside * (0.75 * z[eq])
+    jp = np.floor(temp1 - temp2).astype('i8') # ascending edge line
+    jm = np.floor(temp1 + temp2).astype('i8') # descending edge line
+    ifp, ifm = jp >> order, jm >> order
+    face[eq] = np.where(ifp == ifm, ifp | 4,
+            np.where(ifp < ifm, ifp, ifm + 8))
+    ix[eq] = jm & (nside - 1)
+    iy[eq] = nside - (jp & (nside - 1)) - 1
+
+    # polar caps
+    pl = ~eq
+    ntt = np.minimum(np.floor(tt[pl]).astype('i8'), 3)
+    tp = tt[pl] - ntt
+    tmp = nside * np.sqrt(3. * (1. - za[pl]))
+    jp = np.minimum(np.floor(tp * tmp).astype('i8'), nside - 1)
+    jm = np.minimum(np.floor((1. - tp) * tmp).astype('i8'), nside - 1)
+    north = z[pl] >= 0.
+    face[pl] = np.where(north, ntt, ntt + 8)
+    ix[pl] = np.where(north, nside - jm - 1, jp)
+    iy[pl] = np.where(north, nside - jp - 1, jm)
+
+    ipix = (face << (2 * order)) + spread_bits(ix, order) \
+            + (spread_bits(iy, order) << 1)
+    return int(ipix[0]) if scalar else ipix
+
+def pix2ang_nest(nside, ipix):
+
+    '''
+    Centers of HEALPix pixels (NESTED).
+
+    Returns
+    -------
+    ra, dec : float arrays, in degrees.
+    '''
+
+    order = nside_to_order(nside)
+    ipix = np.atleast_1d(np.asarray(ipix, dtype='i8'))
+    npface = nside * nside
+    if np.any((ipix < 0) | (ipix >= 12 * npface)):
+        raise ValueError('Pixel number out of range.')
+    fact2 = 4. / nside_to_npix(nside)
+    fact1 = 2. * nside * fact2
+
+    face = ipix >> (2 * order)
+    ipf = ipix & (npface - 1)
+    ix, iy = compress_bits(ipf, order), compress_bits(ipf >> 1, order)
+    jr = (jrll[face] << order) - ix - iy - 1
+
+    nr = np.where(jr < nside, jr, np.where(jr > 3 * nside,
+            4 * nside - jr, nside))
+    z = np.where(jr < nside, 1. - nr * nr * fact2,
+            np.where(jr > 3 * nside, nr * nr * fact2 - 1.,
+            (2 * nside - jr) * fact1))
+    kshift = np.where((jr >= nside) & (jr <= 3 * nside),
+            (jr - nside) & 1, 0)
+
+    jp = (jpll[face] * nr + ix - iy + 1 + kshift) // 2
+    jp = np.where(jp > 4 * nside, jp - 4 * nside, jp)
+    jp = np.where(jp < 1, jp + 4 * nside, jp)
+    phi = (jp - (kshift + 1) * 0.5) * (90. / nr)
+
+    return phi, np.degrees(np.arcsin(np.clip(z, -1., 1.)))
+
+def parent(ipix, nside, nside_parent):
+    ''' Pixels at a lower resolution (NESTED) containing `ipix`. '''
+    shift = 2 * (nside_to_order(nside) - nside_to_order(nside_parent))
+    if shift < 0:
+        raise ValueError('`nside_parent` must not exceed `nside`.')
+    return np.asarray(ipix, dtype='i8') >> shift
+
+if (__name__ == '__main__') and ('test' in sys.argv):
+
+    rng = np.random.RandomState(42)
+    N = 200000
+    ra = rng.uniform(0., 360., N)
+    dec = np.degrees(np.arcsin(rng.uniform(-1., 1., N)))
+
+    # base pixels.
+    assert ang2pix_nest(1, 0., 0.) == 4
+    assert ang2pix_nest(1, 45., 90.) == 0
+    assert ang2pix_nest(1, 45., -90.) == 8
+
+    for nside in [1, 2, 16, 256, 2 ** 20]:
+
+        ipix = ang2pix_nest(nside, ra, dec)
+        assert ipix.min() >= 0 and ipix.max() < nside_to_npix(nside)
+
+        # centers are in their own pixels.
+        pix = np.unique(ipix)[:5000]
+        assert np.all(ang2pix_nest(nside, *pix2ang_nest(nside, pix)) == pix)
+
+        # hierarchy.
+        if nside >= 16:
+            assert np.all(parent(ipix, nside, 16) == ang2pix_nest(16, ra, dec))
+
+        # equal area.
+        if nside <= 16:
+            counts = np.bincount(ipix, minlength=nside_to_npix(nside))
+            expected = N / float(nside_to_npix(nside))
+            chi2 = np.sum((counts - expected) ** 2 / expected) / counts.size
+            assert chi2 < 1.5, (nside, chi2)
+
+        # same as healpy, if installed.
+        try:
+            import healpy as hp
+        except ImportError:
+            continue
+        assert np.all(ipix == hp.ang2pix(nside, ra, dec, nest=True,
+                lonlat=True))
+
+    print('OK')
+
+# EOF
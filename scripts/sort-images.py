@@ -2,12 +2,26 @@
 
 '''
     Sort image stamps per the results of visual inspection.
+
+    Modes (`--mode`):
+        copy:     copy stamps into flag folders (default).
+        hardlink: hard links instead of copies (falls back to copy across
+                  file systems).
+        symlink:  symbolic links to the stamps.
+        manifest: only write a list of stamps per flag (`stamps-vis.txt`...)
+
+    Reruns are incremental: up-to-date files are not touched, and files
+    sorted by an earlier run whose flag has been removed are deleted. Sorted
+    files are recorded in `sorted-stamps.json`.
 '''
 
 import os, sys
-import json
 import glob, shutil
+import argparse
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from jsonio import load_json, dump_json
 
 desti_dirs = dict(
     c='./stamps-clsby/',
@@ -17,11 +31,68 @@ desti_dirs = dict(
     f='./stamps-fav/'
 )
 
+def is_up_to_date(src, desti, mode):
+    ''' True if `desti` is already the sorted copy/link of `src`. '''
+    if not os.path.lexists(desti):
+        return False
+    if mode == 'symlink':
+        return os.path.islink(desti) \
+                and os.readlink(desti) == os.path.abspath(src)
+    if os.path.islink(desti):
+        return False
+    st_src, st_desti = os.stat(src), os.stat(desti)
+    if mode == 'hardlink' and (st_src.st_dev == st_desti.st_dev):
+        # copies (e.g., from 'copy' mode) are re-linked.
+        return os.path.samestat(st_src, st_desti)
+    return (st_src.st_size == st_desti.st_size) \
+            and (int(st_src.st_mtime) == int(st_desti.st_mtime))
+
+def sort_file(src, desti, mode):
+
+    '''
+    Copy or link a stamp into a flag folder.
+
+    Returns
+    -------
+    True if the file was (re-)written, False if up to date.
+    '''
+
+    if is_up_to_date(src, desti, mode):
+        return False
+    if os.path.lexists(desti):
+        os.remove(desti)
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src), desti)
+    elif mode == 'hardlink':
+        try:
+            os.link(src, desti)
+        except OSError: # e.g., across file systems.
+            shutil.copy2(src, desti)
+    else:
+        shutil.copy2(src, desti)
+    return True
+
+def write_if_changed(filename, content):
+    ''' Write a text file only if the content has changed. '''
+    if os.path.isfile(filename):
+        with open(filename, 'r') as fp:
+            if fp.read() == content:
+                return False
+    with open(filename + '.tmp', 'w') as fp:
+        fp.write(content)
+    os.replace(filename + '.tmp', filename)
+    return True
+
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='copy',
+            choices=['copy', 'hardlink', 'symlink', 'manifest'])
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
     # read saved images.
-    with open('./annotated-images.json', 'r') as fp:
-        annotated_images = json.load(fp, object_pairs_hook=OrderedDict)
+    annotated_images = load_json('./annotated-images.json')
 
     # create a flattened list of images.
     image_stamps = list()
@@ -30,14 +101,51 @@ if __name__ == '__main__':
             if imfile_j: # skip null
                 image_stamps.append((event_i, imsrc_j, imfile_j))
 
-    with open('./visual-inspection.json', 'r') as fp:
-        inspection = json.load(fp, object_pairs_hook=OrderedDict)
+    inspection = load_json('./visual-inspection.json')
 
+    # (source, destination) of sorted stamps, per flag.
+    sorted_files = OrderedDict([(w, list()) for w in desti_dirs])
     for event_i, images_i in inspection.items():
         for imsrc_j, iminsp_j in images_i.items():
             imfile_j = annotated_images[event_i][imsrc_j]
             for flag_k, desti_k in desti_dirs.items():
                 if flag_k in iminsp_j:
-                    shutil.copy2(imfile_j, desti_k)
+                    sorted_files[flag_k].append((imfile_j, os.path.join( \
+                            desti_k, os.path.basename(imfile_j))))
+
+    # manifests only.
+    if args.mode == 'manifest':
+        for flag_k, files_k in sorted_files.items():
+            manifest_k = desti_dirs[flag_k].rstrip('/') + '.txt'
+            if write_if_changed(manifest_k,
+                    ''.join([w[0] + '\n' for w in files_k])):
+                print('Updated', manifest_k, len(files_k))
+        sys.exit(0)
+
+    # files from the previous run.
+    sorted_prev = load_json('./sorted-stamps.json', missing_ok=True)
+
+    for desti_k in desti_dirs.values():
+        if not os.path.isdir(desti_k):
+            os.makedirs(desti_k)
+
+    # remove stale files.
+    sorted_now = OrderedDict([(w[1], w[0]) \
+            for files_k in sorted_files.values() for w in files_k])
+    N_removed = 0
+    for desti_i in sorted_prev:
+        if (desti_i not in sorted_now) and os.path.lexists(desti_i):
+            os.remove(desti_i)
+            N_removed += 1
+
+    # copy or link.
+    with ThreadPoolExecutor(args.threads) as pool:
+        N_written = sum(pool.map(lambda w: sort_file(w[1], w[0], args.mode),
+                sorted_now.items()))
+
+    dump_json(sorted_now, './sorted-stamps.json')
+
+    print('Sorted:', len(sorted_now), 'Written:', N_written,
+          'Removed:', N_removed)
 
 #.
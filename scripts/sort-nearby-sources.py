@@ -9,38 +9,19 @@
 
 import os
 import sys
-import json
 import glob
+import argparse
 from collections import OrderedDict, namedtuple
 import itertools as itt
 
 from tqdm import tqdm
 
 import numpy as np
-from astropy.coordinates import SkyCoord
-from astropy.cosmology import WMAP9 as cosmo
-
-from scipy.sparse import csr_matrix
-from scipy.sparse.csgraph import connected_components
-
-import matplotlib.pyplot as plt
 
+import profiling
 from catalogs import *
-
-# encoder for numpy types from: https://github.com/mpld3/mpld3/issues/434
-class npEncoder(json.JSONEncoder):
-    """ Special json encoder for np types """
-    def default(self, obj):
-        if isinstance(obj, (np.int_, np.intc, np.intp, np.int8,
-            np.int16, np.int32, np.int64, np.uint8,
-            np.uint16,np.uint32, np.uint64)):
-            return int(obj)
-        elif isinstance(obj, (np.float_, np.float16, np.float32,
-            np.float64)):
-            return float(obj)
-        elif isinstance(obj,(np.ndarray,)):
-            return obj.tolist()
-        return json.JSONEncoder.default(self, obj)
+from coords import event_coords, parse_sexagesimal, ang_sep
+from jsonio import load_json, dump_json, open_events, JsonlStore
 
 def simple_match(ra_c, dec_c, srcs, dist_tol=2.):
 
@@ -66,6 +47,9 @@ def simple_match(ra_c, dec_c, srcs, dist_tol=2.):
         of this matched object.
     '''
 
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+
     # convert into delta-arcseconds
     cos_d = np.cos(dec_c * np.pi / 180.)
     dasec = lambda w: ((w[2] - ra_c) * 3.6e3 * cos_d, (w[3] - dec_c) * 3.6e3)
@@ -96,34 +80,55 @@ def parse_datalab_csv(tab):
     tab = [(str(r[0]), float(r[1]), float(r[2])) for r in tab if len(r) == 3]
     return tab
 
-if __name__ == '__main__':
+def sort_sources(cand_events, cand_hosts_v, cand_hosts_dl, nearest_src=None):
 
-    # read list of event candidates.
-    with open('candidate-events.json', 'r') as fp:
-        cand_events = json.load(fp, object_pairs_hook=OrderedDict)
+    '''
+    Nearby sources of events from Vizier and Data Lab, with separations,
+    projected distances and cross-match groups.
+
+    Parameters
+    ----------
+    cand_events : dict
+        Candidate events (candidate-events.json).
+
+    cand_hosts_v, cand_hosts_dl : dict
+        Search results of Vizier (candidate-hosts.json) and Data Lab
+        (candidate-hosts-dl.json), read one event at a time.
+
+    nearest_src : OrderedDict or jsonio.JsonlStore
+        Output of nearby sources (default: a new OrderedDict).
+
+    Returns
+    -------
+    nearest_src : OrderedDict
+        Event name -> list of sources (nearest-host-candidate.json).
 
-    # read list of possible hosts (vizier)
-    with open('candidate-hosts.json', 'r') as fp:
-        cand_hosts_v = json.load(fp, object_pairs_hook=OrderedDict)
+    survey_coverage : OrderedDict
+        Event name -> list of surveys with sources (survey-coverage.json).
+    '''
 
-    # read list of possible hosts (datalab)
-    with open('candidate-hosts-dl.json', 'r') as fp:
-        cand_hosts_dl = json.load(fp, object_pairs_hook=OrderedDict)
+    from astropy.cosmology import WMAP9 as cosmo
 
     # nearest source in any survey.
-    nearest_src, survey_coverage = OrderedDict(), OrderedDict()
+    if nearest_src is None:
+        nearest_src = OrderedDict()
+    survey_coverage = OrderedDict()
+
+    # coordinates of events in degrees.
+    event_crds = event_coords(cand_events)
 
     # for candidate events
-    for event_i, event_info_i in tqdm(cand_events.items(),
-                                      total=len(cand_events)):
+    for event_i, event_info_i in profiling.iter_events(tqdm( \
+            cand_events.items(), total=len(cand_events))):
 
         # nearby sources and dataset coverage for this event:
         srcs_i, coverage_i = list(), list()
 
-        # construct coord
-        crd_i = SkyCoord(ra=event_info_i['ra'],
-                         dec=event_info_i['dec'],
-                         unit=('hour', 'deg'))
+        # event coordinates,
+        if event_i not in event_crds:
+            nearest_src[event_i], survey_coverage[event_i] = list(), list()
+            continue
+        ra_i, dec_i = event_crds[event_i]
 
         # scale of projected distance
         kpc_per_asec_i = cosmo.kpc_proper_per_arcmin( \
@@ -132,18 +137,24 @@ if __name__ == '__main__':
         # for Vizier sources:
         tabs_i = cand_hosts_v[event_i]
         for cat_j, tab_j in tabs_i.items():
-            if cat_j == 'search_radius':
+            if (cat_j == 'search_radius') or (not tab_j):
                 continue
             ra_colid_j, dec_colid_j = radec_cols[cat_j][0]
             radec_units_j = radec_cols[cat_j][1]
-            for rec_k in tab_j:
-                try:
-                    crd_k = SkyCoord(ra=rec_k[ra_colid_j],
-                                     dec=rec_k[dec_colid_j],
-                                     unit=radec_units_j)
-                except:
+
+            # coordinates and separations of the whole table.
+            ra_j, bad_ra_j = parse_sexagesimal([w[ra_colid_j] for w in tab_j],
+                                               unit=radec_units_j[0])
+            dec_j, bad_dec_j = parse_sexagesimal( \
+                    [w[dec_colid_j] for w in tab_j],
+                    unit=radec_units_j[1], max_value=90.)
+            ra_j = ra_j % 360.
+            sep_j = ang_sep(ra_i, dec_i, ra_j, dec_j) * 3.6e3
+
+            for rec_k, ra_k, dec_k, sep_k, bad_k in zip(tab_j,
+                    ra_j, dec_j, sep_j, bad_ra_j | bad_dec_j):
+                if bad_k:
                     continue # not my fault :)
-                sep_k = crd_i.separation(crd_k).arcsec
                 pm_k, pm_err_k, star_flag_k = None, None, 'NA'
                 if 'gaia' in cat_j: # for Gaia sources: find proper motion
                     if rec_k[7] is None or rec_k[7] is None:
@@ -156,7 +167,7 @@ if __name__ == '__main__':
                 srcs_i.append((
                     cat_names[cat_j],
                     str(rec_k[srcid_cols[cat_j]]),
-                    crd_k.ra.deg, crd_k.dec.deg,
+                    ra_k, dec_k,
                     pm_k, pm_err_k, star_flag_k,
                     sep_k,
                     sep_k * kpc_per_asec_i
@@ -166,11 +177,11 @@ if __name__ == '__main__':
         tabs_i = cand_hosts_dl[event_i]
         for cat_j, tab_j in tabs_i.items():
             tab_ps_j = parse_datalab_csv(tab_j)
-            for rec_k in tab_ps_j:
-                crd_k = SkyCoord(ra=rec_k[1],
-                                 dec=rec_k[2],
-                                 unit=('deg', 'deg'))
-                sep_k = crd_i.separation(crd_k).arcsec
+            if not tab_ps_j:
+                continue
+            sep_j = ang_sep(ra_i, dec_i, [w[1] for w in tab_ps_j],
+                            [w[2] for w in tab_ps_j]) * 3.6e3
+            for rec_k, sep_k in zip(tab_ps_j, sep_j):
                 srcs_i.append((
                     cat_j,
                     rec_k[0],
@@ -187,7 +198,7 @@ if __name__ == '__main__':
         # srcs_i = list(filter(lambda x: x[-1] < 50., srcs_i)) # within 50 kpc
         # srcs_i = sorted(srcs_i, key=lambda x: x[-1])
         # do NOT perform 50 proper kpc cut.
-        srcs_i = simple_match(crd_i.ra.deg, crd_i.dec.deg, srcs_i)
+        srcs_i = simple_match(ra_i, dec_i, srcs_i)
 
         # put into dict.
         if srcs_i:
@@ -198,10 +209,38 @@ if __name__ == '__main__':
         # save survey coverage.
         survey_coverage[event_i] = coverage_i
 
-    # save into file.
-    with open('nearest-host-candidate.json', 'w') as fp:
-        json.dump(nearest_src, fp, indent=4, cls=npEncoder,)
+    return nearest_src, survey_coverage
+
+if __name__ == '__main__':
+
+    profiling.enable()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stream', action='store_true',
+            help='Write nearest-host-candidate.jsonl, one event at a time.')
+    args = parser.parse_args()
+
+    # read list of event candidates.
+    cand_events = load_json('candidate-events.json')
+
+    # list of possible hosts (vizier, datalab), read on demand if stored
+    # as JSON Lines.
+    cand_hosts_v = open_events('candidate-hosts.json')
+    cand_hosts_dl = open_events('candidate-hosts-dl.json')
+
+    # one line per event, written at once.
+    if args.stream:
+        with JsonlStore('nearest-host-candidate.jsonl', mode='w') \
+                as nearest_src:
+            _, survey_coverage = sort_sources(cand_events,
+                    cand_hosts_v, cand_hosts_dl, nearest_src=nearest_src)
+
+    else:
+        nearest_src, survey_coverage = sort_sources(cand_events,
+                cand_hosts_v, cand_hosts_dl)
+
+        # save into file.
+        dump_json(nearest_src, 'nearest-host-candidate.json', pretty=False)
 
-    with open('survey-coverage.json', 'w') as fp:
-        json.dump(survey_coverage, fp, indent=4, cls=npEncoder,)
+    dump_json(survey_coverage, 'survey-coverage.json')
 # EOF
@@ -4,12 +4,21 @@
     Inspect image stamps.
 
     This is a quick-and-dirty mini-application.
+
+    Stamps are decoded and resized in a background thread, which prefetches
+    the next few stamps in the queue.
+
+    With an inspector ID (`python vis-inspect.py ab`), only the stamps
+    assigned to this inspector (`assign-stamps.py`) are shown, and results
+    are saved into `visual-inspection-ab.json`. Stamps flagged by
+    `prescreen-stamps.py` are skipped.
 '''
 
 import sys
 import os
-import json
 import random
+import threading
+import queue
 from collections import OrderedDict, deque, namedtuple
 
 from tkinter import *
@@ -18,56 +27,163 @@ from PIL import ImageTk, Image
 
 import numpy as np
 
+from overlays import draw_overlay
+from jsonio import load_json, dump_json
+
+# number of stamps to prefetch, and number of display images to keep.
+n_prefetch, cache_size = 8, 64
+
+class StampLoader(threading.Thread):
+
+    '''
+    Decode and resize stamps in background, keep the recent ones (LRU).
+
+    Parameters
+    ----------
+    size : tuple of int
+        Display size of stamps.
+
+    overlays : dict
+        Overlays to draw at display time, {event: {image source: overlay}}.
+
+    cache_size : int
+        Number of display images to keep.
+    '''
+
+    def __init__(self, size, overlays, cache_size=64):
+        threading.Thread.__init__(self, daemon=True)
+        self.size, self.overlays = size, overlays
+        self.cache, self.cache_size = OrderedDict(), cache_size
+        self.lock, self.requests = threading.Lock(), queue.Queue()
+        self.start()
+
+    def load(self, stamp):
+        ''' Decode, resize and draw overlay. '''
+        event_i, imsrc_i, imfile_i = stamp
+        image_i = Image.open(imfile_i).convert('RGB')
+        image_i = image_i.resize(self.size, Image.LANCZOS)
+        if imsrc_i in self.overlays.get(event_i, {}):
+            draw_overlay(image_i, self.overlays[event_i][imsrc_i])
+        return image_i
+
+    def put(self, stamp, image):
+        with self.lock:
+            self.cache[stamp] = image
+            self.cache.move_to_end(stamp)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def get(self, stamp):
+        ''' Display image of a stamp, load now if not prefetched. '''
+        with self.lock:
+            if stamp in self.cache:
+                self.cache.move_to_end(stamp)
+                return self.cache[stamp]
+        image = self.load(stamp)
+        self.put(stamp, image)
+        return image
+
+    def prefetch(self, stamps):
+        ''' Replace pending requests with these stamps. '''
+        try:
+            while True:
+                self.requests.get_nowait()
+        except queue.Empty:
+            pass
+        for stamp in stamps:
+            self.requests.put(stamp)
+
+    def run(self):
+        while True:
+            stamp = self.requests.get()
+            with self.lock:
+                if stamp in self.cache:
+                    continue
+            try:
+                self.put(stamp, self.load(stamp))
+            except Exception as err:
+                print('Failed to load', stamp[2], ':', err)
+
 if __name__ == '__main__':
 
     # read events.
-    with open('candidate-events.json', 'r') as fp:
-        cand_events = json.load(fp, object_pairs_hook=OrderedDict)
+    cand_events = load_json('candidate-events.json')
 
     # read saved images.
-    with open('./annotated-images.json', 'r') as fp:
-        annotated_images = json.load(fp, object_pairs_hook=OrderedDict)
+    annotated_images = load_json('./annotated-images.json')
 
     # create a flattened list of images.
-    image_stamps, i_current, i_sequence = list(), -1, list()
+    image_stamps, i_current, p_current, p_sequence = list(), -1, -1, list()
     for event_i, images_i in annotated_images.items():
         for imsrc_j, imfile_j in images_i.items():
             if imfile_j: # skip null
                 image_stamps.append((event_i, imsrc_j, imfile_j))
 
-    # shuffle
-    random.shuffle(image_stamps)
+    # inspector ID, and own shard of stamps.
+    inspector = sys.argv[1] if len(sys.argv) > 1 else None
+    if inspector:
+        assignments = load_json('./inspection-assignments.json')
+        prescreen = load_json('./prescreen-stats.json', missing_ok=True)
+        imfiles = {(w[0], w[1]): w[2] for w in image_stamps}
+        image_stamps = [(w[0], w[1], imfiles[tuple(w)]) \
+                for w in assignments['shards'][inspector] \
+                if (tuple(w) in imfiles) and (not prescreen.get(w[0], \
+                    {}).get(w[1], {}).get('auto'))]
+        result_file = './visual-inspection-%s.json' % (inspector,)
+    else:
+        random.shuffle(image_stamps) # shuffle
+        result_file = './visual-inspection.json'
+
+    # overlays drawn at display time (annotate-stamps.py --overlay-only)
+    stamp_overlays = load_json('./stamp-overlays.json', missing_ok=True)
 
     # read existing results.
-    if os.path.isfile('./visual-inspection.json'):
-        with open('./visual-inspection.json', 'r') as fp:
-            inspection = json.load(fp, object_pairs_hook=OrderedDict)
-    else:
-        inspection = OrderedDict()
+    inspection = load_json(result_file, missing_ok=True)
+
+    # index of uninspected stamps (positions in `image_stamps`)
+    i_pending = [i for i, (event_i, imsrc_i, imfile_i) \
+            in enumerate(image_stamps) \
+            if imsrc_i not in inspection.get(event_i, {})]
+    if not i_pending:
+        print('All images inspected.')
+        sys.exit(0)
+
+    def is_inspected(i_stamp):
+        event_i, imsrc_i, imfile_i = image_stamps[i_stamp]
+        return imsrc_i in inspection.get(event_i, {})
 
     # get next image.
-    def next_image(): # better into an iterator.
-        global i_current, i_sequence
-        i_sequence.append(i_current)
-        i_current += 1
-        while True: # fast-forward to the first uninspected image.
-            event_i, imsrc_i, imfile_i = image_stamps[i_current]
-            if event_i not in inspection: break
-            if imsrc_i not in inspection[event_i]: break
-            i_current += 1
-        if image_stamps:
-            return image_stamps[i_current]
-        else:
+    def next_image():
+        global i_current, p_current, p_sequence
+        p_next = p_current + 1
+        while (p_next < len(i_pending)) and is_inspected(i_pending[p_next]):
+            p_next += 1 # skip images inspected in this session.
+        if p_next >= len(i_pending): # end of list, stay here.
+            print('No more images.')
             return None, None, None
+        p_sequence.append(p_current)
+        p_current, i_current = p_next, i_pending[p_next]
+        loader.prefetch([image_stamps[i] \
+                for i in i_pending[p_current + 1:p_current + 1 + n_prefetch]])
+        return image_stamps[i_current]
 
-    # get next image.
+    # get previous image.
     def prev_image():
-        global i_current, i_sequence
-        if i_current == 0: # first image, do nothing.
+        global i_current, p_current, p_sequence
+        if (not p_sequence) or (p_sequence[-1] < 0): # first image.
             return image_stamps[i_current]
-        i_current = i_sequence.pop() # or step back
+        p_current = p_sequence.pop() # or step back
+        i_current = i_pending[p_current]
         return image_stamps[i_current]
 
+    # display size, from the first image.
+    basewidth = 800
+    image_i = Image.open(image_stamps[i_pending[0]][2])
+    wpercent = (basewidth / float(image_i.size[0]))
+    hsize = int((float(image_i.size[1]) * float(wpercent)))
+    loader = StampLoader((basewidth, hsize), stamp_overlays,
+            cache_size=cache_size)
+
     # before showing images: ff to the next image.
     event_i, imsrc_i, imfile_i = next_image()
     print(i_current, event_i, imsrc_i, imfile_i)
@@ -76,34 +192,29 @@ if __name__ == '__main__':
     root = Tk()
     root.geometry('800x800')
 
-    basewidth = 800
     canvas = Canvas(root, height=basewidth, width=basewidth)
-    image_i = Image.open(imfile_i)
-    wpercent = (basewidth / float(image_i.size[0]))
-    hsize = int((float(image_i.size[1]) * float(wpercent)))
-    image_i = image_i.resize((basewidth, hsize), PIL.Image.ANTIALIAS)
-    photo_i = ImageTk.PhotoImage(image_i)
-    canvas_image = canvas.create_image(400, 400, image=photo_i)
     canvas.pack(side=TOP, expand=True, fill=BOTH)
 
-    def render(imfile_i):
-        image_i = Image.open(imfile_i)
-        image_i = image_i.resize((basewidth, hsize), PIL.Image.ANTIALIAS)
+    def render(event_i, imsrc_i, imfile_i):
+        image_i = loader.get((event_i, imsrc_i, imfile_i))
         canvas.img = ImageTk.PhotoImage(image_i)
         canvas.create_image(400, 400, image=canvas.img)
 
+    render(event_i, imsrc_i, imfile_i)
+
     def prev_key(event):
         canvas.delete('all')
         event_i, imsrc_i, imfile_i = prev_image()
         print(i_current, event_i, imsrc_i, imfile_i)
-        render(imfile_i)
+        render(event_i, imsrc_i, imfile_i)
 
     def next_key(event):
-        canvas.delete('all')
         event_i, imsrc_i, imfile_i = next_image()
+        if not imfile_i: # end of list, keep the current one.
+            return
+        canvas.delete('all')
         print(i_current, event_i, imsrc_i, imfile_i)
-        if imfile_i:
-            render(imfile_i)
+        render(event_i, imsrc_i, imfile_i)
 
     def mark_as_lowquality(event): # mark host as bad quality.
         event_i, imsrc_i, imfile_i = image_stamps[i_current]
@@ -192,8 +303,7 @@ if __name__ == '__main__':
         next_key(event)
 
     def save_progress(event): # mark host asbad quality.
-        with open('./visual-inspection.json', 'w') as fp:
-            json.dump(inspection, fp, indent=4)
+        dump_json(inspection, result_file)
         print('File saved.')
 
     root.bind('<Left>', prev_key)
@@ -213,5 +323,4 @@ if __name__ == '__main__':
         pass
 
     # save again upon exit.
-    with open('./visual-inspection.json', 'w') as fp:
-        json.dump(inspection, fp, indent=4)
+    dump_json(inspection, result_file)